@@ -0,0 +1,126 @@
+# The fields the LLM extracts from a comment, and the prompts that ask for them
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class Comment(BaseModel):
+    ai_first_name: Optional[str] = Field(default=None, description="The commenter's first name")
+    ai_middle_name: Optional[str] = Field(default=None, description="The commenter's middle name or initial")
+    ai_last_name: Optional[str] = Field(default=None, description="The commenter's last name")
+    ai_email: Optional[str] = Field(default=None, description="The commenter's email address, if mentioned")
+    ai_phone: Optional[str] = Field(default=None, description="The commenter's phone number, if mentioned")
+    ai_address: Optional[str] = Field(default=None, description="Mailing address of the commenter")
+    ai_city: Optional[str] = Field(default=None, description="City of the commenter")
+    ai_state: Optional[str] = Field(
+        default=None,
+        description="State of the commenter e.g. MA for Massachusetts, MD for Maryland or PA for Pennsylvania.",
+    )
+    ai_zip: Optional[str] = Field(default=None, description="Zipcode of the commenter")
+    ai_country: Optional[str] = Field(default=None, description="Country of the commenter")
+    ai_job_title: Optional[str] = Field(default=None, description="Job title of the commenter")
+    ai_org: Optional[str] = Field(default=None, description="Organization of the commenter")
+    # ValidLength(min=5) in the notebooks
+    ai_summary: str = Field(
+        min_length=5, description="A short two sentence summary of main points of the comment"
+    )
+
+
+# The columns of comment_enrichment after comment_id and model, in order
+AI_FIELDS = tuple(Comment.model_fields)
+
+SYSTEM_PROMPT: str = """
+Read the following public comment on a federal regulation and extract ALL of the relevant information,
+including the commenter's first name, middle name, last name, email adress, phone number, address, city,
+state, zipcode, country, job title, affiliated organization, and a short 2 sentences long summary of what the
+commenter is saying. The summary cannot be empty or the string 'None'. If any of the information can't be derived,
+you must return null and nothing else.
+
+Example output format 1:
+'{"ai_first_name": "Mary",
+"ai_middle_name": "C.",
+"ai_last_name": "Smith",
+"ai_email": "msmith@gmail.com",
+"ai_phone": "913-593-4889",
+"ai_address": "1604 Grand Ave.",
+"ai_city": "St. Paul",
+"ai_state": "MN",
+"ai_zip": "55105",
+"ai_country": "United States",
+"ai_job_title": "High school teacher",
+"ai_org": "Seattle Public Schools",
+"ai_summary": "The proposed regulation will help protect the environment and help keep the air clean for her five children. The administration must make an effort to pass this as soon as possible."}'
+
+Example output format 2:
+'{"ai_first_name": "David",
+"ai_middle_name": "James",
+"ai_last_name": "Roberts",
+"ai_email": "david_roberts@hotmail.com",
+"ai_phone": null,
+"ai_address": null,
+"ai_city": "Sioux Falls",
+"ai_state": "SD",
+"ai_zip": null,
+"ai_country": "United States",
+"ai_job_title": "Mechanic",
+"ai_org": null,
+"ai_summary": "This regulation will hurt small businesses and make it harder for people to get to work. The administration should not pass this regulation."}'
+
+Example output format 3:
+'{"ai_first_name": "Hanna",
+"ai_middle_name": null,
+"ai_last_name": "Chen",
+"ai_email": "bdfarms@aol.com",
+"ai_phone": "785-551-2009",
+"ai_address": "490 Del Matro Ave.",
+"ai_city": "Windsor Heights",
+"ai_state": "IA",
+"ai_zip": "50324",
+"ai_country": "United States",
+"ai_job_title": "Organizer",
+"ai_org": "Natural Resources Defense Council",
+"ai_summary": "The commenter expresses their love for the state and the environment. They say their family will continue to live in the state."}'
+
+Do not use the examples provided in the prompt to fill in the fields.
+"""
+
+SINGLE_SUFFIX: str = """
+Return only the JSON object for the comment below, with exactly these keys: {fields}.
+"""
+
+# Several comments in one request. Every comment is extracted on its own, and the answers
+# come back under their id so that a missing or broken one can be asked again
+PACKED_SUFFIX: str = """
+The message below contains {count} separate comments, each between <comment id="..."> and </comment>.
+Extract the information of every comment on its own, never mixing information between comments.
+Return only a JSON object of the form {{"comments": [{{"id": "<id>", ...}}, ...]}} with one entry per
+comment, where every entry has the id of its comment and exactly these keys: {fields}.
+"""
+
+
+def single_prompt(text, error=None):
+    """Return the (system, user) prompt that asks for the fields of one comment.
+
+    `error` is what was wrong with the last answer for the comment, if it was
+    asked before.
+    """
+    system = SYSTEM_PROMPT + SINGLE_SUFFIX.format(fields=", ".join(AI_FIELDS))
+    user = f"Comment: {text}"
+    if error:
+        user = f"Your last answer for this comment was not valid: {error}. Correct it.\n\n{user}"
+    return system, user
+
+
+def packed_prompt(texts, errors=None):
+    """Return the (system, user) prompt for several comments, whose ids are their positions.
+
+    `errors` has what was wrong with the last answer for each comment, or
+    None for the ones that weren't asked before.
+    """
+    system = SYSTEM_PROMPT + PACKED_SUFFIX.format(count=len(texts), fields=", ".join(AI_FIELDS))
+    user = "\n\n".join(f'<comment id="{index}">\n{text}\n</comment>' for index, text in enumerate(texts))
+    reasks = [f"- comment {index}: {error}" for index, error in enumerate(errors or ()) if error]
+    if reasks:
+        header = "Your last answers for these comments were not valid. Correct them.\n"
+        user = header + "\n".join(reasks) + "\n\n" + user
+    return system, user
@@ -0,0 +1,196 @@
+# Scrape a range of days with several workers at once
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import boto3
+import pytz
+from botocore.config import Config
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.bulk_load import connect
+from jobs.historical_scrape.key_pool import HISTORICAL_KEYS, KeyPool
+from jobs.historical_scrape.near_duplicates import create_tables
+from jobs.historical_scrape.pipeline import run_pipeline
+from jobs.historical_scrape.s3_archiver import UPLOAD_WORKERS
+from jobs.historical_scrape.sql import (
+    CLAIM_LEASE_STMT,
+    CREATE_LEASES_STMT,
+    INSERT_STATUS_STMT,
+    RELEASE_LEASE_STMT,
+    RENEW_LEASE_STMT,
+)
+
+BUCKET_NAME: str = "commons-docs"
+WORKERS: int = 3
+# How long a claimed day stays leased without being renewed. A worker renews its lease
+# every third of that, so a day is only picked up again when its worker has died
+LEASE_SECONDS: int = 15 * 60
+
+
+def split_keys(names, workers):
+    """Deal the API keys out to the workers, so no two workers share a key."""
+    if len(names) < workers:
+        raise ValueError(f"Can't split {len(names)} API keys between {workers} workers")
+    return [names[i::workers] for i in range(workers)]
+
+
+def days_between(start, end):
+    """Return the days from `end` back to `start`, newest first like run.py."""
+    start = datetime.strptime(start, "%Y-%m-%d")
+    end = datetime.strptime(end, "%Y-%m-%d")
+    days = []
+    while end >= start:
+        days.append(end.strftime("%Y-%m-%d"))
+        end -= timedelta(days=1)
+    return days
+
+
+def claim(conn, data_date, worker):
+    """Take the lease on `data_date`. Returns False if the day is done or leased by someone else."""
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            CLAIM_LEASE_STMT,
+            {"data_date": data_date, "worker": worker, "seconds": LEASE_SECONDS},
+        )
+        return cur.fetchone() is not None
+
+
+def release(conn, data_date, worker):
+    with conn, conn.cursor() as cur:
+        cur.execute(RELEASE_LEASE_STMT, {"data_date": data_date, "worker": worker})
+
+
+def _keep_leased(data_date, worker, stop):
+    # Runs in a thread with its own connection while the day is being scraped
+    conn = connect()
+    try:
+        while not stop.wait(LEASE_SECONDS / 3):
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    RENEW_LEASE_STMT,
+                    {"data_date": data_date, "worker": worker, "seconds": LEASE_SECONDS},
+                )
+    except Exception as e:
+        logging.error(f"Could not renew the lease on {data_date}: {e}")
+    finally:
+        conn.close()
+
+
+def scrape_day(conn, data_date, worker, s3_client, key_pool, max_workers):
+    """Scrape one claimed day, then write its status row and drop the lease in one transaction."""
+    stop = threading.Event()
+    renewer = threading.Thread(target=_keep_leased, args=(data_date, worker, stop), daemon=True)
+    renewer.start()
+    try:
+        number_of_comments, number_of_dockets, number_of_documents = run_pipeline(
+            data_date, s3_client, BUCKET_NAME, key_pool=key_pool, max_workers=max_workers
+        )
+    finally:
+        stop.set()
+        renewer.join()
+
+    # To keep better track of the scrapes, we add a timestamp for when the data is added to the database.
+    ts = datetime.now().astimezone(pytz.timezone("EST"))
+    timestamp = datetime.strftime(ts, "%Y-%m-%d %H:%M:%S")
+    today = datetime.strftime(ts, "%Y-%m-%d")
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            INSERT_STATUS_STMT,
+            (
+                today,
+                data_date,
+                number_of_comments,
+                number_of_dockets,
+                timestamp,
+                number_of_documents,
+            ),
+        )
+        cur.execute(RELEASE_LEASE_STMT, {"data_date": data_date, "worker": worker})
+    return number_of_comments
+
+
+def work(days, key_names, max_workers):
+    """Scrape every day of `days` that no other worker has done or claimed.
+
+    Each worker runs in its own process with its own share of the API keys.
+    A day that fails is released, so a later backfill can pick it up again.
+    """
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    key_pool = KeyPool.from_env(key_names)
+    s3_client = boto3.client(
+        service_name="s3",
+        region_name=os.getenv("AWS_REGION"),
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        config=Config(max_pool_connections=UPLOAD_WORKERS),
+    )
+    conn = connect()
+
+    failed = []
+    for data_date in days:
+        if not claim(conn, data_date, worker):
+            continue
+        logging.info(f"Worker {worker} scraping {data_date} with keys {', '.join(key_names)}")
+        try:
+            count = scrape_day(conn, data_date, worker, s3_client, key_pool, max_workers)
+        except Exception:
+            logging.exception(f"Scrape of {data_date} failed, releasing it")
+            release(conn, data_date, worker)
+            failed.append(data_date)
+            continue
+        logging.info(f"Completed {data_date}: {count} comments")
+
+    conn.close()
+    if failed:
+        logging.error(f"Worker {worker} failed on {', '.join(failed)}")
+        sys.exit(1)
+
+
+def backfill(start, end, workers=WORKERS, key_names=HISTORICAL_KEYS):
+    """Scrape the days from `end` back to `start` with `workers` processes.
+
+    Returns True if every worker finished without a failed day.
+    """
+    conn = connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(CREATE_LEASES_STMT)
+    # Created before the workers start, as concurrent CREATE TABLE IF NOT EXISTS can collide
+    create_tables(conn)
+    conn.close()
+
+    days = days_between(start, end)
+    # Share the cores between the attachment parsers of the workers
+    max_workers = max(1, (os.cpu_count() or 1) // workers)
+    processes = [
+        multiprocessing.Process(target=work, args=(days, names, max_workers))
+        for names in split_keys(key_names, workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return all(process.exitcode == 0 for process in processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape a range of days in parallel")
+    parser.add_argument("start", help="first day to scrape, YYYY-MM-DD")
+    parser.add_argument("end", help="last day to scrape, YYYY-MM-DD")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="days scraped at once, each with its own share of the API keys",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+    logging.info(f"Backfilling {args.start} to {args.end} with {args.workers} workers")
+    sys.exit(0 if backfill(args.start, args.end, args.workers) else 1)
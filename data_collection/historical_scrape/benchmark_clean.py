@@ -0,0 +1,89 @@
+"""Time clean_string and clean_rows against the old clean_string on comment-like rows.
+
+tests/test_clean.py checks that they give the same output.
+
+    python benchmark_clean.py
+    python benchmark_clean.py --rows 20000
+"""
+
+import argparse
+import random
+import time
+
+from jobs.historical_scrape.bulk_load import COMMENT_TEXT_FIELDS
+from jobs.historical_scrape.supporting_functions import clean_rows, clean_string
+from jobs.historical_scrape.tests.test_clean import legacy_clean_string
+
+# Comments come from the API as HTML, attachments as plain text extracted from PDFs
+PARAGRAPH = (
+    "The proposed rule would impose significant financial burdens on small businesses &amp; "
+    "family farms.\nWe urge the agency to reconsider the compliance timeline in Section 3(b)."
+    "<br>Our members &quot;cannot absorb&quot; these costs without assistance. \n \n"
+)
+PDF_PARAGRAPH = (
+    "Comments of the National Association of Manufacturers\nRe: Docket No. EPA-HQ-OAR-2021-0317\n"
+    "The Agency's cost estimates understate the burden of compliance for the maintenance and\n"
+    "operation of existing units, particularly for facilities with limited access to financing.\n \n"
+)
+
+
+def fake_row(i, rng):
+    # A structured comment as it comes out of structure_data, with a PDF attachment every few rows
+    # Numbered so that no two comments are the same, which would flatter clean_rows
+    comment = f"Comment {i}: " + PARAGRAPH * rng.randint(1, 4)
+    pdf = f"\n \nAttachment {i}: " + PDF_PARAGRAPH * rng.randint(20, 200) if i % 3 == 0 else ""
+    row = {field: "" for field in COMMENT_TEXT_FIELDS}
+    row.update(
+        {
+            "comment_id": f"EPA-HQ-OAR-2021-0317-{i:04d}",
+            "docket_id": "EPA-HQ-OAR-2021-0317",
+            "agency_id": "EPA",
+            "title": f"Comment from Jane Doe {i}",
+            "comment": comment,
+            "comment_pdf_extracted": pdf,
+            "commenter_first_name": "Jane",
+            "commenter_last_name": "Doe",
+            "commenter_country": "United States",
+            "receive_date": "2024-01-01T05:00:00Z",
+            "posted_date": "2024-01-02T05:00:00Z",
+            "attachment_read": "attachment extracted" if pdf else "no attachment",
+            "api_url": f"https://api.regulations.gov/v4/comments/EPA-HQ-OAR-2021-0317-{i:04d}",
+            "full_text": comment + " " + pdf,
+        }
+    )
+    return row
+
+
+def benchmark(rows):
+    rng = random.Random(0)
+    data = [fake_row(i, rng) for i in range(rows)]
+    size = sum(len(row["full_text"]) for row in data)
+    print(f"{rows} rows, {size / 1e6:.1f}M characters of full text")
+
+    start = time.perf_counter()
+    legacy = [
+        {field: legacy_clean_string(row.get(field)) for field in COMMENT_TEXT_FIELDS}
+        for row in data
+    ]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [{field: clean_string(row.get(field)) for field in COMMENT_TEXT_FIELDS} for row in data]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = clean_rows(data, COMMENT_TEXT_FIELDS)
+    batch_time = time.perf_counter() - start
+
+    assert legacy == single == [{field: row[field] for field in COMMENT_TEXT_FIELDS} for row in batch]
+    print(f"legacy clean_string: {legacy_time:.2f}s")
+    print(f"clean_string:        {single_time:.2f}s ({legacy_time / single_time:.1f}x)")
+    print(f"clean_rows:          {batch_time:.2f}s ({legacy_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    benchmark(args.rows)
@@ -0,0 +1,88 @@
+"""Compare the enrichment engine with one request per comment, one at a time.
+
+Starts the stub model server and enriches the same fake comments both ways, the
+way the notebooks did (every comment alone, waiting for each answer, though
+copies of a form letter already share one request) and with concurrent and
+packed requests, then twice more through a response cache, and prints the
+requests and time they take:
+
+    python benchmark_enrichment.py
+    python benchmark_enrichment.py --comments 2000 --latency 1 --broken 0.05
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from jobs.historical_scrape.benchmark_clean import PARAGRAPH
+from jobs.historical_scrape.enrichment import CONCURRENCY, PACK_SIZE, enrich_comments
+from jobs.historical_scrape.llm_providers import make_provider
+from jobs.historical_scrape.response_cache import ResponseCache
+from jobs.historical_scrape.stub_model_server import start_stub_model_server
+
+
+def fake_comments(count, rng, copies=0.3):
+    # Mostly short comments, like the ones typed on regulations.gov, some long letters and form letters
+    comments = []
+    for i in range(count):
+        if rng.random() < copies:
+            text = "I urge the EPA to  withdraw this rule.\nIt will cost jobs in my state. " + rng.choice(["", " "])
+        elif rng.random() < 0.8:
+            text = f"Comment {i}. I oppose this rule, it will hurt my family. jane{i}@example.com"
+        else:
+            text = f"Letter {i}. " + PARAGRAPH * rng.randint(10, 100)
+        comments.append((f"EPA-HQ-OAR-2021-0317-{i:04d}", text))
+    return comments
+
+
+def run(comments, url, concurrency, pack_size, cache=None):
+    provider = make_provider("gemini", api_url=url, requests_per_minute=10**6, tokens_per_minute=10**9)
+    results = {}
+
+    async def chunks():
+        yield comments
+
+    async def on_result(comment_id, fields):
+        results[comment_id] = fields
+
+    start = time.perf_counter()
+    stats = asyncio.run(enrich_comments(chunks(), provider, on_result, concurrency, pack_size, cache))
+    return results, stats, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--comments", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--broken", type=float, default=0.0)
+    parser.add_argument("--copies", type=float, default=0.3, help="share of form letters")
+    args = parser.parse_args()
+
+    server = start_stub_model_server(latency=args.latency, requests_per_minute=10**6, broken=args.broken)
+    url = f"http://127.0.0.1:{server.server_port}"
+    comments = fake_comments(args.comments, random.Random(0), args.copies)
+
+    serial, serial_stats, serial_time = run(comments, url, 1, 1)
+    engine, engine_stats, engine_time = run(comments, url, CONCURRENCY, PACK_SIZE)
+    cache = ResponseCache(":memory:")
+    cold, cold_stats, cold_time = run(comments, url, CONCURRENCY, PACK_SIZE, cache)
+    warm, warm_stats, warm_time = run(comments, url, CONCURRENCY, PACK_SIZE, cache)
+
+    if not args.broken:
+        assert serial == engine == cold == warm
+    print(f"{args.comments} comments, {args.latency}s per request")
+    print(f"one at a time: {serial_time:.2f}s, {serial_stats['requests']} requests, {len(serial)} enriched")
+    print(
+        f"engine:        {engine_time:.2f}s, {engine_stats['requests']} requests, {len(engine)} enriched, "
+        f"{engine_stats['retried']} asked again ({serial_time / engine_time:.1f}x)"
+    )
+    for name, (results, stats, elapsed) in {
+        "cold cache:   ": (cold, cold_stats, cold_time),
+        "warm cache:   ": (warm, warm_stats, warm_time),
+    }.items():
+        print(
+            f"{name}{elapsed:.2f}s, {stats['requests']} requests, {len(results)} enriched, "
+            f"{stats['cached']} from the cache, {stats['copies']} copies"
+        )
+    print(f"cache: {cache.stats()}")
@@ -0,0 +1,107 @@
+"""Compare the single-pass extraction engine with the old triple-parse extractor.
+
+Runs both over every PDF in a directory, checks that they return the same
+text and prints the time each one took:
+
+    python benchmark_extraction.py path/to/sample_pdfs
+"""
+
+import argparse
+import os
+import time
+from io import BytesIO
+
+import pdfplumber
+import PyPDF2
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTChar, LTTextContainer
+
+from jobs.historical_scrape.extraction import extract_text, extract_text_with_formats
+
+
+def legacy_extract_text(pdf_bytes):
+    # The per-attachment parse get_comment_text used to do: PyPDF2, pdfminer and a
+    # pdfplumber open for every page, and a font walk for every character
+    def text_extraction(element):
+        line_text = element.get_text()
+        line_formats = []
+        for text_line in element:
+            if isinstance(text_line, LTTextContainer):
+                for character in text_line:
+                    if isinstance(character, LTChar):
+                        line_formats.append(character.fontname)
+                        line_formats.append(character.size)
+        return (line_text, list(set(line_formats)))
+
+    result = ""
+    pdfReaded = PyPDF2.PdfReader(BytesIO(pdf_bytes))
+    num_pages = len(pdfReaded.pages)
+    text_per_page = {}
+    for pagenum, page in enumerate(extract_pages(BytesIO(pdf_bytes))):
+        if pagenum > 2:
+            break
+        pageObj = pdfReaded.pages[pagenum]
+        page_text = []
+        line_format = []
+        pdf = pdfplumber.open(BytesIO(pdf_bytes))
+        page_tables = pdf.pages[pagenum]
+        page_elements = [(element.y1, element) for element in page._objs]
+        page_elements.sort(key=lambda a: a[0], reverse=True)
+        for i, component in enumerate(page_elements):
+            element = component[1]
+            if isinstance(element, LTTextContainer):
+                (line_text, format_per_line) = text_extraction(element)
+                page_text.append(line_text)
+                line_format.append(format_per_line)
+            text_per_page["Page_" + str(pagenum)] = [page_text, line_format]
+        result = result + "\n \n" + "".join(text_per_page["Page_" + str(pagenum)][0])
+    return result
+
+
+def time_extractor(extractor, documents):
+    start = time.perf_counter()
+    texts = {}
+    for name, pdf_bytes in documents.items():
+        try:
+            texts[name] = extractor(pdf_bytes)
+        except Exception as e:
+            texts[name] = e
+    return time.perf_counter() - start, texts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("corpus", help="Directory with sample PDFs")
+    args = parser.parse_args()
+
+    documents = {}
+    for name in sorted(os.listdir(args.corpus)):
+        if name.lower().endswith(".pdf"):
+            with open(os.path.join(args.corpus, name), "rb") as f:
+                documents[name] = f.read()
+
+    legacy_time, legacy_texts = time_extractor(legacy_extract_text, documents)
+    formats_time, formats_texts = time_extractor(
+        lambda pdf_bytes: extract_text_with_formats(pdf_bytes)[0], documents
+    )
+    text_time, texts = time_extractor(extract_text, documents)
+
+    mismatches = [
+        name
+        for name, text in legacy_texts.items()
+        # Documents the old extractor failed on are allowed to succeed now
+        if not isinstance(text, Exception)
+        and not (text == texts[name] == formats_texts[name])
+    ]
+    failed = [name for name, text in legacy_texts.items() if isinstance(text, Exception)]
+
+    print(f"documents:           {len(documents)}")
+    print(f"legacy extractor:    {legacy_time:7.2f}s")
+    print(f"with formats:        {formats_time:7.2f}s  ({legacy_time / formats_time:4.1f}x)")
+    print(f"text only:           {text_time:7.2f}s  ({legacy_time / text_time:4.1f}x)")
+    if failed:
+        print(f"failed with the legacy extractor: {', '.join(failed)}")
+    if mismatches:
+        print(f"DIFFERENT TEXT: {', '.join(mismatches)}")
+        raise SystemExit(1)
+    print("all texts identical")
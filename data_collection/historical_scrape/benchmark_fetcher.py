@@ -0,0 +1,62 @@
+"""Compare the serial comment loop with the concurrent fetcher, offline.
+
+Both run against the local stub API, so no quota is used:
+
+    python benchmark_fetcher.py --comments 300 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import requests
+
+from jobs.historical_scrape.key_pool import HISTORICAL_KEYS
+from jobs.historical_scrape.stub_server import start_stub_server
+
+
+def serial_fetch(ids, keys, base_url, delay):
+    # The loop get_comments used to run: one request at a time, one key at a time
+    comment_details = []
+    for num, comment_id in enumerate(ids):
+        api_key = os.getenv(f"REGGOV_API_KEY_{keys[(num // 50) % len(keys)]}")
+        url = f"{base_url}/comments/{comment_id}?include=attachments&api_key={api_key}"
+        comment_details.append(requests.get(url).json())
+        time.sleep(delay)
+    return comment_details
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--comments", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--delay", type=float, default=0.4)
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    base_url = f"http://127.0.0.1:{server.server_port}/v4"
+    os.environ["REGGOV_API_URL"] = base_url
+
+    # Imported after REGGOV_API_URL is set so the fetcher talks to the stub
+    from jobs.historical_scrape import fetcher
+
+    for key in HISTORICAL_KEYS:
+        os.environ.setdefault(f"REGGOV_API_KEY_{key}", f"stub-{key}")
+
+    ids = [f"STUB-2024-0001-{num:04d}" for num in range(args.comments)]
+
+    start = time.perf_counter()
+    serial = serial_fetch(ids, HISTORICAL_KEYS, base_url, args.delay)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concurrent = asyncio.run(fetcher.fetch_comments(ids))
+    concurrent_time = time.perf_counter() - start
+
+    assert [c["data"]["id"] for c in concurrent] == [c["data"]["id"] for c in serial]
+    print(f"serial:     {serial_time:7.2f}s  ({len(ids) / serial_time:6.1f} comments/s)")
+    print(f"concurrent: {concurrent_time:7.2f}s  ({len(ids) / concurrent_time:6.1f} comments/s)")
+    print(f"speedup:    {serial_time / concurrent_time:7.1f}x")
+
+    server.shutdown()
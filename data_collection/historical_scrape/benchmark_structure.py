@@ -0,0 +1,159 @@
+"""Compare the field projector with the old flatten()-based structure_data.
+
+Builds fake API responses with attachments and some missing and null fields,
+checks that both give the same rows and prints the time and memory they take,
+and what a CommentBatch of the same comments takes:
+
+    python benchmark_structure.py
+    python benchmark_structure.py --comments 50000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from flatten_json import flatten
+
+from jobs.historical_scrape.comment_batch import CommentBatch
+from jobs.historical_scrape.stub_server import fake_comment
+from jobs.historical_scrape.supporting_functions import COMMENT_PROJECTOR, structure_data
+
+
+def legacy_structure_data(data):
+    # structure_data as it was, minus the recursive branch that no response ever reached
+    keys_to_include = [
+        "data_id",
+        "data_attributes_commentOnDocumentId",
+        "data_attributes_docketId",
+        "data_attributes_agencyId",
+        "data_attributes_title",
+        "data_attributes_comment",
+        "data_attributes_pdf_extracted_text",
+        "data_attributes_firstName",
+        "data_attributes_lastName",
+        "data_attributes_organization",
+        "data_attributes_address1",
+        "data_attributes_address2",
+        "data_attributes_zip",
+        "data_attributes_city",
+        "data_attributes_country",
+        "data_attributes_stateProvinceRegion",
+        "data_attributes_email",
+        "data_attributes_receiveDate",
+        "data_attributes_postedDate",
+        "data_attributes_postmarkDate",
+        "data_links_self",
+        "data_attributes_attachments_url",
+        "data_attributes_attachment_read",
+        "data_attributes_duplicateComments",
+        "data_attributes_withdrawn",
+    ]
+    final_data = []
+    for comment in data:
+        flat_comment = flatten(comment)
+        result_dict = {}
+        for key, value in flat_comment.items():
+            if key in keys_to_include:
+                result_dict[key] = value if value is not None else ""
+        final_data.append(result_dict)
+
+    key_mapping = {
+        "data_id": "comment_id",
+        "data_attributes_commentOnDocumentId": "document_id",
+        "data_attributes_docketId": "docket_id",
+        "data_attributes_agencyId": "agency_id",
+        "data_attributes_title": "title",
+        "data_attributes_comment": "comment",
+        "data_attributes_pdf_extracted_text": "comment_pdf_extracted",
+        "data_attributes_firstName": "commenter_first_name",
+        "data_attributes_lastName": "commenter_last_name",
+        "data_attributes_organization": "commenter_organization",
+        "data_attributes_address1": "commenter_address1",
+        "data_attributes_address2": "commenter_address2",
+        "data_attributes_zip": "commenter_zip",
+        "data_attributes_city": "commenter_city",
+        "data_attributes_stateProvinceRegion": "commenter_state_province_region",
+        "data_attributes_country": "commenter_country",
+        "data_attributes_email": "commenter_email",
+        "data_attributes_receiveDate": "receive_date",
+        "data_attributes_postedDate": "posted_date",
+        "data_attributes_postmarkDate": "postmark_date",
+        "data_attributes_duplicateComments": "duplicate_comments",
+        "data_attributes_attachment_read": "attachment_read",
+        "data_attributes_attachments_url": "attachment_url",
+        "data_attributes_withdrawn": "withdrawn",
+        "data_links_self": "api_url",
+    }
+    for i in final_data:
+        for old_key, new_key in key_mapping.items():
+            i[new_key] = i.pop(old_key, "")
+    return final_data
+
+
+def fake_response(i, rng):
+    # A comment after get_comment_text, with a few attachments in "included"
+    comment = fake_comment(f"EPA-HQ-OAR-2021-0317-{i:04d}")
+    attributes = comment["data"]["attributes"]
+    attributes["comment"] = f"Comment {i}. " + "The proposed rule is too costly. " * rng.randint(1, 50)
+    attributes["pdf_extracted_text"] = "\n \nAttached letter. " * rng.randint(0, 200)
+    attributes["attachment_read"] = rng.choice(["attachment extracted", "no attachment"])
+    attributes["attachments_url"] = "https://downloads.regulations.gov/x/attachment_1.pdf "
+    for key in rng.sample(sorted(attributes), 3):
+        if rng.random() < 0.5:
+            attributes[key] = None
+        else:
+            del attributes[key]
+    comment["included"] = [
+        {
+            "id": f"09000064{i:08x}{n}",
+            "type": "attachments",
+            "attributes": {
+                "title": f"Attachment {n}",
+                "docOrder": n,
+                "modifyDate": "2024-01-02T05:00:00Z",
+                "fileFormats": [
+                    {
+                        "fileUrl": f"https://downloads.regulations.gov/x/attachment_{n}.pdf",
+                        "format": "pdf",
+                        "size": rng.randint(10_000, 5_000_000),
+                    }
+                ],
+            },
+        }
+        for n in range(rng.randint(0, 5))
+    ]
+    return comment
+
+
+def measure(function, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(data)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--comments", type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    data = [fake_response(i, rng) for i in range(args.comments)]
+
+    legacy, legacy_time, legacy_size = measure(legacy_structure_data, data)
+    dicts, dicts_time, dicts_size = measure(structure_data, data)
+    rows, rows_time, rows_size = measure(COMMENT_PROJECTOR.rows, data)
+    batch, batch_time, batch_size = measure(CommentBatch.from_responses, data)
+
+    assert legacy == dicts
+    assert rows == [tuple(row[name] for name in COMMENT_PROJECTOR.names) for row in legacy]
+    assert [dict(row) for row in batch] == [dict(row, full_text=None) for row in legacy]
+    print(f"{args.comments} comments, same rows from all four")
+    print(f"flatten() structure_data: {legacy_time:.2f}s, {legacy_size / 1e6:.1f} MB")
+    print(f"structure_data:           {dicts_time:.2f}s, {dicts_size / 1e6:.1f} MB ({legacy_time / dicts_time:.1f}x)")
+    print(f"projector rows:           {rows_time:.2f}s, {rows_size / 1e6:.1f} MB ({legacy_time / rows_time:.1f}x)")
+    print(f"CommentBatch:             {batch_time:.2f}s, {batch_size / 1e6:.1f} MB ({legacy_time / batch_time:.1f}x)")
@@ -0,0 +1,188 @@
+import os
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.comment_batch import COLUMNS, CommentBatch
+from jobs.historical_scrape.near_duplicates import add_to_index
+from jobs.historical_scrape.sql import (
+    CREATE_STAGE_STMT,
+    REFRESH_COMMENTS_STMT,
+    STAGE_COMMENTS_STMT,
+    STAGE_DOCKETS_STMT,
+    STAGE_DOCUMENTS_STMT,
+    UPSERT_COMMENTS_STMT,
+    UPSERT_DOCKETS_STMT,
+    UPSERT_DOCUMENTS_STMT,
+)
+from jobs.historical_scrape.supporting_functions import clean_rows, clean_string
+
+# Rows sent to the staging table per round trip
+PAGE_SIZE: int = 1000
+# Position of full_text in the rows of the comments
+FULL_TEXT: int = COLUMNS.index("full_text")
+
+
+def connect():
+    """Open a psycopg2 connection to the database in `DATABASE_URL`."""
+    return psycopg2.connect(os.getenv("DATABASE_URL"))
+
+
+# The fields of a comment that go through clean_string before they are written
+COMMENT_TEXT_FIELDS = (
+    "comment_id",
+    "docket_id",
+    "agency_id",
+    "title",
+    "comment",
+    "comment_pdf_extracted",
+    "commenter_first_name",
+    "commenter_last_name",
+    "commenter_organization",
+    "commenter_address1",
+    "commenter_address2",
+    "commenter_zip",
+    "commenter_city",
+    "commenter_state_province_region",
+    "commenter_country",
+    "commenter_email",
+    "receive_date",
+    "posted_date",
+    "postmark_date",
+    "attachment_read",
+    "attachment_url",
+    "api_url",
+    "full_text",
+)
+
+
+def comment_row(item):
+    # The values for INSERT_COMMENTS_STMT / STAGE_COMMENTS_STMT, in column order.
+    # `item` must have been cleaned with clean_rows(..., COMMENT_TEXT_FIELDS)
+    return (
+        item["comment_id"],
+        item["docket_id"],
+        item["agency_id"],
+        item["title"],
+        item["comment"],
+        item.get("comment_pdf_extracted"),
+        item.get("commenter_first_name"),
+        item.get("commenter_last_name"),
+        item.get("commenter_organization"),
+        item.get("commenter_address1"),
+        item.get("commenter_address2"),
+        item.get("commenter_zip"),
+        item.get("commenter_city"),
+        item.get("commenter_state_province_region"),
+        item.get("commenter_country"),
+        item.get("commenter_email"),
+        item.get("receive_date"),
+        item.get("posted_date"),
+        item.get("postmark_date"),
+        item.get("duplicate_comments"),
+        item.get("attachment_read"),
+        item.get("attachment_url"),
+        item.get("withdrawn"),
+        item.get("api_url"),
+        item.get("full_text"),
+        item.get("document_id"),
+    )
+
+
+def docket_row(item):
+    # The values for INSERT_DOCKETS_STMT / STAGE_DOCKETS_STMT, in column order
+    return (
+        item["docket_id"],
+        item["agency_id"],
+        clean_string(item["title"]),
+        clean_string(item["docket_type"]),
+        item["keywords"],
+        clean_string(item["abstract"]),
+        item["category"],
+        item["modify_date"],
+        item["effective_date"],
+        clean_string(item["organization"]),
+        clean_string(item["program"]),
+        item["rin"],
+        item["object_id"],
+        item["docket_url"],
+    )
+
+
+def document_row(item):
+    # The values for INSERT_DOCUMENTS_STMT / STAGE_DOCUMENTS_STMT, in column order
+    return (
+        item["document_id"],
+        item["original_document_id"],
+        item["document_type"],
+        item["subtype"],
+        item["docket_id"],
+        item["agency_id"],
+        item["title"],
+        item["abstract"],
+        item["topics"],
+        item["subject"],
+        item["comment_start_date"],
+        item["comment_end_date"],
+        item["effective_date"],
+        item["implementation_date"],
+        item["modified_date"],
+        item["open_for_comment"],
+        item["allow_late_comments"],
+        item["object_id"],
+        item["withdrawn"],
+        item["document_url"],
+        item["attachments"],
+    )
+
+
+def bulk_upsert(conn, table, stage_stmt, upsert_stmt, rows):
+    """Stage `rows` in a temporary table and apply them to `table` in one statement.
+
+    Everything runs in one transaction, so either all the rows are written or
+    none are. Returns the number of rows inserted or updated.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    with conn, conn.cursor() as cur:
+        return upsert(cur, table, stage_stmt, upsert_stmt, rows)
+
+
+def upsert(cur, table, stage_stmt, upsert_stmt, rows):
+    # bulk_upsert within the transaction of `cur`
+    cur.execute(CREATE_STAGE_STMT.format(stage=f"stage_{table}", table=table))
+    execute_values(cur, stage_stmt, rows, page_size=PAGE_SIZE)
+    cur.execute(upsert_stmt)
+    return cur.rowcount
+
+
+def load_comments(conn, items, refresh=False):
+    # `items` is a CommentBatch or a list of dicts.
+    # Comments already in the table are kept as they are, unless `refresh` is set
+    upsert_stmt = REFRESH_COMMENTS_STMT if refresh else UPSERT_COMMENTS_STMT
+    if isinstance(items, CommentBatch):
+        rows = items.cleaned(COMMENT_TEXT_FIELDS).rows()
+    else:
+        rows = [comment_row(item) for item in clean_rows(items, COMMENT_TEXT_FIELDS)]
+    if not rows:
+        return 0
+    # The near-duplicate index is kept up to date with the full text that was stored, in the
+    # same transaction, so that a comment is never stored without being indexed
+    with conn, conn.cursor() as cur:
+        loaded = upsert(cur, "comments", STAGE_COMMENTS_STMT, upsert_stmt, rows)
+        add_to_index(cur, ((row[0], row[FULL_TEXT]) for row in rows), replace=refresh)
+    return loaded
+
+
+def load_dockets(conn, items):
+    return bulk_upsert(
+        conn, "dockets", STAGE_DOCKETS_STMT, UPSERT_DOCKETS_STMT, map(docket_row, items)
+    )
+
+
+def load_documents(conn, items):
+    return bulk_upsert(
+        conn, "documents", STAGE_DOCUMENTS_STMT, UPSERT_DOCUMENTS_STMT, map(document_row, items)
+    )
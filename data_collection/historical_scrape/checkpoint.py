@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+import threading
+
+CHECKPOINT_DIR: str = os.getenv(
+    "CHECKPOINT_DIR", os.path.expanduser("~/.cache/commons/checkpoints")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (stage, key)
+);
+CREATE TABLE IF NOT EXISTS stages (
+    stage TEXT PRIMARY KEY
+);
+"""
+
+
+class Checkpoint:
+    """Local store of the work done for one scrape, so a crashed run can resume.
+
+    Every stage saves its output as units of work (one comment, one chunk of
+    text, ...) as soon as they are done, and is marked complete at the end. A
+    rerun for the same `name` skips completed stages and only redoes the units
+    that are missing. The store is a SQLite file in `CHECKPOINT_DIR`, and can
+    be written to from several threads.
+    """
+
+    def __init__(self, name, directory=CHECKPOINT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite")
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def put(self, stage, key, value):
+        """Save one unit of work of `stage`. `value` must be JSON serialisable."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO units (stage, key, value) VALUES (?, ?, ?)",
+                (stage, key, json.dumps(value)),
+            )
+
+    def put_many(self, stage, items):
+        """Save several `(key, value)` units of `stage` in one transaction."""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO units (stage, key, value) VALUES (?, ?, ?)",
+                ((stage, key, json.dumps(value)) for key, value in items),
+            )
+
+    def units(self, stage):
+        """Return the saved units of `stage` as a dict, in the order they were saved."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, value FROM units WHERE stage = ? ORDER BY rowid", (stage,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def keys(self, stage):
+        """Return the set of keys saved for `stage`."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key FROM units WHERE stage = ?", (stage,)
+            ).fetchall()
+        return {key for (key,) in rows}
+
+    def is_done(self, stage):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM stages WHERE stage = ?", (stage,)
+            ).fetchone()
+        return row is not None
+
+    def mark_done(self, stage):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO stages (stage) VALUES (?)", (stage,))
+
+    def run(self, stage, function):
+        """Return the saved output of `stage`, or run `function` and save what it returns.
+
+        For stages that can't be split into units, so they are redone from the
+        start if the run stops half way through them.
+        """
+        if self.is_done(stage):
+            return self.units(stage)[stage]
+        output = function()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO units (stage, key, value) VALUES (?, ?, ?)",
+                (stage, stage, json.dumps(output)),
+            )
+            self.conn.execute("INSERT OR IGNORE INTO stages (stage) VALUES (?)", (stage,))
+        return output
+
+    def clear(self):
+        """Delete the store once the scrape is complete."""
+        self.conn.close()
+        os.remove(self.path)
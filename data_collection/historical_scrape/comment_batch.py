@@ -0,0 +1,161 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed to write Parquet
+    pa = None
+
+from jobs.historical_scrape.supporting_functions import COMMENT_PROJECTOR, clean_string
+
+# The columns of the comments table, in the order of INSERT_COMMENTS_STMT
+COLUMNS = (
+    "comment_id",
+    "docket_id",
+    "agency_id",
+    "title",
+    "comment",
+    "comment_pdf_extracted",
+    "commenter_first_name",
+    "commenter_last_name",
+    "commenter_organization",
+    "commenter_address1",
+    "commenter_address2",
+    "commenter_zip",
+    "commenter_city",
+    "commenter_state_province_region",
+    "commenter_country",
+    "commenter_email",
+    "receive_date",
+    "posted_date",
+    "postmark_date",
+    "duplicate_comments",
+    "attachment_read",
+    "attachment_url",
+    "withdrawn",
+    "api_url",
+    "full_text",
+    "document_id",
+)
+# The columns that aren't strings. Everything else is written to Parquet as a string
+COLUMN_TYPES = {"duplicate_comments": "int64", "withdrawn": "bool"}
+
+
+class CommentRow:
+    """View of one comment of a `CommentBatch`, which reads and writes like the old dicts."""
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, name):
+        return self.batch.columns[name][self.index]
+
+    def __setitem__(self, name, value):
+        self.batch.columns[name][self.index] = value
+
+    def get(self, name, default=None):
+        column = self.batch.columns.get(name)
+        return default if column is None else column[self.index]
+
+    def keys(self):
+        return self.batch.columns.keys()
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class CommentBatch:
+    """Structured comments held column by column.
+
+    `columns` maps every name in `COLUMNS` to a list with one value per
+    comment. A batch takes no per-comment dict, and it can be built straight
+    from the API responses (`from_responses`), so the responses can be dropped
+    as soon as it exists. Iterating over it or indexing it gives `CommentRow`
+    views, so code written for lists of dicts keeps working. `columns` is JSON
+    serialisable, which is how run.py checkpoints it.
+    """
+
+    def __init__(self, columns):
+        self.columns = {name: list(columns.get(name, ())) for name in COLUMNS}
+        self.length = len(self.columns["comment_id"])
+        for name in COLUMNS:
+            if not self.columns[name]:
+                self.columns[name] = [None] * self.length
+
+    @classmethod
+    def from_responses(cls, data):
+        """Build a batch from API responses that went through get_comment_text."""
+        values = zip(*map(COMMENT_PROJECTOR.row, data))
+        columns = dict(zip(COMMENT_PROJECTOR.names, map(list, values)))
+        return cls(columns)
+
+    @classmethod
+    def from_dicts(cls, rows):
+        rows = list(rows)
+        return cls({name: [row.get(name) for row in rows] for name in COLUMNS})
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not -self.length <= index < self.length:
+            raise IndexError(index)
+        return CommentRow(self, index % self.length)
+
+    def __iter__(self):
+        return (CommentRow(self, index) for index in range(self.length))
+
+    def column(self, name):
+        return self.columns[name]
+
+    def add_full_text(self):
+        # Create a new column that combines the comment and the extracted text from the pdf
+        self.columns["full_text"] = [
+            comment + " " + pdf_text
+            for comment, pdf_text in zip(self.columns["comment"], self.columns["comment_pdf_extracted"])
+        ]
+        return self
+
+    def cleaned(self, names):
+        """Return a new batch with the `names` columns passed through clean_string.
+
+        Values that repeat in a column are only cleaned once.
+        """
+        columns = dict(self.columns)
+        for name in names:
+            cleaned = {}
+            column = []
+            for value in columns[name]:
+                if value is not None:
+                    result = cleaned.get(value)
+                    if result is None:
+                        result = cleaned[value] = clean_string(value)
+                    value = result
+                column.append(value)
+            columns[name] = column
+        return CommentBatch(columns)
+
+    def rows(self):
+        """Return the comments as tuples in the order of `COLUMNS`."""
+        return list(zip(*(self.columns[name] for name in COLUMNS)))
+
+    def to_dicts(self):
+        return [dict(zip(COLUMNS, row)) for row in self.rows()]
+
+    def to_arrow(self):
+        if pa is None:
+            raise ImportError("pyarrow is needed to convert a CommentBatch to Arrow")
+        arrays = {}
+        for name in COLUMNS:
+            column = self.columns[name]
+            if name in COLUMN_TYPES:
+                # Missing values come out of the projector as ""
+                column = [None if value == "" else value for value in column]
+            arrays[name] = pa.array(column, type=pa.type_for_alias(COLUMN_TYPES.get(name, "string")))
+        return pa.table(arrays)
+
+    def write_parquet(self, path, **kwargs):
+        """Write the batch to a Parquet file, with the keyword arguments of pyarrow's write_table."""
+        pq.write_table(self.to_arrow(), path, **kwargs)
@@ -0,0 +1,157 @@
+# Keep the comments of a docket up to date, fetching only what changed since the last sync
+import argparse
+import logging
+import os
+import sys
+from contextlib import closing
+
+import boto3
+from botocore.config import Config
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.bulk_load import (
+    connect,
+    load_comments,
+    load_dockets,
+    load_documents,
+)
+from jobs.historical_scrape.extraction_cache import ExtractionCache
+from jobs.historical_scrape.extraction_pool import ExtractionPool
+from jobs.historical_scrape.key_pool import KeyPool
+from jobs.historical_scrape.near_duplicates import create_tables
+from jobs.historical_scrape.s3_archiver import UPLOAD_WORKERS
+from jobs.historical_scrape.sql import (
+    CREATE_DOCKET_SYNC_STMT,
+    SELECT_DOCKET_SYNC_STMT,
+    UPDATE_DOCKET_SYNC_STMT,
+)
+from jobs.historical_scrape.supporting_functions import (
+    get_comment_text,
+    get_comments,
+    get_dockets,
+    get_documents,
+    iter_comments,
+    structure_data,
+)
+
+BUCKET_NAME: str = "commons-docs"
+# Comments fetched, extracted and loaded at a time. The high-water mark moves after each chunk
+CHUNK_SIZE: int = 1000
+
+
+def changed_comments(docket_id, since=None, key_pool=None):
+    """Return the summaries of the comments of `docket_id` modified at or after `since`.
+
+    `since` is a lastModifiedDate as returned by the API. Without it, every
+    comment of the docket is listed. The summaries come oldest modification
+    first. The requests use the keys of `key_pool`, by default `REGGOV_API_KEY`.
+    """
+    if key_pool is None:
+        key_pool = KeyPool({"default": os.getenv("REGGOV_API_KEY")})
+    return [
+        comment
+        for comment in iter_comments({"filter[docketId]": docket_id}, key_pool, since=since)
+        # The cursor filter only has a precision of a second, so drop what it lets through
+        if since is None or comment["attributes"]["lastModifiedDate"] >= since
+    ]
+
+
+def fetch_docket(docket_id, since=None, s3_client=None, bucket_name=BUCKET_NAME, key_pool=None):
+    """Fetch, extract and structure the comments of `docket_id` modified since `since`.
+
+    Yields `(rows, last_modified)` for every chunk of `CHUNK_SIZE` comments,
+    where `rows` are the structured comments with their full text, ready for
+    `load_comments`, and `last_modified` is where the high-water mark can
+    move: the newest lastModifiedDate in the chunk, or, once a comment could
+    not be fetched, that comment's lastModifiedDate, so that the next sync
+    asks for it again. The raw comments are archived to S3 when `s3_client`
+    is given.
+    """
+    summaries = changed_comments(docket_id, since, key_pool)
+    logging.info(f"{len(summaries)} comments of {docket_id} changed since {since or 'the start'}")
+    if not summaries:
+        return
+
+    cache = ExtractionCache()
+    # The lastModifiedDate of the first comment that could not be fetched, past which the mark stays
+    failed_at = None
+    with closing(cache), ExtractionPool() as pool:
+        for start in range(0, len(summaries), CHUNK_SIZE):
+            chunk = summaries[start : start + CHUNK_SIZE]
+            comments = get_comments(
+                [comment["id"] for comment in chunk], s3_client, bucket_name, key_pool=key_pool
+            )
+            fetched = {comment["data"]["id"] for comment in comments}
+            missing = [comment for comment in chunk if comment["id"] not in fetched]
+            if missing:
+                logging.warning(f"{len(missing)} comments of {docket_id} could not be fetched")
+                if failed_at is None:
+                    failed_at = missing[0]["attributes"]["lastModifiedDate"]
+            rows = structure_data(get_comment_text(comments, cache=cache, pool=pool))
+            for item in rows:
+                # Create a new column that combines the comment and the extracted text from the pdf
+                item["full_text"] = item["comment"] + " " + item["comment_pdf_extracted"]
+            yield rows, failed_at or chunk[-1]["attributes"]["lastModifiedDate"]
+
+
+def sync_docket(conn, docket_id, s3_client=None, bucket_name=BUCKET_NAME, key_pool=None):
+    """Bring the comments of `docket_id` in the database up to date.
+
+    Only the comments modified since the docket's high-water mark in the
+    `docket_sync` table are fetched. New ones are inserted and modified ones
+    replace the stored version. The mark moves forward after every chunk, so
+    an interrupted sync carries on from the last chunk loaded, but never past
+    a comment that could not be fetched. The docket and
+    the documents the comments are on are refreshed too.
+
+    Returns the number of comments loaded.
+    """
+    with conn, conn.cursor() as cur:
+        cur.execute(CREATE_DOCKET_SYNC_STMT)
+        cur.execute(SELECT_DOCKET_SYNC_STMT, (docket_id,))
+        row = cur.fetchone()
+    create_tables(conn)
+    since = row[0] if row else None
+
+    loaded = 0
+    document_ids = set()
+    for rows, last_modified in fetch_docket(docket_id, since, s3_client, bucket_name, key_pool):
+        load_comments(conn, rows, refresh=True)
+        with conn, conn.cursor() as cur:
+            cur.execute(UPDATE_DOCKET_SYNC_STMT, (docket_id, last_modified))
+        loaded += len(rows)
+        document_ids.update(item["document_id"] for item in rows)
+
+    if loaded:
+        load_dockets(conn, get_dockets([{"docket_id": docket_id}]))
+        load_documents(conn, get_documents([{"document_id": document_id} for document_id in document_ids]))
+    logging.info(f"Synced {loaded} comments of {docket_id}")
+    return loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch the new and modified comments of one or more dockets"
+    )
+    parser.add_argument("docket_ids", nargs="+")
+    parser.add_argument(
+        "--no-archive", action="store_true", help="don't archive the raw comments to S3"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    s3_client = None
+    if not args.no_archive:
+        s3_client = boto3.client(
+            service_name="s3",
+            region_name=os.getenv("AWS_REGION"),
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            config=Config(max_pool_connections=UPLOAD_WORKERS),
+        )
+
+    conn = connect()
+    for docket_id in args.docket_ids:
+        sync_docket(conn, docket_id, s3_client)
+    conn.close()
@@ -0,0 +1,280 @@
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from xml.etree import ElementTree
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    # Only available in the Python that ships with LibreOffice (python3-uno).
+    # Without it, every batch is converted with one soffice --convert-to call
+    uno = None
+
+SOFFICE_PATH: str = os.getenv("SOFFICE_PATH") or shutil.which("soffice") or "/usr/bin/soffice"
+# Seconds to wait for a LibreOffice worker to accept connections
+STARTUP_TIMEOUT: int = 60
+BASE_PORT: int = 2002
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+COMPATIBILITY_NAMESPACE = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+
+def docx_to_text(docx_bytes):
+    """Extract the text of a .docx straight from its XML, without converting it to PDF.
+
+    Paragraphs are separated by newlines, and tabs and line breaks are kept.
+    The paragraphs of a text box come after the one it is anchored in. The
+    text is prefixed with a blank line like the text of a PDF page.
+    """
+    with zipfile.ZipFile(BytesIO(docx_bytes)) as docx:
+        root = ElementTree.fromstring(docx.read("word/document.xml"))
+
+    paragraphs = []
+    _read_paragraphs(root, None, paragraphs)
+    return "\n \n" + "\n".join("".join(parts) for parts in paragraphs)
+
+
+def _read_paragraphs(node, parts, paragraphs):
+    # Adds the text under `node` to `parts`, the paragraph being read. A paragraph nested in it
+    # (the ones of a text box) gets its own line after it instead of its text being read twice
+    for child in node:
+        if child.tag == f"{COMPATIBILITY_NAMESPACE}Fallback":
+            # The same text box again, drawn for readers older than Word 2010
+            continue
+        if child.tag == f"{WORD_NAMESPACE}p":
+            paragraph = []
+            paragraphs.append(paragraph)
+            _read_paragraphs(child, paragraph, paragraphs)
+            continue
+        if parts is not None:
+            if child.tag == f"{WORD_NAMESPACE}t":
+                parts.append(child.text or "")
+            elif child.tag == f"{WORD_NAMESPACE}tab":
+                parts.append("\t")
+            elif child.tag in (f"{WORD_NAMESPACE}br", f"{WORD_NAMESPACE}cr"):
+                parts.append("\n")
+        _read_paragraphs(child, parts, paragraphs)
+
+
+def scratch_dir():
+    """A private temporary directory for files a subprocess needs on disk.
+
+    It lives in tmpfs when there is one, so nothing touches the disk and
+    concurrent runs can't see each other's files.
+    """
+    return tempfile.TemporaryDirectory(
+        prefix="commons-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+    )
+
+
+class _Worker:
+    """One headless LibreOffice process that stays up between conversions."""
+
+    def __init__(self, scratch, port):
+        self.scratch = scratch
+        self.port = port
+        self.profile = os.path.join(scratch, f"profile-{port}")
+        self.process = None
+        self.desktop = None
+        if uno is not None:
+            self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [
+                SOFFICE_PATH,
+                "--headless",
+                "--invisible",
+                "--nologo",
+                "--norestore",
+                f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext",
+                # Its own profile, so it doesn't wait on the lock of another LibreOffice
+                f"-env:UserInstallation=file://{self.profile}",
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if time.monotonic() > deadline or self.process.poll() is not None:
+                    raise RuntimeError(f"LibreOffice worker on port {self.port} did not start")
+                time.sleep(0.5)
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+
+    def convert(self, paths):
+        # Convert the .docx files in `paths` and return the paths of the PDFs, None for the ones that failed
+        if uno is None:
+            subprocess.run(
+                [
+                    SOFFICE_PATH,
+                    f"-env:UserInstallation=file://{self.profile}",
+                    "--headless",
+                    "--convert-to",
+                    "pdf",
+                    "--outdir",
+                    self.scratch,
+                    *paths,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            return [path[: -len(".docx")] + ".pdf" for path in paths]
+
+        if self.process.poll() is not None:
+            logging.warning(f"LibreOffice worker on port {self.port} died, restarting it")
+            self.start()
+
+        # A corrupt or password-protected document gets None, and the rest of the batch goes on
+        pdf_paths = []
+        for path in paths:
+            pdf_path = path[: -len(".docx")] + ".pdf"
+            document = None
+            try:
+                document = self.desktop.loadComponentFromURL(
+                    uno.systemPathToFileUrl(path), "_blank", 0, (_property("Hidden", True),)
+                )
+                if document is None:
+                    raise RuntimeError("LibreOffice could not open the document")
+                document.storeToURL(
+                    uno.systemPathToFileUrl(pdf_path),
+                    (_property("FilterName", "writer_pdf_Export"),),
+                )
+            except Exception as e:
+                logging.warning(f"Could not convert {path}: {e}")
+                pdf_path = None
+            finally:
+                if document is not None:
+                    try:
+                        document.close(True)
+                    except Exception:
+                        pass
+            pdf_paths.append(pdf_path)
+        return pdf_paths
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+class DocxConverter:
+    """Pool of long-lived headless LibreOffice workers that turn .docx files into PDFs.
+
+    The workers start once and convert every document sent to them, so the
+    startup cost is paid per run instead of per file. `convert` takes a batch
+    of documents and spreads it over the workers, and `submit` converts a
+    single document in the background and returns a future. Use it as a
+    context manager so the workers are shut down.
+
+    If LibreOffice's `uno` module can't be imported, each batch is converted by
+    one `soffice --convert-to` call per worker instead.
+    """
+
+    def __init__(self, workers=2, base_port=BASE_PORT):
+        self._scratch = scratch_dir()
+        self.scratch = self._scratch.name
+        self.idle = queue.Queue()
+        for number in range(workers):
+            self.idle.put(_Worker(self.scratch, base_port + number))
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+
+    def _convert_batch(self, batch):
+        paths = []
+        for docx_bytes in batch:
+            path = os.path.join(self.scratch, f"{uuid.uuid4().hex}.docx")
+            with open(path, "wb") as f:
+                f.write(docx_bytes)
+            paths.append(path)
+
+        worker = self.idle.get()
+        try:
+            pdf_paths = worker.convert(paths)
+        except Exception as e:
+            # The worker itself failed, e.g. LibreOffice could not be restarted
+            logging.warning(f"LibreOffice worker on port {worker.port} failed: {e}")
+            pdf_paths = [None] * len(paths)
+        finally:
+            self.idle.put(worker)
+
+        pdfs = []
+        for path, pdf_path in zip(paths, pdf_paths):
+            try:
+                with open(pdf_path, "rb") as f:
+                    pdfs.append(f.read())
+            except (FileNotFoundError, TypeError):
+                pdfs.append(None)
+            finally:
+                for leftover in (path, pdf_path):
+                    if leftover is not None and os.path.exists(leftover):
+                        os.remove(leftover)
+        return pdfs
+
+    def convert(self, documents):
+        """Convert a batch of .docx files given as bytes.
+
+        Returns the PDF bytes in the same order, with None for the documents
+        LibreOffice could not convert.
+        """
+        documents = list(documents)
+        size = max(1, -(-len(documents) // self.workers))
+        batches = [documents[i : i + size] for i in range(0, len(documents), size)]
+        return [pdf for pdfs in self.executor.map(self._convert_batch, batches) for pdf in pdfs]
+
+    def submit(self, docx_bytes):
+        """Convert one .docx in the background. The future holds the PDF bytes."""
+
+        def convert_one():
+            pdf = self._convert_batch([docx_bytes])[0]
+            if pdf is None:
+                raise RuntimeError("LibreOffice could not convert the document")
+            return pdf
+
+        return self.executor.submit(convert_one)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.idle.empty():
+            self.idle.get().stop()
+        self._scratch.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,368 @@
+# Extract the ai_* fields of the comments with an LLM, many requests at a time
+import argparse
+import asyncio
+import logging
+import sys
+
+import aiohttp
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.ai_schema import AI_FIELDS, SYSTEM_PROMPT, packed_prompt, single_prompt
+from jobs.historical_scrape.bulk_load import bulk_upsert, connect
+from jobs.historical_scrape.llm_providers import MAX_TOKENS, PROVIDERS, RateLimited, make_provider
+from jobs.historical_scrape.near_duplicates import create_tables
+from jobs.historical_scrape.response_cache import ResponseCache, response_key, text_hash
+from jobs.historical_scrape.sql import (
+    CREATE_ENRICHMENT_STMT,
+    SELECT_UNENRICHED_LEADERS_STMT,
+    SELECT_UNENRICHED_STMT,
+    STAGE_ENRICHMENT_STMT,
+    UPSERT_ENRICHMENT_STMT,
+)
+from jobs.historical_scrape.structured_output import read_packed, read_single
+from jobs.historical_scrape.triage import FINAL, reasons
+
+# Requests in flight at once. The rate limiter of the provider still decides how fast they go
+CONCURRENCY: int = 16
+# Comments shorter than PACK_MAX_CHARS share a prompt, up to PACK_SIZE of them and PACK_CHARS in total
+PACK_SIZE: int = 8
+PACK_MAX_CHARS: int = 2000
+PACK_CHARS: int = 8000
+# Room kept in the answer for the fields of each packed comment
+ANSWER_TOKENS: int = 250
+# Comments longer than this are cut, so that a prompt always fits in the context of the model
+MAX_CHARS: int = 60000
+MAX_ATTEMPTS: int = 3
+# Comments read from the database at a time, and enriched comments written at a time
+READ_SIZE: int = 2000
+WRITE_SIZE: int = 500
+
+
+def pack(comments, pack_size=PACK_SIZE):
+    """Group `(comment_id, text)` pairs into the lists that are sent in one prompt.
+
+    Short comments are packed together until the group has `pack_size`
+    comments or `PACK_CHARS` characters. Longer ones go alone.
+    """
+    groups = []
+    group, size = [], 0
+    for comment_id, text in comments:
+        if len(text) >= PACK_MAX_CHARS or pack_size <= 1:
+            groups.append([(comment_id, text)])
+            continue
+        if len(group) >= pack_size or size + len(text) > PACK_CHARS:
+            groups.append(group)
+            group, size = [], 0
+        group.append((comment_id, text))
+        size += len(text)
+    if group:
+        groups.append(group)
+    return groups
+
+
+async def _ask(session, provider, group, errors):
+    # Returns ({comment_id: fields}, {comment_id: error}) for the comments of `group`.
+    # `errors` has what was wrong with the last answer for the comments asked again
+    if len(group) == 1:
+        comment_id, text = group[0]
+        system, user = single_prompt(text, errors.get(comment_id))
+        fields, error = read_single(await provider.complete(session, system, user, MAX_TOKENS))
+        return ({comment_id: fields}, {}) if fields is not None else ({}, {comment_id: error})
+
+    system, user = packed_prompt(
+        [text for _, text in group], [errors.get(comment_id) for comment_id, _ in group]
+    )
+    max_tokens = min(provider.max_output_tokens, ANSWER_TOKENS * len(group))
+    results, errors = read_packed(await provider.complete(session, system, user, max_tokens), len(group))
+    return (
+        {group[index][0]: fields for index, fields in results.items()},
+        {group[index][0]: error for index, error in errors.items()},
+    )
+
+
+async def _worker(queue, session, provider, deliver, retry, stats):
+    while True:
+        item = await queue.get()
+        if item is None:
+            queue.task_done()
+            return
+        group, errors = item
+        try:
+            try:
+                results, errors = await _ask(session, provider, group, errors)
+            except RateLimited:
+                # Not the comments' fault: the limiter holds every worker back until Retry-After
+                queue.put_nowait(item)
+                continue
+            except Exception as e:
+                logging.warning(f"Request for {len(group)} comments failed: {e}")
+                results, errors = {}, {}
+            stats["requests"] += 1
+            await deliver([(comment, results[comment[0]]) for comment in group if comment[0] in results])
+            # Called after every request, even with nothing missing, so that no failure waits forever
+            retry([(comment, errors.get(comment[0])) for comment in group if comment[0] not in results])
+        finally:
+            queue.task_done()
+
+
+async def enrich_comments(
+    comments, provider, on_result, concurrency=CONCURRENCY, pack_size=PACK_SIZE, cache=None
+):
+    """Enrich every `(comment_id, text)` of `comments` with `provider`.
+
+    `comments` is an async iterator of lists of comments, read as the queue
+    empties so that only a few lists are held at a time. `on_result(comment_id,
+    fields)` is awaited for every comment enriched, with the ai_* fields as a
+    dict. Answers are read and fixed locally (see structured_output.py). The
+    comments whose answer is still missing or invalid are asked again packed
+    together, told what was wrong, and left out after `MAX_ATTEMPTS`.
+
+    The answers are looked up in and stored to `cache` (a ResponseCache) when
+    one is given. Comments with the same normalised text as one already in
+    flight wait for its answer instead of being sent again. Returns the number
+    of requests sent, of comments answered from the cache or from a copy, of
+    comments asked again and of comments given up on.
+    """
+    queue = asyncio.Queue()
+    stats = {"requests": 0, "cached": 0, "copies": 0, "retried": 0, "failed": 0}
+    # The comment sent for each normalised text in flight, and the other comments with that text
+    in_flight = {}
+    copies = {}
+    # The answers asked for each comment so far, and the comments waiting to be asked again
+    attempts = {}
+    failed = []
+
+    async def deliver(answered):
+        if cache is not None:
+            cache.put_many(
+                (response_key(provider.model, SYSTEM_PROMPT, text), fields)
+                for (_, text), fields in answered
+            )
+        for (comment_id, text), fields in answered:
+            in_flight.pop(text_hash(text), None)
+            attempts.pop(comment_id, None)
+            for copy_id in [comment_id, *copies.pop(comment_id, ())]:
+                await on_result(copy_id, fields)
+
+    def give_up(comment):
+        comment_id, text = comment
+        in_flight.pop(text_hash(text), None)
+        stats["failed"] += 1 + len(copies.pop(comment_id, ()))
+
+    def retry(missing):
+        for comment, error in missing:
+            attempts[comment[0]] = attempts.get(comment[0], 0) + 1
+            if attempts[comment[0]] >= MAX_ATTEMPTS:
+                logging.error(f"Giving up on {comment[0]} after {MAX_ATTEMPTS} attempts")
+                attempts.pop(comment[0])
+                give_up(comment)
+            else:
+                failed.append((comment, error))
+        # The failures of many answers share a prompt, once there are enough of them to fill
+        # one or nothing else is left to send
+        if failed and (len(failed) >= pack_size or queue.empty()):
+            stats["retried"] += len(failed)
+            errors = {comment[0]: error for comment, error in failed}
+            for group in pack([comment for comment, _ in failed], pack_size):
+                queue.put_nowait((group, {comment_id: errors[comment_id] for comment_id, _ in group}))
+            failed.clear()
+
+    async def unanswered(chunk):
+        # Answers what the cache has, and returns the comments left to send
+        if cache is not None:
+            keys = [response_key(provider.model, SYSTEM_PROMPT, text) for _, text in chunk]
+            cached = cache.get_many(keys)
+            for (comment_id, _), key in zip(chunk, keys):
+                if key in cached:
+                    stats["cached"] += 1
+                    await on_result(comment_id, cached[key])
+            chunk = [comment for comment, key in zip(chunk, keys) if key not in cached]
+        send = []
+        for comment_id, text in chunk:
+            sent = in_flight.setdefault(text_hash(text), comment_id)
+            if sent == comment_id:
+                send.append((comment_id, text))
+            else:
+                stats["copies"] += 1
+                copies.setdefault(sent, []).append(comment_id)
+        return send
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        workers = [
+            asyncio.create_task(_worker(queue, session, provider, deliver, retry, stats))
+            for _ in range(concurrency)
+        ]
+
+        def check():
+            # A worker only stops early when on_result raised, which is the end of the run
+            for worker in workers:
+                if worker.done():
+                    for other in workers:
+                        other.cancel()
+                    worker.result()
+
+        async for chunk in comments:
+            chunk = [(comment_id, (text or "")[:MAX_CHARS]) for comment_id, text in chunk]
+            for group in pack(await unanswered(chunk), pack_size):
+                queue.put_nowait((group, {}))
+            # Read the next chunk once the workers are about to run out of this one
+            while queue.qsize() > concurrency:
+                check()
+                await asyncio.sleep(0.05)
+        joined = asyncio.ensure_future(queue.join())
+        await asyncio.wait([joined, *workers], return_when=asyncio.FIRST_COMPLETED)
+        if not joined.done():
+            joined.cancel()
+        check()
+        for _ in workers:
+            queue.put_nowait(None)
+        await asyncio.gather(*workers)
+    return stats
+
+
+async def _enrich(conn, provider, limit, concurrency, pack_size, cache, one_per_cluster, skip_trivial):
+    # The database is only used from one thread at a time
+    db_lock = asyncio.Lock()
+    pending = []
+    written = 0
+    trivial = {}
+
+    async def read():
+        after, remaining = "", limit
+        while remaining is None or remaining > 0:
+            size = READ_SIZE if remaining is None else min(READ_SIZE, remaining)
+            async with db_lock:
+                rows = await asyncio.to_thread(_select, conn, after, size, one_per_cluster)
+            if not rows:
+                return
+            after = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+            if not skip_trivial:
+                yield [(comment_id, text) for comment_id, text, _ in rows]
+                continue
+            # Comments with nothing to extract aren't sent. Only those that will never have
+            # anything get a row with null fields: the others are triaged again on the next run
+            send = []
+            for (comment_id, text, _), reason in zip(
+                rows, reasons([row[1] for row in rows], [row[2] for row in rows])
+            ):
+                if reason is None:
+                    send.append((comment_id, text))
+                    continue
+                trivial[reason] = trivial.get(reason, 0) + 1
+                if reason in FINAL:
+                    await write((comment_id, "triage", *(None for _ in AI_FIELDS), reason))
+            yield send
+
+    async def flush():
+        nonlocal written
+        rows = pending[:]
+        pending.clear()
+        async with db_lock:
+            written += await asyncio.to_thread(
+                bulk_upsert, conn, "comment_enrichment", STAGE_ENRICHMENT_STMT, UPSERT_ENRICHMENT_STMT, rows
+            )
+
+    async def write(row):
+        pending.append(row)
+        if len(pending) >= WRITE_SIZE:
+            await flush()
+
+    async def on_result(comment_id, fields):
+        await write((comment_id, provider.model, *(fields[field] for field in AI_FIELDS), None))
+
+    stats = await enrich_comments(read(), provider, on_result, concurrency, pack_size, cache)
+    await flush()
+    stats["trivial"] = trivial
+    return written, stats
+
+
+def _select(conn, after, limit, one_per_cluster):
+    statement = SELECT_UNENRICHED_LEADERS_STMT if one_per_cluster else SELECT_UNENRICHED_STMT
+    with conn, conn.cursor() as cur:
+        cur.execute(statement, {"after": after, "limit": limit})
+        return cur.fetchall()
+
+
+def enrich(
+    conn,
+    provider,
+    limit=None,
+    concurrency=CONCURRENCY,
+    pack_size=PACK_SIZE,
+    cache=None,
+    one_per_cluster=False,
+    skip_trivial=True,
+):
+    """Enrich the comments that have no row in comment_enrichment yet, up to `limit` of them.
+
+    Answers are reused from `cache` (a ResponseCache) when one is given. With
+    `one_per_cluster`, only the comment that leads each near-duplicate cluster
+    is enriched. With `skip_trivial`, the comments that triage finds nothing to
+    extract from (see triage.py) are never sent to the model. The empty and
+    boilerplate ones are written with null fields, the model "triage" and the
+    reason; the others, which an OCR or a new extraction of their attachment
+    can change, are left for a later run. Returns the number of comments
+    written to comment_enrichment.
+    """
+    with conn, conn.cursor() as cur:
+        cur.execute(CREATE_ENRICHMENT_STMT)
+    create_tables(conn)
+    written, stats = asyncio.run(
+        _enrich(conn, provider, limit, concurrency, pack_size, cache, one_per_cluster, skip_trivial)
+    )
+    logging.info(
+        f"Enriched {written} comments with {provider.model} in {stats['requests']} requests, "
+        f"{stats['cached']} from the cache, {stats['copies']} copies of another comment, "
+        f"{stats['retried']} asked again, {stats['failed']} failed, "
+        f"throttled {provider.limiter.throttled} times"
+    )
+    if stats["trivial"]:
+        logging.info(f"Skipped {sum(stats['trivial'].values())} trivial comments: {stats['trivial']}")
+    if cache is not None:
+        logging.info(f"Response cache: {cache.stats()}")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich the comments with an LLM")
+    parser.add_argument("--provider", choices=sorted(PROVIDERS), default="gemini")
+    parser.add_argument("--model", help="model of the provider, by default the one we picked")
+    parser.add_argument("--limit", type=int, help="enrich at most this many comments")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--pack-size", type=int, default=PACK_SIZE, help="1 to send every comment alone")
+    parser.add_argument("--requests-per-minute", type=int)
+    parser.add_argument("--tokens-per-minute", type=int)
+    parser.add_argument("--no-cache", action="store_true", help="ask the model again for every comment")
+    parser.add_argument(
+        "--one-per-cluster", action="store_true", help="skip the near-duplicates of another comment"
+    )
+    parser.add_argument(
+        "--no-triage", action="store_true", help="send the empty and boilerplate comments to the model too"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    provider = make_provider(
+        args.provider,
+        args.model,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+    )
+    cache = None if args.no_cache else ResponseCache()
+    conn = connect()
+    enrich(
+        conn,
+        provider,
+        args.limit,
+        args.concurrency,
+        args.pack_size,
+        cache,
+        args.one_per_cluster,
+        not args.no_triage,
+    )
+    conn.close()
@@ -0,0 +1,267 @@
+# Export the database to a local Parquet dataset for analysis, so notebooks don't query production
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pytz
+import pyarrow.dataset as ds
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.bulk_load import connect
+from jobs.historical_scrape.comment_batch import COLUMNS, CommentBatch
+from jobs.historical_scrape.sql import (
+    CREATE_EXPORT_INDEX_STMT,
+    DROP_EXPORT_INDEX_STMT,
+    SELECT_EXPORT_COMMENTS_STMT,
+    SELECT_EXPORT_DAYS_STMT,
+    SELECT_EXPORT_INDEX_VALID_STMT,
+)
+
+LAKE_PATH: str = os.getenv("LAKE_PATH", os.path.expanduser("~/.cache/commons/lake"))
+# Comments per Parquet file, and per round trip of the server-side cursor
+CHUNK_SIZE: int = 10000
+STATE_FILE: str = "_export_state.json"
+
+# Hive style directories, like comments/agency_id=EPA/data_date=2024-01-02/part-0-0.parquet.
+# data_date is the day the comment was posted in Eastern time, which is the day run.py scraped it for
+COMMENT_PARTITIONING = ds.partitioning(
+    pa.schema([("agency_id", pa.string()), ("data_date", pa.string())]), flavor="hive"
+)
+AGENCY_PARTITIONING = ds.partitioning(pa.schema([("agency_id", pa.string())]), flavor="hive")
+# regulations.gov filters postedDate by the day in Eastern time
+POSTED_TIMEZONE = pytz.timezone("America/New_York")
+
+
+def _read_state(root):
+    path = os.path.join(root, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_state(root, state):
+    path = os.path.join(root, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _write_comments(root, rows, chunk):
+    # rows are the columns of SELECT_EXPORT_COMMENTS_STMT, all from the same day and agency
+    values = list(zip(*rows))
+    table = CommentBatch(dict(zip(COLUMNS, values))).to_arrow()
+    table = table.append_column("data_date", pa.array(values[-1], type=pa.string()))
+    ds.write_dataset(
+        table,
+        os.path.join(root, "comments"),
+        format="parquet",
+        partitioning=COMMENT_PARTITIONING,
+        basename_template=f"part-{chunk}-{{i}}.parquet",
+        # The first chunk of a partition replaces what an earlier export wrote in it
+        existing_data_behavior="delete_matching" if chunk == 0 else "overwrite_or_ignore",
+    )
+
+
+def day_range(data_date):
+    """Return the first and the next-day bounds of posted_date for the comments of `data_date`, in UTC."""
+    start = POSTED_TIMEZONE.localize(datetime.strptime(data_date, "%Y-%m-%d"))
+    end = POSTED_TIMEZONE.localize(datetime.strptime(data_date, "%Y-%m-%d") + timedelta(days=1))
+    return tuple(bound.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ") for bound in (start, end))
+
+
+def index_state(conn):
+    """Return True if the posted_date index is usable, False if a build left it invalid, None if there is none."""
+    with conn, conn.cursor() as cur:
+        cur.execute(SELECT_EXPORT_INDEX_VALID_STMT)
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def create_index(conn):
+    """Index comments.posted_date without blocking the scrapers writing to it.
+
+    A migration, run once with `export.py --create-index`: the export itself
+    never changes the database. An index left invalid by a build that failed
+    or was interrupted is dropped and built again.
+    """
+    state = index_state(conn)
+    if state:
+        return
+    # CREATE INDEX CONCURRENTLY can't run in a transaction
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if state is False:
+                logging.info("Dropping the invalid index on comments.posted_date")
+                cur.execute(DROP_EXPORT_INDEX_STMT)
+            logging.info("Indexing comments.posted_date")
+            cur.execute(CREATE_EXPORT_INDEX_STMT)
+    finally:
+        conn.autocommit = False
+
+
+def export_comments(conn, root, days=None):
+    """Write the comments posted on `days` (all of them if None) to `root`/comments.
+
+    The comments are streamed with a server-side cursor, sorted by day and
+    agency, and each partition is written in files of `CHUNK_SIZE` comments,
+    so the export never holds more than a chunk. Each day is read as a range
+    of posted_date, which the index of `create_index` serves. Returns the
+    number of comments written. The comments with no posted_date are only
+    exported with all the others, with a null data_date.
+    """
+    if days is None:
+        return _export_comments(conn, root, None, None)
+    return sum(_export_comments(conn, root, *day_range(day)) for day in days)
+
+
+def _export_comments(conn, root, start, end):
+    exported = 0
+    with conn.cursor(name="export_comments") as cur:
+        cur.itersize = CHUNK_SIZE
+        cur.execute(SELECT_EXPORT_COMMENTS_STMT, {"start": start, "end": end})
+        partition, rows, chunk = None, [], 0
+        for row in cur:
+            # The rows come sorted by day and agency, so each partition is written in one go
+            if (row[-1], row[2]) != partition or len(rows) >= CHUNK_SIZE:
+                if rows:
+                    _write_comments(root, rows, chunk)
+                    exported += len(rows)
+                chunk = chunk + 1 if (row[-1], row[2]) == partition else 0
+                partition, rows = (row[-1], row[2]), []
+            rows.append(row)
+        if rows:
+            _write_comments(root, rows, chunk)
+            exported += len(rows)
+    conn.commit()
+    return exported
+
+
+def export_table(conn, root, table):
+    """Rewrite the whole `table` (dockets or documents) under `root`, partitioned by agency_id."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM {table};")
+        names = [column.name for column in cur.description]
+        rows = [dict(zip(names, row)) for row in cur.fetchall()]
+    conn.commit()
+    path = os.path.join(root, table)
+    shutil.rmtree(path, ignore_errors=True)
+    if rows:
+        ds.write_dataset(
+            pa.Table.from_pylist(rows),
+            path,
+            format="parquet",
+            partitioning=AGENCY_PARTITIONING,
+        )
+    return len(rows)
+
+
+def export(conn, root=LAKE_PATH, full=False):
+    """Bring the Parquet dataset in `root` up to date with the database.
+
+    Only the days whose status row was written after the last export are
+    exported again, based on their scrape_timestamp. With `full`, every
+    comment is exported, including the ones that no status row covers (from
+    docket_sync for example). The dockets and documents tables are small, so
+    they are always rewritten whole.
+    """
+    os.makedirs(root, exist_ok=True)
+    state = {} if full else _read_state(root)
+
+    with conn.cursor() as cur:
+        cur.execute(SELECT_EXPORT_DAYS_STMT, {"since": state.get("scrape_timestamp")})
+        status = cur.fetchall()
+    conn.commit()
+    days = sorted({data_date for data_date, _ in status})
+
+    if full:
+        comments = export_comments(conn, root)
+    elif days:
+        if not index_state(conn):
+            logging.warning(
+                "comments.posted_date has no valid index, so every day is a scan of the whole table. "
+                "Run export.py --create-index once"
+            )
+        comments = export_comments(conn, root, days)
+    else:
+        comments = 0
+    dockets = export_table(conn, root, "dockets")
+    documents = export_table(conn, root, "documents")
+
+    if status:
+        state["scrape_timestamp"] = max(scrape_timestamp for _, scrape_timestamp in status)
+    _write_state(root, state)
+    logging.info(
+        f"Exported {comments} comments from {len(days)} days, {dockets} dockets and {documents} documents to {root}"
+    )
+    return comments
+
+
+def _dataset(root, table):
+    partitioning = COMMENT_PARTITIONING if table == "comments" else AGENCY_PARTITIONING
+    return ds.dataset(os.path.join(root, table), format="parquet", partitioning=partitioning)
+
+
+def read_comments(
+    root=LAKE_PATH, columns=None, agency_id=None, start_date=None, end_date=None, filter=None
+):
+    """Read comments from the Parquet dataset into an Arrow table.
+
+    `agency_id` (one id or a list) and the `start_date` / `end_date` range of
+    data_date (inclusive, "YYYY-MM-DD") only open the matching partitions.
+    `filter` is any other pyarrow.dataset expression, which is checked against
+    the statistics of each file before it is read, for example
+    `ds.field("docket_id") == "EPA-HQ-OAR-2021-0317"`. Call `.to_pandas()` on
+    the result for a DataFrame.
+    """
+    expression = filter
+    conditions = []
+    if agency_id is not None:
+        if isinstance(agency_id, str):
+            conditions.append(ds.field("agency_id") == agency_id)
+        else:
+            conditions.append(ds.field("agency_id").isin(list(agency_id)))
+    if start_date is not None:
+        conditions.append(ds.field("data_date") >= start_date)
+    if end_date is not None:
+        conditions.append(ds.field("data_date") <= end_date)
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return _dataset(root, "comments").to_table(columns=columns, filter=expression)
+
+
+def read_dockets(root=LAKE_PATH, columns=None, filter=None):
+    return _dataset(root, "dockets").to_table(columns=columns, filter=filter)
+
+
+def read_documents(root=LAKE_PATH, columns=None, filter=None):
+    return _dataset(root, "documents").to_table(columns=columns, filter=filter)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the database to a Parquet dataset")
+    parser.add_argument("--path", default=LAKE_PATH, help="directory of the dataset")
+    parser.add_argument(
+        "--full", action="store_true", help="export every comment, not only the new days"
+    )
+    parser.add_argument(
+        "--create-index",
+        action="store_true",
+        help="index comments.posted_date for the incremental export instead of exporting",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    conn = connect()
+    if args.create_index:
+        create_index(conn)
+    else:
+        export(conn, args.path, args.full)
+    conn.close()
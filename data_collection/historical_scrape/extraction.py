@@ -0,0 +1,58 @@
+from io import BytesIO
+
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTChar, LTTextContainer
+
+# Only the first pages of an attachment are read
+MAX_PAGES: int = 3
+
+
+def _line_formats(element):
+    # Find the unique font names and sizes used in a text element
+    formats = set()
+    for text_line in element:
+        if isinstance(text_line, LTTextContainer):
+            for character in text_line:
+                if isinstance(character, LTChar):
+                    formats.add(character.fontname)
+                    formats.add(character.size)
+    return list(formats)
+
+
+def _text_elements(page):
+    # The text elements of a page, sorted from the top of the page to the bottom
+    elements = [element for element in page if isinstance(element, LTTextContainer)]
+    elements.sort(key=lambda element: element.y1, reverse=True)
+    return elements
+
+
+def extract_text(pdf_bytes, max_pages=MAX_PAGES):
+    """Extract the text of the first pages of a PDF given as bytes.
+
+    The document is parsed once by pdfminer, and only up to `max_pages`.
+    Each page is prefixed with a blank line, as the database expects.
+    """
+    result = ""
+    for page in extract_pages(BytesIO(pdf_bytes), maxpages=max_pages):
+        page_text = "".join(element.get_text() for element in _text_elements(page))
+        result = result + "\n \n" + page_text
+    return result
+
+
+def extract_text_with_formats(pdf_bytes, max_pages=MAX_PAGES):
+    """Like `extract_text`, but also return the fonts used on each line.
+
+    Returns the text and a list with, for every page, a list of
+    `(line_text, [font names and sizes])` tuples. Walking every character for
+    its font is slow, so only use this when the formats are needed.
+    """
+    result = ""
+    formats = []
+    for page in extract_pages(BytesIO(pdf_bytes), maxpages=max_pages):
+        lines = [
+            (element.get_text(), _line_formats(element))
+            for element in _text_elements(page)
+        ]
+        result = result + "\n \n" + "".join(line_text for line_text, _ in lines)
+        formats.append(lines)
+    return result, formats
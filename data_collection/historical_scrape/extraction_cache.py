@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_PATH: str = os.getenv(
+    "EXTRACTION_CACHE_PATH", os.path.expanduser("~/.cache/commons/extraction.sqlite")
+)
+# Size of the extracted text kept before the least recently used entries are evicted
+MAX_BYTES: int = 2 * 1024**3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    content_hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS texts_last_used ON texts (last_used);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS urls_content_hash ON urls (content_hash);
+"""
+
+
+def hash_content(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class ExtractionCache:
+    """Local cache of the text extracted from attachments.
+
+    Text is stored once per content hash, and every attachment URL points to
+    the hash of the file it served. A URL hit saves both the download and the
+    parse, a hash hit (the same file under another URL) saves the parse.
+    Entries are evicted least recently used first once the text stored goes
+    over `max_bytes`. The cache is a SQLite file, so the daily and historical
+    jobs can share it, and one cache can be shared between threads.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # One connection for every thread, used under `lock`
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.max_bytes = max_bytes
+        # Kept up to date as texts are stored, so that a put doesn't have to sum the table
+        self.bytes = self.size()
+        self.hits = 0
+        self.misses = 0
+
+    def _touch(self, content_hash):
+        row = self.conn.execute(
+            "SELECT text FROM texts WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE texts SET last_used = ? WHERE content_hash = ?",
+                (time.time(), content_hash),
+            )
+        self.hits += 1
+        return row[0]
+
+    def get_by_url(self, url):
+        """Return the text extracted from `url`, or None if it isn't cached."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._touch(row[0])
+
+    def get_by_hash(self, content_hash):
+        """Return the text extracted from a file with this content hash, or None."""
+        with self.lock:
+            return self._touch(content_hash)
+
+    def put(self, url, content_hash, text):
+        """Store the text extracted from the file with `content_hash` served at `url`."""
+        with self.lock:
+            self._put(url, content_hash, text)
+            self._evict()
+
+    def _put(self, url, content_hash, text):
+        size = len(text.encode())
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO texts (content_hash, text, size, last_used) VALUES (?, ?, ?, ?)",
+                (content_hash, text, size, time.time()),
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO urls (url, content_hash) VALUES (?, ?)",
+                (url, content_hash),
+            )
+        self.bytes += size
+
+    def size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+
+    def evict(self):
+        """Drop the least recently used texts until the cache fits in `max_bytes`."""
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        if self.bytes <= self.max_bytes:
+            return
+        # Replaced texts and the other jobs sharing the file make the running total drift
+        self.bytes = self.size()
+        excess = self.bytes - self.max_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        with self.conn:
+            while freed < excess:
+                # The oldest texts, a page at a time, so the whole index is never read at once
+                rows = self.conn.execute(
+                    "SELECT content_hash, size FROM texts ORDER BY last_used LIMIT 1000"
+                ).fetchall()
+                if not rows:
+                    break
+                for content_hash, size in rows:
+                    self.conn.execute("DELETE FROM texts WHERE content_hash = ?", (content_hash,))
+                    self.conn.execute("DELETE FROM urls WHERE content_hash = ?", (content_hash,))
+                    freed += size
+                    if freed >= excess:
+                        break
+        self.bytes -= freed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,67 @@
+import os
+import signal
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from jobs.historical_scrape.extraction import extract_text
+
+# Stop parsing an attachment after this many seconds
+ATTACHMENT_TIMEOUT: int = 120
+# Most attachments waiting to be parsed at once, to bound the memory held by their bytes
+MAX_PENDING: int = 64
+
+
+class AttachmentTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise AttachmentTimeout()
+
+
+def _extract(comment_id, content, timeout, extractor):
+    # Runs in a worker process. The alarm interrupts pdfminer if a document takes too long,
+    # so one pathological PDF doesn't hold on to the worker
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return extractor(content)
+    except AttachmentTimeout:
+        raise AttachmentTimeout(f"{comment_id}: gave up after {timeout}s") from None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class ExtractionPool:
+    """Bounded pool of processes that extract the text of attachments.
+
+    `submit(comment_id, content)` returns a future with the text `extractor`
+    gets out of the attachment bytes, by default the PDF extractor. Once
+    `max_pending` attachments are waiting, `submit` blocks until one of them
+    is done. Use it as a context manager so the workers are shut down.
+    """
+
+    def __init__(self, max_workers=None, timeout=ATTACHMENT_TIMEOUT, max_pending=MAX_PENDING):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = deque()
+
+    def submit(self, comment_id, content, extractor=extract_text):
+        while len(self.pending) >= self.max_pending:
+            wait(self.pending, return_when=FIRST_COMPLETED)
+            self.pending = deque(f for f in self.pending if not f.done())
+        future = self.executor.submit(_extract, comment_id, content, self.timeout, extractor)
+        self.pending.append(future)
+        return future
+
+    def result(self, future):
+        """Wait for the text of an attachment, raising if it failed or timed out."""
+        # The worker enforces the timeout itself, this is only a backstop
+        return future.result(timeout=self.timeout * 2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.key_pool import KeyPool
+
+API_URL: str = os.getenv("REGGOV_API_URL", "https://api.regulations.gov/v4")
+
+MAX_CONNECTIONS: int = 30
+MAX_ATTEMPTS: int = 5
+# Seconds before retrying a server error or a dropped connection, doubled after each attempt
+RETRY_DELAY: float = 1.0
+
+
+def retryable(status):
+    """Whether a request that got `status` (None when there was no response) can pass if tried again."""
+    return status is None or status == 429 or status >= 500
+
+
+async def _fetch_comment(session, comment_id, key_pool):
+    key = await key_pool.acquire_async()
+    url = f"{API_URL}/comments/{comment_id}?include=attachments&api_key={key.api_key}"
+    status, headers = None, None
+    try:
+        async with session.get(url) as response:
+            status, headers = response.status, response.headers
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                    message=await response.text(),
+                )
+            return await response.json(content_type=None)
+    finally:
+        # Let the pool see the rate-limit headers, or the failure if there was no response
+        key_pool.update(key, status, headers)
+
+
+async def _worker(queue, session, key_pool, results, archive, stats):
+    while True:
+        item = await queue.get()
+        if item is None:
+            queue.task_done()
+            return
+        index, comment_id, attempt = item
+        try:
+            result = await _fetch_comment(session, comment_id, key_pool)
+        except Exception as e:
+            status = e.status if isinstance(e, aiohttp.ClientResponseError) else None
+            if not retryable(status):
+                # A 404 or a bad request won't pass the next time either
+                logging.error(f"Giving up on {comment_id}: {e}")
+            elif attempt + 1 < MAX_ATTEMPTS:
+                logging.warning(f"Failed to fetch {comment_id}: {e}. Retrying")
+                if status != 429:
+                    # A 429 parks the key in the pool already, the rest backs off here
+                    await asyncio.sleep(RETRY_DELAY * 2**attempt)
+                # Put the comment back at the end of the queue so it is retried with another key
+                queue.put_nowait((index, comment_id, attempt + 1))
+            else:
+                logging.error(f"Giving up on {comment_id} after {MAX_ATTEMPTS} attempts: {e}")
+        else:
+            stats["fetched"] += 1
+            if results is not None:
+                results[index] = result
+            if archive is not None:
+                try:
+                    await asyncio.to_thread(archive, comment_id, result)
+                except Exception as e:
+                    logging.error(f"Failed to archive {comment_id}: {e}")
+        queue.task_done()
+
+
+async def fetch_comments(ids, key_pool=None, archive=None, max_connections=MAX_CONNECTIONS, keep=True):
+    """Fetch the details of every comment in `ids` using all the keys at once.
+
+    Requests are spread over the keys of `key_pool` (by default the historical
+    keys) and share one connection pool. Failed requests are put back on the
+    queue so they are retried, usually with another key, after a growing delay
+    for server errors and dropped connections. Other 4xx are not retried. `archive(comment_id,
+    result)` is called in a thread for every comment fetched. Returns the API
+    responses in the same order as `ids`, leaving out the comments that could
+    not be fetched. Without `keep`, the responses are only handed to
+    `archive`, so they don't stay in memory, and the number fetched is
+    returned instead.
+    """
+    if key_pool is None:
+        key_pool = KeyPool.from_env()
+
+    queue = asyncio.Queue()
+    for index, comment_id in enumerate(ids):
+        queue.put_nowait((index, comment_id, 0))
+
+    results = [None] * len(ids) if keep else None
+    stats = {"fetched": 0}
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        workers = [
+            asyncio.create_task(_worker(queue, session, key_pool, results, archive, stats))
+            for _ in range(max_connections)
+        ]
+        await queue.join()
+        for _ in workers:
+            queue.put_nowait(None)
+        await asyncio.gather(*workers)
+
+    logging.info(f"Key usage: {key_pool.usage()}")
+    if not keep:
+        return stats["fetched"]
+    return [result for result in results if result is not None]
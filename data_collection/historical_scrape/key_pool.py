@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import config  # pylint: disable=unused-import
+
+# The API keys used for the historical scrape
+HISTORICAL_KEYS = [
+    "L01",
+    "L02",
+    "L03",
+    "L04",
+    "L05",
+    "J06",
+    "J07",
+    "J08",
+    "J09",
+    "J10",
+    "H11",
+    "M12",
+    "M13",
+    "M14",
+    "M15",
+]
+
+# regulations.gov allows 1000 requests per rolling hour per key
+REQUESTS_PER_HOUR: int = 1000
+WINDOW_SECONDS: int = 3600
+BURST: int = 50
+
+
+def retry_after(value, default):
+    """Return the seconds to wait from a Retry-After header, or `default` if it can't be read.
+
+    The header is either a number of seconds or an HTTP date.
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        until = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return default
+    if until.tzinfo is None:
+        until = until.replace(tzinfo=timezone.utc)
+    return max(0.0, (until - datetime.now(timezone.utc)).total_seconds())
+
+
+def header_int(value):
+    """Return a rate limit header as an int, or None when it is missing or can't be read."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class KeyState:
+    """Budget and usage counters for one API key."""
+
+    def __init__(self, name, api_key, limit, burst):
+        self.name = name
+        self.api_key = api_key
+        self.limit = limit
+        self.remaining = limit
+        self.parked_until = 0.0
+        # Token bucket that keeps a key from spending its hour in one burst
+        self.rate = limit / WINDOW_SECONDS
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.parked_until and now >= self.parked_until:
+            # The window has reset, so the key gets its full budget back
+            self.parked_until = 0.0
+            self.remaining = self.limit
+
+    def wait_time(self, now):
+        if self.parked_until:
+            return self.parked_until - now
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class KeyPool:
+    """Scheduler that spreads requests over a set of API keys.
+
+    Every request goes to the key with the most budget left. The budget comes
+    from the `X-RateLimit-Remaining` header of that key's last response, and
+    keys that answer 429 or run out are parked until their window resets.
+    Call `acquire` (or `acquire_async`) before each request and `update` with
+    the response afterwards. The pool is safe to share between threads.
+    """
+
+    def __init__(self, api_keys, limit=REQUESTS_PER_HOUR, burst=BURST):
+        self.keys = {
+            name: KeyState(name, api_key, limit, burst)
+            for name, api_key in api_keys.items()
+        }
+        if not self.keys:
+            raise ValueError("KeyPool needs at least one API key")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, names=HISTORICAL_KEYS, **kwargs):
+        """Build a pool from the `REGGOV_API_KEY_{name}` environment variables."""
+        api_keys = {}
+        for name in names:
+            api_key = os.getenv(f"REGGOV_API_KEY_{name}")
+            if api_key:
+                api_keys[name] = api_key
+            else:
+                logging.warning(f"REGGOV_API_KEY_{name} is not set, leaving it out")
+        return cls(api_keys, **kwargs)
+
+    def _reserve(self):
+        # Returns (key, 0) when a key is free, or (None, seconds to wait)
+        now = time.monotonic()
+        with self.lock:
+            best = None
+            wait = None
+            for key in self.keys.values():
+                key.refill(now)
+                key_wait = key.wait_time(now)
+                if key_wait > 0:
+                    wait = key_wait if wait is None else min(wait, key_wait)
+                elif best is None or (key.remaining - key.in_flight) > (
+                    best.remaining - best.in_flight
+                ):
+                    best = key
+            if best is None:
+                return None, wait
+            best.tokens -= 1
+            best.in_flight += 1
+            best.requests += 1
+            return best, 0
+
+    def acquire(self):
+        """Block until a key has budget and return its `KeyState`."""
+        while True:
+            key, wait = self._reserve()
+            if key is not None:
+                return key
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Like `acquire`, but waits without blocking the event loop."""
+        while True:
+            key, wait = self._reserve()
+            if key is not None:
+                return key
+            await asyncio.sleep(wait)
+
+    def update(self, key, status, headers=None):
+        """Record the response to a request made with `key`.
+
+        `status` is the HTTP status code, or None when the request never got
+        a response.
+        """
+        headers = headers or {}
+        now = time.monotonic()
+        with self.lock:
+            key.in_flight -= 1
+            # Called from the finally of a fetch, so a header that can't be read is ignored
+            remaining = header_int(headers.get("X-RateLimit-Remaining"))
+            if remaining is not None:
+                key.remaining = remaining
+            limit = header_int(headers.get("X-RateLimit-Limit"))
+            if limit is not None:
+                key.limit = limit
+
+            if status == 429:
+                key.throttled += 1
+                key.remaining = 0
+            elif status is not None and status < 400:
+                key.successes += 1
+            else:
+                key.errors += 1
+
+            if key.remaining <= 0 and not key.parked_until:
+                delay = retry_after(headers.get("Retry-After"), WINDOW_SECONDS)
+                key.parked_until = now + delay
+                logging.info(f"Key {key.name} is out of requests, parking it for {delay:.0f}s")
+
+    def usage(self):
+        """Return the usage counters of every key."""
+        now = time.monotonic()
+        with self.lock:
+            return {
+                key.name: {
+                    "requests": key.requests,
+                    "successes": key.successes,
+                    "throttled": key.throttled,
+                    "errors": key.errors,
+                    "remaining": key.remaining,
+                    "limit": key.limit,
+                    "parked_for": max(0.0, key.parked_until - now),
+                }
+                for key in self.keys.values()
+            }
@@ -0,0 +1,225 @@
+# The LLM APIs the comments can be enriched with, called over HTTP with a rate limit per provider
+import asyncio
+import os
+import time
+
+import aiohttp
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.key_pool import retry_after
+
+# The models picked in data_analysis/how_we_chose_an_ai_model
+DEFAULT_MODELS = {
+    "anthropic": "claude-3-haiku-20240307",
+    "openai": "gpt-3.5-turbo-1106",
+    "gemini": "gemini-1.0-pro",
+}
+MAX_TOKENS: int = 1024
+# Rough size of a token, to count prompts against the tokens per minute without a tokenizer
+CHARS_PER_TOKEN: int = 4
+
+
+class RateLimited(Exception):
+    """The provider answered 429."""
+
+
+class RateLimiter:
+    """Token buckets for the requests and the tokens a provider allows per minute.
+
+    `acquire` waits until both buckets can pay for the request, so the
+    limiter can be shared by every task calling the same provider. After a
+    429, `pause` stops everyone until the provider's Retry-After has passed.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_rate = requests_per_minute / 60
+        self.token_rate = tokens_per_minute / 60
+        # Allow a few seconds worth of burst, not a minute's worth
+        self.request_capacity = max(1.0, self.request_rate * 5)
+        self.token_capacity = max(1.0, self.token_rate * 5)
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled = 0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+        self.updated = now
+
+    async def acquire(self, tokens):
+        # A prompt bigger than the bucket would never fit, it goes through once the bucket is full
+        tokens = min(tokens, self.token_capacity)
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                wait = self.paused_until - now
+            elif self.requests >= 1 and self.tokens >= tokens:
+                self.requests -= 1
+                self.tokens -= tokens
+                return
+            else:
+                wait = max(
+                    (1 - self.requests) / self.request_rate,
+                    (tokens - self.tokens) / self.token_rate,
+                )
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class Provider:
+    """One model of one LLM API.
+
+    Subclasses say how to build a request (`request`) and where the text is in
+    the response (`text`). `complete` sends the request once, under the rate
+    limit of the provider, and leaves retrying to the caller. The API key and
+    URL come from `{NAME}_API_KEY` and `{NAME}_API_URL`, so the provider can be
+    pointed at stub_model_server.py.
+    """
+
+    name = None
+    api_url = None
+    # The limits of the lowest paid tier of each API as of 2024, which the constructor can raise
+    requests_per_minute = None
+    tokens_per_minute = None
+    # The longest answer the model can give, which bounds how many comments fit in one prompt
+    max_output_tokens = None
+
+    def __init__(self, model=None, api_key=None, api_url=None, requests_per_minute=None, tokens_per_minute=None):
+        prefix = self.name.upper()
+        self.model = model or DEFAULT_MODELS[self.name]
+        self.api_key = api_key or os.getenv(f"{prefix}_API_KEY", "")
+        self.api_url = (api_url or os.getenv(f"{prefix}_API_URL") or self.api_url).rstrip("/")
+        self.limiter = RateLimiter(
+            requests_per_minute or self.requests_per_minute,
+            tokens_per_minute or self.tokens_per_minute,
+        )
+
+    def request(self, system, user, max_tokens):
+        """Return the (url, headers, json body) of a request."""
+        raise NotImplementedError
+
+    def text(self, response):
+        """Return the text the model answered from the decoded JSON `response`."""
+        raise NotImplementedError
+
+    async def complete(self, session, system, user, max_tokens=MAX_TOKENS):
+        tokens = (len(system) + len(user)) // CHARS_PER_TOKEN + max_tokens
+        await self.limiter.acquire(tokens)
+        url, headers, body = self.request(system, user, max_tokens)
+        async with session.post(url, headers=headers, json=body) as response:
+            if response.status == 429:
+                self.limiter.pause(retry_after(response.headers.get("Retry-After"), 10))
+                raise RateLimited(f"{self.name} answered 429")
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info,
+                    response.history,
+                    status=response.status,
+                    message=await response.text(),
+                )
+            return self.text(await response.json(content_type=None))
+
+
+class AnthropicProvider(Provider):
+    # make_claude_request in testing-models.ipynb
+    name = "anthropic"
+    api_url = "https://api.anthropic.com"
+    requests_per_minute = 50
+    tokens_per_minute = 50000
+    max_output_tokens = 4096
+
+    def request(self, system, user, max_tokens):
+        headers = {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}
+        body = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "system": system,
+            "messages": [{"role": "user", "content": user}],
+        }
+        return f"{self.api_url}/v1/messages", headers, body
+
+    def text(self, response):
+        return "".join(block["text"] for block in response["content"] if block["type"] == "text")
+
+
+class OpenAIProvider(Provider):
+    # ask_gpt in testing-models.ipynb
+    name = "openai"
+    api_url = "https://api.openai.com"
+    requests_per_minute = 500
+    tokens_per_minute = 60000
+    max_output_tokens = 4096
+
+    def request(self, system, user, max_tokens):
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        body = {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+        }
+        return f"{self.api_url}/v1/chat/completions", headers, body
+
+    def text(self, response):
+        return response["choices"][0]["message"]["content"]
+
+
+class GeminiProvider(Provider):
+    # make_gemini_request in testing-models.ipynb
+    name = "gemini"
+    api_url = "https://generativelanguage.googleapis.com"
+    requests_per_minute = 360
+    tokens_per_minute = 120000
+    max_output_tokens = 2048
+
+    SAFETY_SETTINGS = [
+        {"category": category, "threshold": "BLOCK_NONE"}
+        for category in (
+            "HARM_CATEGORY_HARASSMENT",
+            "HARM_CATEGORY_HATE_SPEECH",
+            "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+            "HARM_CATEGORY_DANGEROUS_CONTENT",
+        )
+    ]
+
+    def request(self, system, user, max_tokens):
+        # gemini-1.0-pro has no system instruction, so it goes at the start of the prompt
+        body = {
+            "contents": [{"role": "user", "parts": [{"text": f"{system}\n{user}"}]}],
+            "generationConfig": {"temperature": 0, "maxOutputTokens": max_tokens},
+            "safetySettings": self.SAFETY_SETTINGS,
+        }
+        url = f"{self.api_url}/v1beta/models/{self.model}:generateContent?key={self.api_key}"
+        return url, {}, body
+
+    def text(self, response):
+        candidates = response.get("candidates")
+        if not candidates or "content" not in candidates[0]:
+            raise ValueError(f"Gemini returned no answer: {response.get('promptFeedback')}")
+        return "".join(part.get("text", "") for part in candidates[0]["content"]["parts"])
+
+
+PROVIDERS = {
+    "anthropic": AnthropicProvider,
+    "openai": OpenAIProvider,
+    "gemini": GeminiProvider,
+}
+
+
+def make_provider(name, model=None, **kwargs):
+    """Return the provider called `name` ("anthropic", "openai" or "gemini") for `model`."""
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown provider {name}, expected one of {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](model, **kwargs)
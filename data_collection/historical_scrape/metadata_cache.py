@@ -0,0 +1,88 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+METADATA_CACHE_PATH: str = os.getenv(
+    "METADATA_CACHE_PATH", os.path.expanduser("~/.cache/commons/metadata.sqlite")
+)
+# Bounds on how long fetched metadata is trusted before it is fetched again
+MIN_TTL: int = 24 * 3600
+MAX_TTL: int = 30 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+"""
+
+
+def ttl(modify_date, now=None):
+    """Return how long to keep metadata last modified at `modify_date`, in seconds.
+
+    Something that hasn't changed for a long time is unlikely to change soon,
+    so metadata is kept for half the time since its last modification, within
+    `MIN_TTL` and `MAX_TTL`. Without a modification date it gets `MIN_TTL`.
+    """
+    now = time.time() if now is None else now
+    try:
+        modified = datetime.strptime(modify_date, "%Y-%m-%dT%H:%M:%SZ")
+    except (TypeError, ValueError):
+        return MIN_TTL
+    age = now - modified.replace(tzinfo=timezone.utc).timestamp()
+    return min(MAX_TTL, max(MIN_TTL, age / 2))
+
+
+class MetadataCache:
+    """Local cache of the docket and document metadata, so it isn't fetched every day.
+
+    Entries are stored under a `kind` ("dockets" or "documents") and expire
+    after a time that depends on when they were last modified (see `ttl`).
+    The cache is a SQLite file, so consecutive runs can share it.
+    """
+
+    def __init__(self, path=METADATA_CACHE_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, kind, ids):
+        """Return a dict of the entries of `ids` that are cached and still fresh."""
+        found = {}
+        now = time.time()
+        ids = list(ids)
+        # Stay under SQLite's limit on the number of parameters of a query
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            rows = self.conn.execute(
+                f"SELECT id, value FROM metadata WHERE kind = ? AND expires > ? "
+                f"AND id IN ({', '.join('?' * len(chunk))})",
+                (kind, now, *chunk),
+            ).fetchall()
+            found.update((id, json.loads(value)) for id, value in rows)
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        return found
+
+    def put_many(self, kind, items, modify_key):
+        """Store the `(id, value)` pairs of `items`, which expire based on `value[modify_key]`."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (kind, id, value, expires) VALUES (?, ?, ?, ?)",
+                (
+                    (kind, id, json.dumps(value), now + ttl(value.get(modify_key), now))
+                    for id, value in items
+                ),
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,271 @@
+# Group the near-identical comments of mass comment campaigns into clusters
+import argparse
+import hashlib
+import logging
+import re
+import sys
+import zlib
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.sql import (
+    CREATE_NEAR_DUPLICATES_STMT,
+    DELETE_NEAR_DUPLICATES_STMT,
+    INSERT_NEAR_DUPLICATE_BUCKETS_STMT,
+    INSERT_NEAR_DUPLICATES_STMT,
+    LOCK_NEAR_DUPLICATES_STMT,
+    MOVE_CLUSTER_STMT,
+    SELECT_INDEXED_SIGNATURES_STMT,
+    SELECT_INDEXED_STMT,
+    SELECT_NEAR_DUPLICATE_CANDIDATES_STMT,
+    SELECT_NEAR_DUPLICATES_EXIST_STMT,
+    SELECT_NEXT_LEADER_STMT,
+    SELECT_UNINDEXED_STMT,
+)
+
+# Words per shingle. Five words are specific enough that two unrelated comments rarely share many
+SHINGLE_SIZE: int = 5
+# 16 bands of 8 rows make comments with a Jaccard similarity of 0.7 or more likely to share a bucket
+NUM_PERM: int = 128
+BANDS: int = 16
+ROWS: int = NUM_PERM // BANDS
+# Share of the signature two comments must have in common to be in the same cluster
+THRESHOLD: float = 0.8
+# Comments indexed per transaction when the index is built for the comments already stored
+CHUNK_SIZE: int = 5000
+
+# Largest prime under 2**32, so that a * x + b fits in 64 bits for 32-bit shingle hashes
+_PRIME = np.uint64(4294967291)
+_random = np.random.RandomState(1)
+_A = _random.randint(1, int(_PRIME), NUM_PERM, dtype=np.uint64)[:, None]
+_B = _random.randint(0, int(_PRIME), NUM_PERM, dtype=np.uint64)[:, None]
+WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text):
+    """Return the 32-bit hashes of the `SHINGLE_SIZE`-word shingles of `text`."""
+    words = WORD_RE.findall((text or "").lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    count = max(1, len(words) - SHINGLE_SIZE + 1)
+    hashes = {zlib.crc32(" ".join(words[i : i + SHINGLE_SIZE]).encode()) for i in range(count)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+def signature(text):
+    """Return the MinHash signature of `text` as `NUM_PERM` uint32, or None if it has no words."""
+    hashes = shingles(text)
+    if not len(hashes):
+        return None
+    # A slice at a time, so that a long attachment doesn't take NUM_PERM times its shingles in memory
+    result = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    for start in range(0, len(hashes), 8192):
+        chunk = hashes[start : start + 8192]
+        np.minimum(result, ((_A * chunk + _B) % _PRIME).min(axis=1), out=result)
+    return result.astype(np.uint32)
+
+
+def buckets(signature):
+    """Return the LSH bucket of each band of `signature`, as signed 64-bit ints for Postgres."""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(signature[band * ROWS : (band + 1) * ROWS].tobytes(), digest_size=8).digest(),
+            "big",
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def similarity(a, b):
+    """Estimate the Jaccard similarity of the shingles of two comments from their signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def create_tables(conn):
+    """Create the near-duplicate tables, if they don't exist yet.
+
+    Call it once before loading comments, not for every batch: CREATE INDEX IF
+    NOT EXISTS locks the tables before it finds the index is already there, so
+    workers loading at the same time would wait on each other.
+    """
+    with conn, conn.cursor() as cur:
+        cur.execute(SELECT_NEAR_DUPLICATES_EXIST_STMT)
+        if not cur.fetchone()[0]:
+            cur.execute(CREATE_NEAR_DUPLICATES_STMT)
+
+
+def _reindex(cur, comments, signatures):
+    # Returns the clusters of the comments of `comments` that are indexed with the same signature,
+    # which are kept as they are. The others are taken out of the index so that they can be added
+    # again, and the clusters they lead are handed over to one of their other members
+    ids = [comment_id for comment_id, _ in comments]
+    cur.execute(SELECT_INDEXED_SIGNATURES_STMT, {"ids": ids})
+    stored = {comment_id: (cluster_id, sig) for comment_id, cluster_id, sig in cur.fetchall()}
+    kept = {}
+    changed = []
+    for comment_id, (cluster_id, sig) in stored.items():
+        new = signatures[comment_id]
+        if (None if sig is None else bytes(sig)) == (None if new is None else new.tobytes()):
+            kept[comment_id] = cluster_id
+        else:
+            changed.append((comment_id, cluster_id))
+    if not changed:
+        return kept
+    changed_ids = [comment_id for comment_id, _ in changed]
+    for comment_id, cluster_id in changed:
+        if cluster_id != comment_id:
+            continue
+        cur.execute(SELECT_NEXT_LEADER_STMT, {"cluster_id": comment_id, "ids": changed_ids})
+        row = cur.fetchone()
+        if row is None:
+            continue
+        leader, sig = row
+        cur.execute(MOVE_CLUSTER_STMT, {"leader": leader, "cluster_id": comment_id, "ids": changed_ids})
+        execute_values(
+            cur,
+            INSERT_NEAR_DUPLICATE_BUCKETS_STMT,
+            [
+                (band, bucket, leader)
+                for band, bucket in enumerate(buckets(np.frombuffer(bytes(sig), dtype=np.uint32)))
+            ],
+        )
+    cur.execute(DELETE_NEAR_DUPLICATES_STMT, {"ids": changed_ids})
+    return kept
+
+
+def index_comments(conn, comments, replace=False):
+    """Add `(comment_id, full_text)` pairs to the near-duplicate index and return their cluster ids.
+
+    Runs `add_to_index` in a transaction of its own.
+    """
+    with conn, conn.cursor() as cur:
+        return add_to_index(cur, comments, replace)
+
+
+def add_to_index(cur, comments, replace=False):
+    """Add `(comment_id, full_text)` pairs to the index with `cur` and return their cluster ids.
+
+    Every comment joins the cluster of the most similar cluster leader it
+    shares an LSH bucket with, if they have at least `THRESHOLD` of their
+    signatures in common. Otherwise it starts a cluster of its own, named
+    after it, and its buckets are stored so that later comments can find it.
+    Comments without words each get a cluster of their own. Comments already
+    indexed are skipped, unless `replace` is set (for comments that were
+    fetched again) and their signature changed. A changed comment that led a
+    cluster hands it over to another member, so the cluster stays whole. The
+    index stays locked until the transaction of `cur` ends, so that loads
+    running at the same time see each other's leaders. The tables must exist
+    (see `create_tables`).
+    """
+    comments = list(dict(comments).items())
+    if not comments:
+        return {}
+    ids = [comment_id for comment_id, _ in comments]
+    cur.execute(LOCK_NEAR_DUPLICATES_STMT)
+    if replace:
+        signatures = {comment_id: signature(text) for comment_id, text in comments}
+        kept = _reindex(cur, comments, signatures)
+        comments = [comment for comment in comments if comment[0] not in kept]
+        signatures = {comment_id: signatures[comment_id] for comment_id, _ in comments}
+    else:
+        cur.execute(SELECT_INDEXED_STMT, {"ids": ids})
+        indexed = {comment_id for comment_id, in cur.fetchall()}
+        comments = [comment for comment in comments if comment[0] not in indexed]
+        signatures = {comment_id: signature(text) for comment_id, text in comments}
+        kept = {}
+    keys = {
+        comment_id: buckets(sig) for comment_id, sig in signatures.items() if sig is not None
+    }
+    # The leaders already stored that share a bucket with one of the comments
+    leaders = {}
+    members = {}
+    if keys:
+        wanted = {(band, bucket) for key in keys.values() for band, bucket in enumerate(key)}
+        bands, bucket_ids = zip(*wanted)
+        cur.execute(
+            SELECT_NEAR_DUPLICATE_CANDIDATES_STMT,
+            {"bands": list(bands), "buckets": list(bucket_ids)},
+        )
+        for band, bucket, comment_id, cluster_id, sig in cur.fetchall():
+            leaders[comment_id] = (cluster_id, np.frombuffer(bytes(sig), dtype=np.uint32))
+            members.setdefault((band, bucket), []).append(comment_id)
+
+    clusters = dict(kept)
+    rows = []
+    bucket_rows = []
+    for comment_id, _ in comments:
+        sig = signatures[comment_id]
+        if sig is None:
+            clusters[comment_id] = comment_id
+            rows.append((comment_id, comment_id, None))
+            continue
+        best, best_similarity = None, THRESHOLD
+        candidates = {
+            candidate
+            for band, bucket in enumerate(keys[comment_id])
+            for candidate in members.get((band, bucket), ())
+        }
+        for candidate in sorted(candidates):
+            score = similarity(sig, leaders[candidate][1])
+            if score > best_similarity or (best is None and score == best_similarity):
+                best, best_similarity = candidate, score
+        if best is not None:
+            clusters[comment_id] = leaders[best][0]
+        else:
+            # A new leader, which the rest of the batch can join too
+            clusters[comment_id] = comment_id
+            leaders[comment_id] = (comment_id, sig)
+            for band, bucket in enumerate(keys[comment_id]):
+                members.setdefault((band, bucket), []).append(comment_id)
+                bucket_rows.append((band, bucket, comment_id))
+        rows.append((comment_id, clusters[comment_id], psycopg2.Binary(sig.tobytes())))
+
+    written = set()
+    if rows:
+        written = {
+            comment_id
+            for comment_id, in execute_values(
+                cur, INSERT_NEAR_DUPLICATES_STMT, rows, page_size=1000, fetch=True
+            )
+        }
+    # A leader whose row was already there keeps the cluster it is stored with, and its buckets
+    bucket_rows = [row for row in bucket_rows if row[2] in written]
+    if bucket_rows:
+        execute_values(cur, INSERT_NEAR_DUPLICATE_BUCKETS_STMT, bucket_rows, page_size=1000)
+    return clusters
+
+
+def index_all(conn):
+    """Index the comments stored in the database that aren't in the index yet."""
+    create_tables(conn)
+    after, indexed, leaders = "", 0, 0
+    while True:
+        with conn, conn.cursor() as cur:
+            cur.execute(SELECT_UNINDEXED_STMT, {"after": after, "limit": CHUNK_SIZE})
+            comments = cur.fetchall()
+        if not comments:
+            break
+        clusters = index_comments(conn, comments)
+        indexed += len(clusters)
+        leaders += sum(comment_id == cluster_id for comment_id, cluster_id in clusters.items())
+        after = comments[-1][0]
+        logging.info(f"Indexed {indexed} comments, {leaders} clusters so far")
+    return indexed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index the stored comments for near-duplicates")
+    parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    # bulk_load indexes what it loads, so it imports this module
+    from jobs.historical_scrape.bulk_load import connect
+
+    conn = connect()
+    index_all(conn)
+    conn.close()
@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+
+from jobs.historical_scrape.bulk_load import (
+    connect,
+    load_comments,
+    load_dockets,
+    load_documents,
+)
+from jobs.historical_scrape.comment_batch import CommentBatch
+from jobs.historical_scrape.extraction_cache import ExtractionCache
+from jobs.historical_scrape.extraction_pool import ExtractionPool
+from jobs.historical_scrape.near_duplicates import create_tables
+from jobs.historical_scrape.supporting_functions import (
+    get_comment_text,
+    get_comments,
+    get_dockets,
+    get_documents,
+    get_ids,
+)
+
+# Comments per batch flowing between the stages
+BATCH_SIZE: int = 100
+# Batches that can wait between two stages before the one upstream has to wait
+QUEUE_SIZE: int = 4
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """Thread that applies `function` to every batch of its inbox.
+
+    The output goes to `outbox`. When the inbox is done (or the stage fails)
+    the outbox is marked done too, so the stages shut down in order.
+    """
+
+    def __init__(self, name, function, inbox, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.inbox = inbox
+        self.outbox = outbox
+        self.error = None
+        self.count = 0
+
+    def run(self):
+        try:
+            while True:
+                batch = self.inbox.get()
+                if batch is _DONE:
+                    break
+                output = self.function(batch)
+                self.count += len(batch)
+                if self.outbox is not None:
+                    self.outbox.put(output)
+        except Exception as e:
+            logging.exception(f"Stage {self.name} failed")
+            self.error = e
+            # Keep taking batches so the stage upstream doesn't block forever
+            while self.inbox.get() is not _DONE:
+                pass
+        finally:
+            if self.outbox is not None:
+                self.outbox.put(_DONE)
+
+
+def stream_comments(
+    feed, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE, conn=None, max_workers=None, refresh=False
+):
+    """Run raw comments through get_comment_text, into CommentBatches and the bulk loader.
+
+    `feed(put)` must call `put(result)` with every raw API response, from any
+    thread. The comments are grouped into batches of `batch_size`, and each
+    stage runs in its own thread. Only `queue_size` batches can wait between
+    two stages, so a slow stage holds the ones before it back (down to `put`)
+    and memory stays flat however many comments there are. The attachments are
+    parsed by `max_workers` processes, by default one per core. Comments
+    already in the database are kept as they are, unless `refresh` is set.
+
+    Returns the number of comments loaded and the sets of docket and document
+    ids they belong to.
+    """
+    fetched = queue.Queue(queue_size)
+    extracted = queue.Queue(queue_size)
+    structured = queue.Queue(queue_size)
+
+    cache = ExtractionCache()
+    conn = conn or connect()
+    create_tables(conn)
+    docket_ids = set()
+    document_ids = set()
+
+    def load(batch):
+        load_comments(conn, batch, refresh=refresh)
+        docket_ids.update(batch.column("docket_id"))
+        document_ids.update(batch.column("document_id"))
+
+    with ExtractionPool(max_workers=max_workers) as pool:
+        stages = [
+            _Stage(
+                "extract",
+                lambda batch: get_comment_text(batch, cache=cache, pool=pool),
+                fetched,
+                extracted,
+            ),
+            _Stage(
+                "structure",
+                lambda batch: CommentBatch.from_responses(batch).add_full_text(),
+                extracted,
+                structured,
+            ),
+            _Stage("load", load, structured),
+        ]
+        for stage in stages:
+            stage.start()
+
+        batch = []
+        lock = threading.Lock()
+
+        def put(result):
+            if any(stage.error for stage in stages):
+                # A stage failed, there is no point in queueing more work
+                return
+            with lock:
+                batch.append(result)
+                if len(batch) < batch_size:
+                    return
+                full = batch[:]
+                batch.clear()
+            fetched.put(full)
+
+        try:
+            feed(put)
+            if batch:
+                fetched.put(batch)
+        finally:
+            fetched.put(_DONE)
+            for stage in stages:
+                stage.join()
+            cache.close()
+
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    loaded = stages[-1].count
+    logging.info(f"Streamed {loaded} comments to the database")
+    return loaded, docket_ids, document_ids
+
+
+def run_pipeline(
+    data_date,
+    s3_client,
+    bucket_name,
+    batch_size=BATCH_SIZE,
+    queue_size=QUEUE_SIZE,
+    key_pool=None,
+    max_workers=None,
+):
+    """Scrape one day with the steps of run.py running at the same time on bounded batches.
+
+    The comments are fetched, and go through `stream_comments` as they
+    arrive. When the fetch falls ahead of the extraction, the fetcher waits.
+    Only the docket and document ids are kept for the end, where their
+    metadata is fetched and loaded. The comments are listed and fetched with
+    the keys of `key_pool`, by default the listing key and all the historical
+    keys.
+
+    Returns the number of comments, dockets and documents loaded.
+    """
+    comment_ids = get_ids(data_date, key_pool)
+    conn = connect()
+
+    def feed(put):
+        # The fetcher calls this from its threads
+        get_comments(
+            comment_ids,
+            s3_client,
+            bucket_name,
+            on_fetched=lambda comment_id, result: put(result),
+            key_pool=key_pool,
+        )
+
+    loaded, docket_ids, document_ids = stream_comments(
+        feed, batch_size, queue_size, conn, max_workers
+    )
+
+    # The metadata of the dockets and documents seen during the day
+    dockets = get_dockets([{"docket_id": docket_id} for docket_id in docket_ids])
+    load_dockets(conn, dockets)
+    documents = get_documents([{"document_id": document_id} for document_id in document_ids])
+    load_documents(conn, documents)
+    conn.close()
+
+    return loaded, len(dockets), len(documents)
@@ -0,0 +1,51 @@
+class Projector:
+    """Pulls a fixed set of fields out of nested API responses.
+
+    `fields` is a list of `(name, path)`, where `path` is a dotted path into
+    the response like `"data.attributes.title"`. The paths are compiled once
+    into a plan that looks up every shared parent (`data`, then
+    `data.attributes`, ...) a single time per response, and `row` returns the
+    values as a tuple in the order of `fields`.
+
+    Missing and None values come out as "", like they did from flatten().
+    So do nested dicts and non-empty lists, which flatten() split into other
+    keys.
+    """
+
+    def __init__(self, fields):
+        self.names = tuple(name for name, _ in fields)
+        # Slot 0 holds the response, every other slot holds a dict looked up from a parent slot
+        self.nodes = []
+        self.leaves = []
+        slots = {(): 0}
+        for _, path in fields:
+            *parents, key = path.split(".")
+            for depth in range(len(parents)):
+                prefix = tuple(parents[: depth + 1])
+                if prefix not in slots:
+                    slots[prefix] = len(slots)
+                    self.nodes.append((slots[prefix[:-1]], prefix[-1]))
+            self.leaves.append((slots[tuple(parents)], key))
+        self.size = len(slots)
+
+    def row(self, record):
+        slots = [record] * self.size
+        for index, (parent, key) in enumerate(self.nodes, start=1):
+            node = slots[parent]
+            slots[index] = node.get(key) if isinstance(node, dict) else None
+        row = []
+        for parent, key in self.leaves:
+            node = slots[parent]
+            value = node.get(key) if isinstance(node, dict) else None
+            if value is None or (isinstance(value, (dict, list)) and value):
+                value = ""
+            row.append(value)
+        return tuple(row)
+
+    def rows(self, records):
+        return [self.row(record) for record in records]
+
+    def dicts(self, records):
+        """Return each record as a dict of the fields, in the order of `fields`."""
+        names = self.names
+        return [dict(zip(names, self.row(record))) for record in records]
@@ -0,0 +1,155 @@
+# Rebuild the database from the raw comments archived in S3, without calling the API
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+import config  # pylint: disable=unused-import
+from jobs.historical_scrape.bulk_load import connect, load_dockets, load_documents
+from jobs.historical_scrape.pipeline import BATCH_SIZE, QUEUE_SIZE, stream_comments
+from jobs.historical_scrape.supporting_functions import get_dockets, get_documents
+
+BUCKET_NAME: str = "commons-docs"
+RAW_PREFIX: str = "data/raw"
+# Objects read from the archive at once
+READ_WORKERS: int = 32
+
+
+def decode(name, body):
+    """Return the raw API responses stored in one archive object or file.
+
+    Per comment objects hold the response as a JSON encoded string, shards
+    hold one response per line of gzipped JSONL.
+    """
+    if name.endswith(".jsonl.gz"):
+        lines = gzip.decompress(body).decode().splitlines()
+        return [json.loads(line) for line in lines if line]
+    return [json.loads(json.loads(body))]
+
+
+def list_s3(s3_client, bucket_name, prefix):
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith((".json", ".jsonl.gz")):
+                yield obj["Key"]
+
+
+def list_local(directory):
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith((".json", ".jsonl.gz")):
+                yield os.path.join(root, name)
+
+
+def read_s3(s3_client, bucket_name):
+    def read(key):
+        body = s3_client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+        return decode(key, body)
+
+    return read
+
+
+def read_local(path):
+    with open(path, "rb") as f:
+        return decode(path, f.read())
+
+
+def replay(names, read, workers=READ_WORKERS, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+    """Read the archived comments in parallel and load them through the streaming pipeline.
+
+    `names` are the objects or files to read and `read(name)` returns the
+    responses in one of them. Only `workers` reads are in flight at a time, so
+    when the extraction falls behind, the reads wait instead of piling up.
+    The comments already in the database are replaced, so that a fix to the
+    extraction or the cleaning reaches them.
+
+    Returns the number of comments loaded and the sets of docket and document
+    ids they belong to.
+    """
+
+    def feed(put):
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            for name in names:
+                pending.append((name, executor.submit(read, name)))
+                if len(pending) < workers:
+                    continue
+                failed += _drain(pending, put)
+            failed += _drain(pending, put)
+        if failed:
+            logging.warning(f"Could not read {failed} archived objects")
+
+    return stream_comments(feed, batch_size, queue_size, refresh=True)
+
+
+def _drain(pending, put):
+    failed = 0
+    for name, future in pending:
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Error reading {name}: {e}")
+            failed += 1
+            continue
+        for result in results:
+            put(result)
+    pending.clear()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the database from the raw comments archived in S3"
+    )
+    parser.add_argument("--docket", help="only replay the comments of this docket")
+    parser.add_argument(
+        "--prefix",
+        default=RAW_PREFIX,
+        help="S3 prefix of the archive, per comment objects or JSONL shards",
+    )
+    parser.add_argument("--local", help="read a local mirror of the archive instead of S3")
+    parser.add_argument(
+        "--metadata",
+        action="store_true",
+        help="also refresh the dockets and documents seen, from the API",
+    )
+    parser.add_argument("--workers", type=int, default=READ_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+    if args.local:
+        directory = os.path.join(args.local, args.docket) if args.docket else args.local
+        names, read = list_local(directory), read_local
+        logging.info(f"Replaying the archive in {directory}")
+    else:
+        s3_client = boto3.client(
+            service_name="s3",
+            region_name=os.getenv("AWS_REGION"),
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+            config=Config(max_pool_connections=args.workers),
+        )
+        prefix = f"{args.prefix.rstrip('/')}/{args.docket}/" if args.docket else args.prefix
+        names, read = list_s3(s3_client, BUCKET_NAME, prefix), read_s3(s3_client, BUCKET_NAME)
+        logging.info(f"Replaying s3://{BUCKET_NAME}/{prefix}")
+
+    loaded, docket_ids, document_ids = replay(names, read, workers=args.workers)
+    logging.info(
+        f"Replayed {loaded} comments from {len(docket_ids)} dockets and {len(document_ids)} documents"
+    )
+
+    if args.metadata:
+        conn = connect()
+        load_dockets(conn, get_dockets([{"docket_id": docket_id} for docket_id in docket_ids]))
+        load_documents(conn, get_documents([{"document_id": document_id} for document_id in document_ids]))
+        conn.close()
+        logging.info("Refreshed the dockets and documents")
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+
+RESPONSE_CACHE_PATH: str = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.expanduser("~/.cache/commons/responses.sqlite")
+)
+# Size of the answers kept before the least recently used entries are evicted
+MAX_BYTES: int = 1024**3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def normalize(text):
+    # Copies of a form letter differ in whitespace and in how the characters were encoded
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize(text).encode()).hexdigest()
+
+
+def response_key(model, system_prompt, text):
+    """Return the cache key of what `model` answers to `system_prompt` for the comment `text`."""
+    prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+    return hashlib.sha256(f"{model}\0{prompt_hash}\0{text_hash(text)}".encode()).hexdigest()
+
+
+class ResponseCache:
+    """Local cache of what the LLM extracted from each comment.
+
+    Answers are stored per model, prompt and comment text (see
+    `response_key`), so a comment is never sent to the same model with the
+    same prompt twice, and copies of a form letter are only sent once.
+    Entries are evicted least recently used first once the answers stored go
+    over `max_bytes`. The cache is a SQLite file, so it survives between runs.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=MAX_BYTES):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.max_bytes = max_bytes
+        # Kept up to date as answers are stored, so that a put doesn't have to sum the table
+        self.bytes = self.size()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get_many(self, keys):
+        """Return a dict of the answers cached for `keys`."""
+        found = {}
+        requested = list(keys)
+        keys = list(dict.fromkeys(requested))
+        # Stay under SQLite's limit on the number of parameters of a query
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, value FROM responses WHERE key IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            found.update((key, json.loads(value)) for key, value in rows)
+        if found:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE responses SET last_used = ? WHERE key = ?",
+                    ((time.time(), key) for key in found),
+                )
+        # Counted per key asked for, so a form letter that comes back several times counts every time
+        hits = sum(key in found for key in requested)
+        self.hits += hits
+        self.misses += len(requested) - hits
+        return found
+
+    def put_many(self, items):
+        """Store the `(key, value)` pairs of `items`, where `value` is JSON serialisable."""
+        now = time.time()
+        rows = []
+        for key, value in items:
+            value = json.dumps(value)
+            rows.append((key, value, len(value.encode()), now))
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        self.bytes += sum(row[2] for row in rows)
+        self.evict()
+
+    def size(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self):
+        """Drop the least recently used answers until the cache fits in `max_bytes`."""
+        if self.bytes <= self.max_bytes:
+            return
+        # Replaced answers and other processes sharing the file make the running total drift
+        self.bytes = self.size()
+        excess = self.bytes - self.max_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        with self.conn:
+            while freed < excess:
+                # The oldest answers, a page at a time, so the whole index is never read at once
+                rows = self.conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used LIMIT 1000"
+                ).fetchall()
+                if not rows:
+                    break
+                for key, size in rows:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.evicted += 1
+                    freed += size
+                    if freed >= excess:
+                        break
+        self.bytes -= freed
+
+    def stats(self):
+        """Return the hits, misses and evictions since the cache was opened, and its size."""
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "entries": entries,
+            "bytes": self.size(),
+        }
+
+    def close(self):
+        self.conn.close()
@@ -1,4 +1,5 @@
 # Load in python libraries
+import argparse
 import logging
 import os
 import sys
@@ -6,28 +7,45 @@ from datetime import datetime, timedelta
 
 import boto3
 import pytz
+from botocore.config import Config
 
 import config  # pylint: disable=unused-import
 from connectors.postgres import PostgresConnector
-from jobs.historical_scrape.sql import (
-    INSERT_COMMENTS_STMT,
-    INSERT_DOCKETS_STMT,
-    INSERT_DOCUMENTS_STMT,
-    INSERT_STATUS_STMT,
+from jobs.historical_scrape.bulk_load import (
+    connect,
+    load_comments,
+    load_dockets,
+    load_documents,
 )
+from jobs.historical_scrape.checkpoint import Checkpoint
+from jobs.historical_scrape.comment_batch import CommentBatch
+from jobs.historical_scrape.extraction_cache import ExtractionCache
+from jobs.historical_scrape.extraction_pool import ExtractionPool
+from jobs.historical_scrape.near_duplicates import create_tables
+from jobs.historical_scrape.pipeline import run_pipeline
+from jobs.historical_scrape.s3_archiver import UPLOAD_WORKERS
+from jobs.historical_scrape.sql import INSERT_STATUS_STMT
 from jobs.historical_scrape.supporting_functions import (
-    clean_string,
     get_comment_text,
     get_comments,
     get_dockets,
     get_documents,
     get_ids,
-    structure_data,
 )
 
 BUCKET_NAME: str = "commons-docs"
+# Number of comments extracted between two checkpoints in Step 3
+CHECKPOINT_CHUNK: int = 100
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the comments through all the steps in bounded batches",
+    )
+    args = parser.parse_args()
+
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
 
     # Set up DB connection
@@ -39,6 +57,8 @@ if __name__ == "__main__":
         region_name=os.getenv("AWS_REGION"),
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        # Enough pooled connections for all the upload threads of the archiver
+        config=Config(max_pool_connections=UPLOAD_WORKERS),
     )
 
     logging.info("Getting Earliest Scraped Date!")
@@ -55,8 +75,31 @@ if __name__ == "__main__":
     timestamp = datetime.strftime(ts, "%Y-%m-%d %H:%M:%S")
     today = datetime.strftime(ts, "%Y-%m-%d")
 
+    if args.stream:
+        # Run all the steps at once on bounded batches instead of one after the other
+        number_of_comments, number_of_dockets, number_of_documents = run_pipeline(
+            data_date, s3_client, BUCKET_NAME
+        )
+        pg_conn.execute(
+            INSERT_STATUS_STMT,
+            (
+                today,
+                data_date,
+                number_of_comments,
+                number_of_dockets,
+                timestamp,
+                number_of_documents,
+            ),
+        )
+        logging.info("Completed streaming scrape and logged to status")
+        sys.exit(0)
+
+    # Every step saves its work locally, so if the run crashes, rerunning it for the same day
+    # picks up where it stopped instead of starting the day over
+    checkpoint = Checkpoint(data_date)
+
     # STEP 1
-    comment_ids = get_ids(data_date)
+    comment_ids = checkpoint.run("ids", lambda: get_ids(data_date))
     if len(comment_ids) == 0:
         pg_conn.execute(
             """
@@ -79,117 +122,80 @@ if __name__ == "__main__":
     logging.info("Completed Step 1: get ids")
 
     # STEP 2
-    comments = get_comments(comment_ids, s3_client, BUCKET_NAME)
+    # Only fetch the comments we don't have yet. Each one is saved as soon as it arrives
+    fetched = checkpoint.keys("comments")
+    missing = [comment_id for comment_id in comment_ids if comment_id not in fetched]
+    if fetched:
+        logging.info(f"Resuming Step 2: {len(fetched)} comments already fetched")
+    if missing:
+        get_comments(
+            missing,
+            s3_client,
+            BUCKET_NAME,
+            on_fetched=lambda comment_id, result: checkpoint.put("comments", comment_id, result),
+        )
+    fetched = checkpoint.units("comments")
+    comments = [fetched[comment_id] for comment_id in comment_ids if comment_id in fetched]
+    del fetched
     logging.info("Completed Step 2: get comments")
 
     # STEP 3
-    full_data = get_comment_text(comments)
+    # Extract the text in chunks and save each chunk once it is done. The chunks share one
+    # cache and one pool of parsing processes
+    extracted = checkpoint.keys("text")
+    todo = [comment for comment in comments if comment["data"]["id"] not in extracted]
+    if extracted:
+        logging.info(f"Resuming Step 3: {len(extracted)} comments already extracted")
+    cache = ExtractionCache()
+    with ExtractionPool() as pool:
+        for start in range(0, len(todo), CHECKPOINT_CHUNK):
+            chunk = get_comment_text(todo[start : start + CHECKPOINT_CHUNK], cache=cache, pool=pool)
+            checkpoint.put_many("text", ((comment["data"]["id"], comment) for comment in chunk))
+    cache.close()
+    extracted = checkpoint.units("text")
+    full_data = [extracted[comment["data"]["id"]] for comment in comments]
+    del comments, todo, extracted
     logging.info("Completed Step 3: get comment text")
 
     # STEP 4
-    result = structure_data(full_data)
+    # The comments are kept column by column from here on, and the raw responses are dropped
+    result = CommentBatch(
+        checkpoint.run("structure", lambda: CommentBatch.from_responses(full_data).columns)
+    )
+    del full_data
     logging.info("Completed Step 4: structure data")
 
     # STEP 5: GET INFORMATION ON THE DOCKETS
-    dockets = get_dockets(result)
+    dockets = checkpoint.run("dockets", lambda: get_dockets(result))
     logging.info("Completed Step 5: get dockets")
 
     # STEP 6: GET INFORMATION ON THE DOCUMENTS
-    documents = get_documents(result)
+    documents = checkpoint.run("documents", lambda: get_documents(result))
     logging.info("Completed Step 6: get documents")
 
     # STEP 7: CREATE THE FULL TEXT AND CLEAN_TEXT COLUMNS:
-    for item in result:
-        # Create a new column that combines the comment and the extracted text from the pdf
-        item["full_text"] = item["comment"] + " " + item["comment_pdf_extracted"]
+    # Create a new column that combines the comment and the extracted text from the pdf
+    result.add_full_text()
     logging.info("Completed Step 7: create full text")
 
     # STEP 8: WRITE DATA TO DATABASE
-    # STEP 8.1: WRITE INFORMATION ON THE COMMENTS TO THE DATABASE
-    for item in result:
-        pg_conn.execute(
-            INSERT_COMMENTS_STMT,
-            (
-                clean_string(item["comment_id"]),
-                clean_string(item["docket_id"]),
-                clean_string(item["agency_id"]),
-                clean_string(item["title"]),
-                clean_string(item["comment"]),
-                clean_string(item.get("comment_pdf_extracted")),
-                clean_string(item.get("commenter_first_name")),
-                clean_string(item.get("commenter_last_name")),
-                clean_string(item.get("commenter_organization")),
-                clean_string(item.get("commenter_address1")),
-                clean_string(item.get("commenter_address2")),
-                clean_string(item.get("commenter_zip")),
-                clean_string(item.get("commenter_city")),
-                clean_string(item.get("commenter_state_province_region")),
-                clean_string(item.get("commenter_country")),
-                clean_string(item.get("commenter_email")),
-                clean_string(item.get("receive_date")),
-                clean_string(item.get("posted_date")),
-                clean_string(item.get("postmark_date")),
-                item.get("duplicate_comments"),
-                clean_string(item.get("attachment_read")),
-                clean_string(item.get("attachment_url")),
-                item.get("withdrawn"),
-                clean_string(item.get("api_url")),
-                clean_string(item.get("full_text")),
-                item.get("document_id"),
-            ),
-        )
+    # Each table is written with one set-based statement, in its own transaction
+    if not checkpoint.is_done("load"):
+        bulk_conn = connect()
+        create_tables(bulk_conn)
 
-    # STEP 8.2: WRITE INFORMATION ON THE DOCKETS TO THE DATABASE
-    # contrary to with the comments, we want to update the dockets if they already exist in the database
-    for item in dockets:
-        pg_conn.execute(
-            INSERT_DOCKETS_STMT,
-            (
-                item["docket_id"],
-                item["agency_id"],
-                clean_string(item["title"]),
-                clean_string(item["docket_type"]),
-                item["keywords"],
-                clean_string(item["abstract"]),
-                item["category"],
-                item["modify_date"],
-                item["effective_date"],
-                clean_string(item["organization"]),
-                clean_string(item["program"]),
-                item["rin"],
-                item["object_id"],
-                item["docket_url"],
-            ),
-        )
+        # STEP 8.1: WRITE INFORMATION ON THE COMMENTS TO THE DATABASE
+        load_comments(bulk_conn, result)
 
-    # STEP 8.3: WRITE INFORMATION ON THE DOCUMENTS TO THE DATABASE
-    for item in documents:
-        pg_conn.execute(
-            INSERT_DOCUMENTS_STMT,
-            (
-                item["document_id"],
-                item["original_document_id"],
-                item["document_type"],
-                item["subtype"],
-                item["docket_id"],
-                item["agency_id"],
-                item["title"],
-                item["abstract"],
-                item["topics"],
-                item["subject"],
-                item["comment_start_date"],
-                item["comment_end_date"],
-                item["effective_date"],
-                item["implementation_date"],
-                item["modified_date"],
-                item["open_for_comment"],
-                item["allow_late_comments"],
-                item["object_id"],
-                item["withdrawn"],
-                item["document_url"],
-                item["attachments"],
-            ),
-        )
+        # STEP 8.2: WRITE INFORMATION ON THE DOCKETS TO THE DATABASE
+        # contrary to with the comments, we want to update the dockets if they already exist in the database
+        load_dockets(bulk_conn, dockets)
+
+        # STEP 8.3: WRITE INFORMATION ON THE DOCUMENTS TO THE DATABASE
+        load_documents(bulk_conn, documents)
+
+        bulk_conn.close()
+        checkpoint.mark_done("load")
     logging.info("Completed Step 8: Wrote to Database")
 
     # STEP 9: WRITE STATUS TO FILE
@@ -209,3 +215,6 @@ if __name__ == "__main__":
     )
 
     print("Completed Step 9: Logged to Status")
+
+    # The day is in the database, so the local checkpoint isn't needed anymore
+    checkpoint.clear()
@@ -0,0 +1,123 @@
+import gzip
+import json
+import logging
+import queue
+import threading
+from io import BytesIO
+
+# Uploads running at once. The S3 client needs at least this many pooled connections
+UPLOAD_WORKERS: int = 16
+# Objects waiting to be uploaded before `put` blocks
+QUEUE_SIZE: int = 1000
+# Comments per shard when packing them into JSONL files
+SHARD_SIZE: int = 5000
+
+_DONE = object()
+
+
+def raw_comment_key(comment_id):
+    # create a directory for each regulation, save each comment as is own json named the comment ID
+    docket_id = comment_id[:-5]
+    return f"data/raw/{docket_id}/{comment_id}.json"
+
+
+class S3Archiver:
+    """Uploads raw API responses to S3 in the background.
+
+    `put(comment_id, result)` queues a response and returns straight away, and
+    a pool of threads uploads them through the one S3 client, without waiting
+    for S3 to confirm each object. By default every comment is its own object
+    at `data/raw/{docket_id}/{comment_id}.json`, as before. With a
+    `shard_prefix`, the comments are packed instead into gzipped JSONL shards
+    of `shard_size` comments at `{shard_prefix}/part-00000.jsonl.gz`, ...
+
+    Use it as a context manager, or call `close` to wait for the last uploads.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        workers=UPLOAD_WORKERS,
+        queue_size=QUEUE_SIZE,
+        shard_prefix=None,
+        shard_size=SHARD_SIZE,
+    ):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.shard_prefix = shard_prefix
+        self.shard_size = shard_size
+        self.queue = queue.Queue(queue_size)
+        # One lock for the shard being written, another for the counters, so the upload
+        # threads never wait on a `put` that is itself waiting for room in the queue
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.uploaded = 0
+        self.failed = 0
+        self.shard_number = 0
+        self._new_shard()
+        self.threads = [
+            threading.Thread(target=self._upload_worker, daemon=True) for _ in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _new_shard(self):
+        self.shard_buffer = BytesIO()
+        self.shard = gzip.GzipFile(fileobj=self.shard_buffer, mode="wb")
+        self.shard_count = 0
+
+    def _flush_shard(self):
+        # Called with the lock held
+        if self.shard_count == 0:
+            return
+        self.shard.close()
+        key = f"{self.shard_prefix}/part-{self.shard_number:05d}.jsonl.gz"
+        self.queue.put((key, self.shard_buffer.getvalue()))
+        self.shard_number += 1
+        self._new_shard()
+
+    def _upload_worker(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            key, body = item
+            try:
+                self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+                with self.stats_lock:
+                    self.uploaded += 1
+            except Exception as e:
+                print(f"Error uploading to S3: {e}")
+                with self.stats_lock:
+                    self.failed += 1
+
+    def put(self, comment_id, result):
+        """Queue the raw API response of a comment for upload."""
+        if self.shard_prefix is None:
+            # Stored as a JSON encoded string, like the rest of the archive
+            self.queue.put((raw_comment_key(comment_id), json.dumps(json.dumps(result)).encode()))
+            return
+        line = (json.dumps(result) + "\n").encode()
+        with self.lock:
+            self.shard.write(line)
+            self.shard_count += 1
+            if self.shard_count >= self.shard_size:
+                self._flush_shard()
+
+    def close(self):
+        """Upload what is left and wait for all the uploads to finish."""
+        if self.shard_prefix is not None:
+            with self.lock:
+                self._flush_shard()
+        for _ in self.threads:
+            self.queue.put(_DONE)
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"Archived {self.uploaded} objects to S3, {self.failed} failed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -123,3 +123,700 @@ INSERT INTO status (
 ) VALUES (%s, %s, %s, %s, %s, %s)
 ON CONFLICT (data_date) DO NOTHING;
 """
+
+# Bulk loading: rows are first staged in a temporary table and then applied to the real
+# table in one statement, with the same ON CONFLICT behaviour as the statements above.
+# DISTINCT ON keeps one row per key, as a single upsert can't touch the same row twice:
+# the first staged row for comments (DO NOTHING) and the last one for dockets and documents (DO UPDATE).
+CREATE_STAGE_STMT = """
+CREATE TEMPORARY TABLE {stage} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP;
+ALTER TABLE {stage} ADD COLUMN stage_row BIGSERIAL;
+"""
+
+STAGE_COMMENTS_STMT = """
+INSERT INTO stage_comments (
+    comment_id,
+    docket_id,
+    agency_id,
+    title,
+    comment,
+    comment_pdf_extracted,
+    commenter_first_name,
+    commenter_last_name,
+    commenter_organization,
+    commenter_address1,
+    commenter_address2,
+    commenter_zip,
+    commenter_city,
+    commenter_state_province_region,
+    commenter_country,
+    commenter_email,
+    receive_date,
+    posted_date,
+    postmark_date,
+    duplicate_comments,
+    attachment_read,
+    attachment_url,
+    withdrawn,
+    api_url,
+    full_text,
+    document_id
+) VALUES %s;
+"""
+
+UPSERT_COMMENTS_STMT = """
+INSERT INTO comments (
+    comment_id,
+    docket_id,
+    agency_id,
+    title,
+    comment,
+    comment_pdf_extracted,
+    commenter_first_name,
+    commenter_last_name,
+    commenter_organization,
+    commenter_address1,
+    commenter_address2,
+    commenter_zip,
+    commenter_city,
+    commenter_state_province_region,
+    commenter_country,
+    commenter_email,
+    receive_date,
+    posted_date,
+    postmark_date,
+    duplicate_comments,
+    attachment_read,
+    attachment_url,
+    withdrawn,
+    api_url,
+    full_text,
+    document_id
+)
+SELECT DISTINCT ON (comment_id)
+    comment_id,
+    docket_id,
+    agency_id,
+    title,
+    comment,
+    comment_pdf_extracted,
+    commenter_first_name,
+    commenter_last_name,
+    commenter_organization,
+    commenter_address1,
+    commenter_address2,
+    commenter_zip,
+    commenter_city,
+    commenter_state_province_region,
+    commenter_country,
+    commenter_email,
+    receive_date,
+    posted_date,
+    postmark_date,
+    duplicate_comments,
+    attachment_read,
+    attachment_url,
+    withdrawn,
+    api_url,
+    full_text,
+    document_id
+FROM stage_comments
+ORDER BY comment_id, stage_row
+ON CONFLICT (comment_id) DO NOTHING;
+"""
+
+# Same as UPSERT_COMMENTS_STMT, but comments that are already stored are replaced by the
+# staged version, for the docket sync which refetches the comments modified since its last run
+REFRESH_COMMENTS_STMT = """
+INSERT INTO comments (
+    comment_id,
+    docket_id,
+    agency_id,
+    title,
+    comment,
+    comment_pdf_extracted,
+    commenter_first_name,
+    commenter_last_name,
+    commenter_organization,
+    commenter_address1,
+    commenter_address2,
+    commenter_zip,
+    commenter_city,
+    commenter_state_province_region,
+    commenter_country,
+    commenter_email,
+    receive_date,
+    posted_date,
+    postmark_date,
+    duplicate_comments,
+    attachment_read,
+    attachment_url,
+    withdrawn,
+    api_url,
+    full_text,
+    document_id
+)
+SELECT DISTINCT ON (comment_id)
+    comment_id,
+    docket_id,
+    agency_id,
+    title,
+    comment,
+    comment_pdf_extracted,
+    commenter_first_name,
+    commenter_last_name,
+    commenter_organization,
+    commenter_address1,
+    commenter_address2,
+    commenter_zip,
+    commenter_city,
+    commenter_state_province_region,
+    commenter_country,
+    commenter_email,
+    receive_date,
+    posted_date,
+    postmark_date,
+    duplicate_comments,
+    attachment_read,
+    attachment_url,
+    withdrawn,
+    api_url,
+    full_text,
+    document_id
+FROM stage_comments
+ORDER BY comment_id, stage_row DESC
+ON CONFLICT (comment_id) DO UPDATE SET
+    docket_id = EXCLUDED.docket_id,
+    agency_id = EXCLUDED.agency_id,
+    title = EXCLUDED.title,
+    comment = EXCLUDED.comment,
+    comment_pdf_extracted = EXCLUDED.comment_pdf_extracted,
+    commenter_first_name = EXCLUDED.commenter_first_name,
+    commenter_last_name = EXCLUDED.commenter_last_name,
+    commenter_organization = EXCLUDED.commenter_organization,
+    commenter_address1 = EXCLUDED.commenter_address1,
+    commenter_address2 = EXCLUDED.commenter_address2,
+    commenter_zip = EXCLUDED.commenter_zip,
+    commenter_city = EXCLUDED.commenter_city,
+    commenter_state_province_region = EXCLUDED.commenter_state_province_region,
+    commenter_country = EXCLUDED.commenter_country,
+    commenter_email = EXCLUDED.commenter_email,
+    receive_date = EXCLUDED.receive_date,
+    posted_date = EXCLUDED.posted_date,
+    postmark_date = EXCLUDED.postmark_date,
+    duplicate_comments = EXCLUDED.duplicate_comments,
+    attachment_read = EXCLUDED.attachment_read,
+    attachment_url = EXCLUDED.attachment_url,
+    withdrawn = EXCLUDED.withdrawn,
+    api_url = EXCLUDED.api_url,
+    full_text = EXCLUDED.full_text,
+    document_id = EXCLUDED.document_id;
+"""
+
+STAGE_DOCKETS_STMT = """
+INSERT INTO stage_dockets (
+    docket_id,
+    agency_id,
+    title,
+    docket_type,
+    keywords,
+    abstract,
+    category,
+    modify_date,
+    effective_date,
+    organization,
+    program,
+    rin,
+    object_id,
+    docket_url
+) VALUES %s;
+"""
+
+UPSERT_DOCKETS_STMT = """
+INSERT INTO dockets (
+    docket_id,
+    agency_id,
+    title,
+    docket_type,
+    keywords,
+    abstract,
+    category,
+    modify_date,
+    effective_date,
+    organization,
+    program,
+    rin,
+    object_id,
+    docket_url
+)
+SELECT DISTINCT ON (docket_id)
+    docket_id,
+    agency_id,
+    title,
+    docket_type,
+    keywords,
+    abstract,
+    category,
+    modify_date,
+    effective_date,
+    organization,
+    program,
+    rin,
+    object_id,
+    docket_url
+FROM stage_dockets
+ORDER BY docket_id, stage_row DESC
+ON CONFLICT (docket_id) DO UPDATE SET
+    docket_id = EXCLUDED.docket_id,
+    agency_id = EXCLUDED.agency_id,
+    title = EXCLUDED.title,
+    docket_type = EXCLUDED.docket_type,
+    keywords = EXCLUDED.keywords,
+    abstract = EXCLUDED.abstract,
+    category = EXCLUDED.category,
+    modify_date = EXCLUDED.modify_date,
+    effective_date = EXCLUDED.effective_date,
+    organization = EXCLUDED.organization,
+    program = EXCLUDED.program,
+    rin = EXCLUDED.rin,
+    object_id = EXCLUDED.object_id,
+    docket_url = EXCLUDED.docket_url;
+"""
+
+STAGE_DOCUMENTS_STMT = """
+INSERT INTO stage_documents (
+    document_id,
+    original_document_id,
+    document_type,
+    subtype,
+    docket_id,
+    agency_id,
+    title,
+    abstract,
+    topics,
+    subject,
+    comment_start_date,
+    comment_end_date,
+    effective_date,
+    implementation_date,
+    modified_date,
+    open_for_comment,
+    allow_late_comment,
+    object_id,
+    withdrawn,
+    document_url,
+    attachments
+) VALUES %s;
+"""
+
+UPSERT_DOCUMENTS_STMT = """
+INSERT INTO documents (
+    document_id,
+    original_document_id,
+    document_type,
+    subtype,
+    docket_id,
+    agency_id,
+    title,
+    abstract,
+    topics,
+    subject,
+    comment_start_date,
+    comment_end_date,
+    effective_date,
+    implementation_date,
+    modified_date,
+    open_for_comment,
+    allow_late_comment,
+    object_id,
+    withdrawn,
+    document_url,
+    attachments
+)
+SELECT DISTINCT ON (document_id)
+    document_id,
+    original_document_id,
+    document_type,
+    subtype,
+    docket_id,
+    agency_id,
+    title,
+    abstract,
+    topics,
+    subject,
+    comment_start_date,
+    comment_end_date,
+    effective_date,
+    implementation_date,
+    modified_date,
+    open_for_comment,
+    allow_late_comment,
+    object_id,
+    withdrawn,
+    document_url,
+    attachments
+FROM stage_documents
+ORDER BY document_id, stage_row DESC
+ON CONFLICT (document_id) DO UPDATE SET
+    document_id = EXCLUDED.document_id,
+    original_document_id = EXCLUDED.original_document_id,
+    document_type = EXCLUDED.document_type,
+    subtype = EXCLUDED.subtype,
+    docket_id = EXCLUDED.docket_id,
+    agency_id = EXCLUDED.agency_id,
+    title = EXCLUDED.title,
+    abstract = EXCLUDED.abstract,
+    topics = EXCLUDED.topics,
+    subject = EXCLUDED.subject,
+    comment_start_date = EXCLUDED.comment_start_date,
+    comment_end_date = EXCLUDED.comment_end_date,
+    effective_date = EXCLUDED.effective_date,
+    implementation_date = EXCLUDED.implementation_date,
+    modified_date = EXCLUDED.modified_date,
+    open_for_comment = EXCLUDED.open_for_comment,
+    allow_late_comment = EXCLUDED.allow_late_comment,
+    object_id = EXCLUDED.object_id,
+    withdrawn = EXCLUDED.withdrawn,
+    document_url = EXCLUDED.document_url,
+    attachments = EXCLUDED.attachments;
+"""
+
+# Backfill leases: a worker claims a day by holding its row until `leased_until`. A day
+# can only be claimed when it has no status row yet and nobody holds a live lease on it
+CREATE_LEASES_STMT = """
+CREATE TABLE IF NOT EXISTS scrape_leases (
+    data_date TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    leased_until TIMESTAMPTZ NOT NULL
+);
+"""
+
+CLAIM_LEASE_STMT = """
+INSERT INTO scrape_leases (data_date, worker, leased_until)
+SELECT %(data_date)s, %(worker)s, now() + %(seconds)s * INTERVAL '1 second'
+WHERE NOT EXISTS (SELECT 1 FROM status WHERE data_date = %(data_date)s)
+ON CONFLICT (data_date) DO UPDATE SET
+    worker = EXCLUDED.worker,
+    leased_until = EXCLUDED.leased_until
+WHERE scrape_leases.leased_until < now()
+RETURNING data_date;
+"""
+
+RENEW_LEASE_STMT = """
+UPDATE scrape_leases
+SET leased_until = now() + %(seconds)s * INTERVAL '1 second'
+WHERE data_date = %(data_date)s AND worker = %(worker)s;
+"""
+
+RELEASE_LEASE_STMT = """
+DELETE FROM scrape_leases
+WHERE data_date = %(data_date)s AND worker = %(worker)s;
+"""
+
+# Docket sync: the lastModifiedDate of the newest comment stored for each docket synced
+CREATE_DOCKET_SYNC_STMT = """
+CREATE TABLE IF NOT EXISTS docket_sync (
+    docket_id TEXT PRIMARY KEY,
+    last_modified TEXT NOT NULL,
+    synced_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+SELECT_DOCKET_SYNC_STMT = """
+SELECT last_modified FROM docket_sync WHERE docket_id = %s;
+"""
+
+UPDATE_DOCKET_SYNC_STMT = """
+INSERT INTO docket_sync (docket_id, last_modified, synced_at)
+VALUES (%s, %s, now())
+ON CONFLICT (docket_id) DO UPDATE SET
+    last_modified = EXCLUDED.last_modified,
+    synced_at = EXCLUDED.synced_at;
+"""
+
+# Parquet export. The days scraped (or rescraped) since the last export, and their comments.
+# Every column but duplicate_comments and withdrawn is read as text, as it is written to Parquet.
+# A day is the one regulations.gov posted the comment on, in Eastern time, which is the day
+# get_ids asked for and the data_date of the status table. %(start)s and %(end)s bound the
+# posted_date of one day, or are null for every comment
+SELECT_EXPORT_DAYS_STMT = """
+SELECT data_date::text, scrape_timestamp::text
+FROM status
+WHERE %(since)s::text IS NULL OR scrape_timestamp::text > %(since)s::text
+ORDER BY data_date;
+"""
+
+SELECT_EXPORT_COMMENTS_STMT = """
+SELECT
+    comment_id::text,
+    docket_id::text,
+    agency_id::text,
+    title::text,
+    comment::text,
+    comment_pdf_extracted::text,
+    commenter_first_name::text,
+    commenter_last_name::text,
+    commenter_organization::text,
+    commenter_address1::text,
+    commenter_address2::text,
+    commenter_zip::text,
+    commenter_city::text,
+    commenter_state_province_region::text,
+    commenter_country::text,
+    commenter_email::text,
+    receive_date::text,
+    posted_date::text,
+    postmark_date::text,
+    duplicate_comments,
+    attachment_read::text,
+    attachment_url::text,
+    withdrawn,
+    api_url::text,
+    full_text::text,
+    document_id::text,
+    -- The scraper writes an empty posted_date when the API has none
+    to_char(NULLIF(posted_date::text, '')::timestamptz AT TIME ZONE 'America/New_York', 'YYYY-MM-DD') AS data_date
+FROM comments
+WHERE %(start)s::text IS NULL OR (posted_date >= %(start)s AND posted_date < %(end)s)
+ORDER BY data_date, agency_id;
+"""
+
+# Lets the export read the comments of a day as a range of posted_date, instead of the whole table.
+# No row when the index doesn't exist, false when a build of it failed or was interrupted
+SELECT_EXPORT_INDEX_VALID_STMT = """
+SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass('comments_posted_date');
+"""
+
+DROP_EXPORT_INDEX_STMT = """
+DROP INDEX CONCURRENTLY IF EXISTS comments_posted_date;
+"""
+
+CREATE_EXPORT_INDEX_STMT = """
+CREATE INDEX CONCURRENTLY IF NOT EXISTS comments_posted_date ON comments (posted_date);
+"""
+
+# LLM enrichment: the ai_* fields extracted from each comment, one row per comment. Empty and
+# boilerplate comments, which triage finds nothing to extract from, get null fields and the
+# reason in `triage`
+CREATE_ENRICHMENT_STMT = """
+CREATE TABLE IF NOT EXISTS comment_enrichment (
+    comment_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    ai_first_name TEXT,
+    ai_middle_name TEXT,
+    ai_last_name TEXT,
+    ai_email TEXT,
+    ai_phone TEXT,
+    ai_address TEXT,
+    ai_city TEXT,
+    ai_state TEXT,
+    ai_zip TEXT,
+    ai_country TEXT,
+    ai_job_title TEXT,
+    ai_org TEXT,
+    ai_summary TEXT,
+    triage TEXT,
+    enriched_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE comment_enrichment ADD COLUMN IF NOT EXISTS triage TEXT;
+"""
+
+# The next comments after %(after)s (in comment_id order) that haven't been enriched yet
+SELECT_UNENRICHED_STMT = """
+SELECT comment_id, full_text, attachment_read
+FROM comments
+WHERE comment_id > %(after)s
+AND NOT EXISTS (
+    SELECT 1 FROM comment_enrichment WHERE comment_enrichment.comment_id = comments.comment_id
+)
+ORDER BY comment_id
+LIMIT %(limit)s;
+"""
+
+# Same as SELECT_UNENRICHED_STMT, leaving out the comments that are near-duplicates of another
+SELECT_UNENRICHED_LEADERS_STMT = """
+SELECT comment_id, full_text, attachment_read
+FROM comments
+WHERE comment_id > %(after)s
+AND NOT EXISTS (
+    SELECT 1 FROM comment_enrichment WHERE comment_enrichment.comment_id = comments.comment_id
+)
+AND NOT EXISTS (
+    SELECT 1 FROM near_duplicates
+    WHERE near_duplicates.comment_id = comments.comment_id
+    AND near_duplicates.cluster_id <> comments.comment_id
+)
+ORDER BY comment_id
+LIMIT %(limit)s;
+"""
+
+STAGE_ENRICHMENT_STMT = """
+INSERT INTO stage_comment_enrichment (
+    comment_id,
+    model,
+    ai_first_name,
+    ai_middle_name,
+    ai_last_name,
+    ai_email,
+    ai_phone,
+    ai_address,
+    ai_city,
+    ai_state,
+    ai_zip,
+    ai_country,
+    ai_job_title,
+    ai_org,
+    ai_summary,
+    triage
+) VALUES %s;
+"""
+
+UPSERT_ENRICHMENT_STMT = """
+INSERT INTO comment_enrichment (
+    comment_id,
+    model,
+    ai_first_name,
+    ai_middle_name,
+    ai_last_name,
+    ai_email,
+    ai_phone,
+    ai_address,
+    ai_city,
+    ai_state,
+    ai_zip,
+    ai_country,
+    ai_job_title,
+    ai_org,
+    ai_summary,
+    triage,
+    enriched_at
+)
+SELECT DISTINCT ON (comment_id)
+    comment_id,
+    model,
+    ai_first_name,
+    ai_middle_name,
+    ai_last_name,
+    ai_email,
+    ai_phone,
+    ai_address,
+    ai_city,
+    ai_state,
+    ai_zip,
+    ai_country,
+    ai_job_title,
+    ai_org,
+    ai_summary,
+    triage,
+    now()
+FROM stage_comment_enrichment
+ORDER BY comment_id, stage_row DESC
+ON CONFLICT (comment_id) DO UPDATE SET
+    model = EXCLUDED.model,
+    ai_first_name = EXCLUDED.ai_first_name,
+    ai_middle_name = EXCLUDED.ai_middle_name,
+    ai_last_name = EXCLUDED.ai_last_name,
+    ai_email = EXCLUDED.ai_email,
+    ai_phone = EXCLUDED.ai_phone,
+    ai_address = EXCLUDED.ai_address,
+    ai_city = EXCLUDED.ai_city,
+    ai_state = EXCLUDED.ai_state,
+    ai_zip = EXCLUDED.ai_zip,
+    ai_country = EXCLUDED.ai_country,
+    ai_job_title = EXCLUDED.ai_job_title,
+    ai_org = EXCLUDED.ai_org,
+    ai_summary = EXCLUDED.ai_summary,
+    triage = EXCLUDED.triage,
+    enriched_at = EXCLUDED.enriched_at;
+"""
+
+# Near-duplicate index: the MinHash signature and cluster of every comment, and the LSH
+# buckets of the comments that lead a cluster. A new comment is only compared to the leaders
+# that share a bucket with it, so the buckets stay small however big a campaign gets
+CREATE_NEAR_DUPLICATES_STMT = """
+CREATE TABLE IF NOT EXISTS near_duplicates (
+    comment_id TEXT PRIMARY KEY,
+    cluster_id TEXT NOT NULL,
+    signature BYTEA
+);
+CREATE INDEX IF NOT EXISTS near_duplicates_cluster_id ON near_duplicates (cluster_id);
+CREATE TABLE IF NOT EXISTS near_duplicate_buckets (
+    band SMALLINT NOT NULL,
+    bucket BIGINT NOT NULL,
+    comment_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS near_duplicate_buckets_key ON near_duplicate_buckets (band, bucket);
+CREATE INDEX IF NOT EXISTS near_duplicate_buckets_comment_id ON near_duplicate_buckets (comment_id);
+"""
+
+# Whether CREATE_NEAR_DUPLICATES_STMT already ran: the last index it creates exists
+SELECT_NEAR_DUPLICATES_EXIST_STMT = """
+SELECT to_regclass('near_duplicate_buckets_comment_id') IS NOT NULL;
+"""
+
+# The leaders in the buckets of %(bands)s / %(buckets)s, with their signatures and clusters
+SELECT_NEAR_DUPLICATE_CANDIDATES_STMT = """
+SELECT DISTINCT b.band, b.bucket, d.comment_id, d.cluster_id, d.signature
+FROM unnest(%(bands)s::smallint[], %(buckets)s::bigint[]) AS k (band, bucket)
+JOIN near_duplicate_buckets b ON b.band = k.band AND b.bucket = k.bucket
+JOIN near_duplicates d ON d.comment_id = b.comment_id;
+"""
+
+# Taken for the rest of the transaction before the index is read, so that two loads can't both
+# find a bucket empty and each start a cluster for the same campaign
+LOCK_NEAR_DUPLICATES_STMT = """
+SELECT pg_advisory_xact_lock(hashtext('near_duplicates'));
+"""
+
+SELECT_INDEXED_STMT = """
+SELECT comment_id FROM near_duplicates WHERE comment_id = ANY(%(ids)s);
+"""
+
+SELECT_INDEXED_SIGNATURES_STMT = """
+SELECT comment_id, cluster_id, signature FROM near_duplicates WHERE comment_id = ANY(%(ids)s);
+"""
+
+# The member of the cluster of %(cluster_id)s that takes over from it as leader, leaving out
+# the comments in %(ids)s, which are about to be indexed again
+SELECT_NEXT_LEADER_STMT = """
+SELECT comment_id, signature
+FROM near_duplicates
+WHERE cluster_id = %(cluster_id)s
+AND comment_id <> ALL(%(ids)s)
+AND signature IS NOT NULL
+ORDER BY comment_id
+LIMIT 1;
+"""
+
+MOVE_CLUSTER_STMT = """
+UPDATE near_duplicates SET cluster_id = %(leader)s
+WHERE cluster_id = %(cluster_id)s AND comment_id <> ALL(%(ids)s);
+"""
+
+DELETE_NEAR_DUPLICATES_STMT = """
+DELETE FROM near_duplicate_buckets WHERE comment_id = ANY(%(ids)s);
+DELETE FROM near_duplicates WHERE comment_id = ANY(%(ids)s);
+"""
+
+# Returns the comments actually written, so that only their buckets are added
+INSERT_NEAR_DUPLICATES_STMT = """
+INSERT INTO near_duplicates (comment_id, cluster_id, signature) VALUES %s
+ON CONFLICT (comment_id) DO NOTHING
+RETURNING comment_id;
+"""
+
+INSERT_NEAR_DUPLICATE_BUCKETS_STMT = """
+INSERT INTO near_duplicate_buckets (band, bucket, comment_id) VALUES %s;
+"""
+
+# The comments loaded before the index existed, or before they were indexed
+SELECT_UNINDEXED_STMT = """
+SELECT comment_id, full_text
+FROM comments
+WHERE comment_id > %(after)s
+AND NOT EXISTS (
+    SELECT 1 FROM near_duplicates WHERE near_duplicates.comment_id = comments.comment_id
+)
+ORDER BY comment_id
+LIMIT %(limit)s;
+"""
@@ -0,0 +1,166 @@
+# Read the answers of the model into the ai_* fields, fixing what can be fixed without asking again
+import ast
+import json
+import re
+
+from pydantic import ValidationError
+
+from jobs.historical_scrape.ai_schema import AI_FIELDS, Comment
+
+FENCE_RE = re.compile(r"^```[\w-]*[ \t]*\n?|\n?```\s*$")
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+PYTHON_LITERAL_RE = re.compile(r"(:\s*)(None|True|False)(\s*[,}\]])")
+PACKED_RE = re.compile(r'"comments"\s*:\s*\[')
+# A JSON string, or the start of one that was cut short
+STRING_RE = re.compile(r'("(?:[^"\\]|\\.)*(?:"|$))', re.DOTALL)
+JSON_LITERALS = {"None": "null", "True": "true", "False": "false"}
+
+
+def _strip(text):
+    # Takes out a markdown code block and any text around the object
+    text = FENCE_RE.sub("", text.strip())
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start : end + 1]
+    return text
+
+
+def repair_json(text):
+    """Fix the mistakes models make around otherwise good JSON.
+
+    Takes out a markdown code block and any text around the object, trailing
+    commas, and Python's None, True and False. Doesn't try to guess what an
+    answer cut short would have said.
+    """
+    text = _strip(text)
+    # Only between the strings, so that the values the model extracted are left as they are
+    parts = STRING_RE.split(text)
+    for index in range(0, len(parts), 2):
+        part = TRAILING_COMMA_RE.sub(r"\1", parts[index])
+        parts[index] = PYTHON_LITERAL_RE.sub(
+            lambda match: match.group(1) + JSON_LITERALS[match.group(2)] + match.group(3), part
+        )
+    return "".join(parts)
+
+
+def _objects(text):
+    # The JSON objects one after the other in `text`, like {...}\n{...}, or None if that isn't all it is
+    decoder = json.JSONDecoder()
+    objects, position = [], 0
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position == len(text):
+            return objects
+        try:
+            item, position = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            return None
+        objects.append(item)
+
+
+def decode(text):
+    """Decode the answer of a model, fixing what `repair_json` fixes.
+
+    An answer written as a Python dict (`{'a': 1, 'b': None}`) is read as one.
+    Several objects one after the other come back as a list of them. Raises
+    json.JSONDecodeError when none of that works.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    repaired = repair_json(text)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError as e:
+        error = e
+    objects = _objects(repaired)
+    if objects and len(objects) > 1:
+        return objects
+    try:
+        # Only literals, nothing is run
+        return ast.literal_eval(_strip(text))
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        raise error
+
+
+def _error(e):
+    # The first thing pydantic found wrong, short enough to be sent back to the model
+    error = e.errors()[0]
+    field = ".".join(str(part) for part in error["loc"])
+    return f"{field}: {error['msg']}" if field else error["msg"]
+
+
+def check(answer):
+    """Return `(fields, None)` with the ai_* fields of one decoded answer, or `(None, error)`."""
+    if isinstance(answer, list):
+        # Which of the objects is the answer can't be told, so the model is asked again
+        return None, "the answer is several JSON objects instead of one"
+    if not isinstance(answer, dict):
+        return None, "the answer is not a JSON object"
+    try:
+        return Comment.model_validate({field: answer.get(field) for field in AI_FIELDS}).model_dump(), None
+    except ValidationError as e:
+        return None, _error(e)
+
+
+def read_single(text):
+    """Return `(fields, None)` with the ai_* fields of the answer for one comment, or `(None, error)`."""
+    # Fast path: pydantic parses and validates the JSON in one pass
+    try:
+        return Comment.model_validate_json(text).model_dump(), None
+    except ValidationError as e:
+        if e.errors()[0]["type"] != "json_invalid":
+            return None, _error(e)
+    try:
+        return check(decode(text))
+    except json.JSONDecodeError:
+        return None, "the answer is not valid JSON"
+
+
+def _salvage(text):
+    # A packed answer cut short by the token limit still has its first comments whole
+    match = PACKED_RE.search(text)
+    if not match:
+        return None
+    decoder = json.JSONDecoder()
+    items, position = [], match.end()
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        try:
+            item, position = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            return {"comments": items}
+        items.append(item)
+
+
+def read_packed(text, count):
+    """Read the answer to a packed prompt of `count` comments.
+
+    Returns `({index: fields}, {index: error})`: the ai_* fields of every
+    comment that came back valid, and what was wrong with the others.
+    """
+    try:
+        answer = decode(text)
+    except json.JSONDecodeError:
+        answer = _salvage(repair_json(text))
+    if isinstance(answer, list):
+        # The entries of the comments, one after the other instead of in a "comments" array
+        answer = {"comments": answer}
+    items = {}
+    for item in answer.get("comments", []) if isinstance(answer, dict) else []:
+        if isinstance(item, dict):
+            items.setdefault(str(item.get("id")), item)
+    results, errors = {}, {}
+    for index in range(count):
+        if str(index) not in items:
+            errors[index] = "the answer has no entry for this comment"
+            continue
+        fields, error = check(items[str(index)])
+        if fields is not None:
+            results[index] = fields
+        else:
+            errors[index] = error
+    return results, errors
@@ -0,0 +1,157 @@
+"""Local stand-in for the Anthropic, OpenAI and Gemini APIs.
+
+Answers the prompts of ai_schema.py with a fake extraction of every comment
+(the email address it contains and its first sentence as the summary), with a
+fixed latency and a limit of requests per minute, so the enrichment can be run
+and benchmarked offline:
+
+    python stub_model_server.py --port 8766 --latency 0.5
+    GEMINI_API_URL=http://127.0.0.1:8766 python enrichment.py --provider gemini
+
+`--broken` is the share of answers that come back cut short, wrapped in a
+markdown code block, or with one comment of a packed prompt missing or with an
+empty summary.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jobs.historical_scrape.ai_schema import AI_FIELDS
+
+COMMENT_RE = re.compile(r'<comment id="([^"]*)">\n(.*?)\n</comment>', re.DOTALL)
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+
+
+def fake_extraction(text):
+    answer = dict.fromkeys(AI_FIELDS)
+    email = EMAIL_RE.search(text)
+    if email:
+        answer["ai_email"] = email.group()
+    sentence = text.strip().split(". ")[0][:200]
+    answer["ai_summary"] = sentence if len(sentence) >= 5 else "The commenter did not say anything."
+    return answer
+
+
+def fake_answer(prompt, broken, rng):
+    comments = COMMENT_RE.findall(prompt)
+    if comments:
+        answer = {"comments": [dict(fake_extraction(text), id=id) for id, text in comments]}
+        if rng.random() < broken:
+            answer["comments"].pop(rng.randrange(len(comments)))
+        if answer["comments"] and rng.random() < broken:
+            answer["comments"][rng.randrange(len(answer["comments"]))]["ai_summary"] = ""
+    else:
+        answer = fake_extraction(prompt.split("Comment: ", 1)[-1])
+    text = json.dumps(answer)
+    if rng.random() < broken:
+        text = text[: len(text) // 2]
+    elif rng.random() < broken:
+        text = f"Here is the JSON:\n```json\n{text}\n```"
+    return text
+
+
+class StubModels:
+    def __init__(self, latency=0.5, requests_per_minute=1000, broken=0.0, seed=0, window=60):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        # Seconds the limit counts requests over, shorter in the tests so that a 429 passes quickly
+        self.window = window
+        self.broken = broken
+        self.rng = random.Random(seed)
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Count a request and return 0, or the seconds to wait when it is over the limit."""
+        with self.lock:
+            self.requests += 1
+            if time.monotonic() - self.window_start >= self.window:
+                self.window_start = time.monotonic()
+                self.used = 0
+            if self.used >= self.requests_per_minute:
+                return self.window_start + self.window - time.monotonic()
+            self.used += 1
+            return 0
+
+    def answer(self, path, body):
+        # Returns the response in the format of the API the path belongs to
+        with self.lock:
+            rng = random.Random(self.rng.random())
+        if path == "/v1/messages":
+            text = fake_answer(body["messages"][-1]["content"], self.broken, rng)
+            return {"content": [{"type": "text", "text": text}], "stop_reason": "end_turn"}
+        if path == "/v1/chat/completions":
+            text = fake_answer(body["messages"][-1]["content"], self.broken, rng)
+            return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+        if path.startswith("/v1beta/models/") and ":generateContent" in path:
+            text = fake_answer(body["contents"][-1]["parts"][0]["text"], self.broken, rng)
+            return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+        return None
+
+    def handler(self):
+        models = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                retry_after = models.take()
+                time.sleep(models.latency)
+
+                if retry_after:
+                    status, answer = 429, {"error": {"type": "rate_limit_error"}}
+                else:
+                    answer = models.answer(self.path.split("?")[0], body)
+                    status = 200 if answer is not None else 404
+                    answer = answer or {"error": {"type": "not_found_error"}}
+
+                payload = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", f"{max(1, retry_after):.0f}")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def start_stub_model_server(port=0, latency=0.5, requests_per_minute=1000, broken=0.0, window=60):
+    """Start the stub models in a background thread and return the server.
+
+    Point `ANTHROPIC_API_URL`, `OPENAI_API_URL` or `GEMINI_API_URL` at
+    `f"http://127.0.0.1:{server.server_port}"`. `server.models` holds the
+    request counter.
+    """
+    models = StubModels(latency, requests_per_minute, broken, window=window)
+    server = ThreadingHTTPServer(("127.0.0.1", port), models.handler())
+    server.daemon_threads = True
+    server.models = models
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--requests-per-minute", type=int, default=1000)
+    parser.add_argument("--broken", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_stub_model_server(args.port, args.latency, args.requests_per_minute, args.broken)
+    print(f"Stub models listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,190 @@
+"""Local stand-in for the regulations.gov comments API.
+
+Serves fake comments, dockets and documents with a fixed latency and enforces
+the hourly limit per API key, so the scraper can be run and benchmarked offline:
+
+    python stub_server.py --port 8765 --latency 0.2
+    REGGOV_API_URL=http://127.0.0.1:8765/v4 python run.py
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def fake_comment(comment_id):
+    docket_id = comment_id[:-5]
+    return {
+        "data": {
+            "id": comment_id,
+            "type": "comments",
+            "attributes": {
+                "commentOnDocumentId": f"{docket_id}-0001",
+                "docketId": docket_id,
+                "agencyId": docket_id.split("-")[0],
+                "title": f"Comment from {comment_id}",
+                "comment": "I support this rule.",
+                "firstName": "Jane",
+                "lastName": "Doe",
+                "organization": None,
+                "address1": None,
+                "address2": None,
+                "zip": None,
+                "city": None,
+                "country": "United States",
+                "stateProvinceRegion": None,
+                "email": None,
+                "receiveDate": "2024-01-01T05:00:00Z",
+                "postedDate": "2024-01-02T05:00:00Z",
+                "postmarkDate": None,
+                "duplicateComments": 0,
+                "withdrawn": False,
+            },
+            "links": {
+                "self": f"https://api.regulations.gov/v4/comments/{comment_id}"
+            },
+        }
+    }
+
+
+def fake_docket(docket_id):
+    return {
+        "data": {
+            "id": docket_id,
+            "type": "dockets",
+            "attributes": {
+                "agencyId": docket_id.split("-")[0],
+                "title": f"Docket {docket_id}",
+                "docketType": "Rulemaking",
+                "keywords": None,
+                "dkAbstract": None,
+                "category": None,
+                "modifyDate": "2024-01-01T05:00:00Z",
+                "effectiveDate": None,
+                "organization": None,
+                "program": None,
+                "rin": None,
+                "objectId": "0b0000000000000",
+            },
+            "links": {"self": f"https://api.regulations.gov/v4/dockets/{docket_id}"},
+        }
+    }
+
+
+def fake_document(document_id):
+    docket_id = document_id[:-5]
+    return {
+        "data": {
+            "id": document_id,
+            "type": "documents",
+            "attributes": {
+                "originalDocumentId": None,
+                "documentType": "Proposed Rule",
+                "subtype": None,
+                "docketId": docket_id,
+                "agencyId": docket_id.split("-")[0],
+                "title": f"Document {document_id}",
+                "docAbstract": None,
+                "topics": None,
+                "subject": None,
+                "commentStartDate": "2024-01-01T05:00:00Z",
+                "commentEndDate": None,
+                "effectiveDate": None,
+                "implementationDate": None,
+                "modifyDate": "2024-01-01T05:00:00Z",
+                "openForComment": True,
+                "allowLateComments": False,
+                "objectId": "0900000000000000",
+                "withdrawn": False,
+                "fileFormats": [],
+            },
+            "links": {"self": f"https://api.regulations.gov/v4/documents/{document_id}"},
+        }
+    }
+
+
+FAKES = {"comments": fake_comment, "dockets": fake_docket, "documents": fake_document}
+
+
+class StubAPI:
+    def __init__(self, latency=0.2, requests_per_hour=1000):
+        self.latency = latency
+        self.requests_per_hour = requests_per_hour
+        self.window_start = time.monotonic()
+        self.usage = {}
+        self.lock = threading.Lock()
+
+    def take(self, api_key):
+        """Count a request against `api_key` and return the calls it has left."""
+        with self.lock:
+            if time.monotonic() - self.window_start >= 3600:
+                self.window_start = time.monotonic()
+                self.usage = {}
+            used = self.usage.get(api_key, 0)
+            if used >= self.requests_per_hour:
+                return -1
+            self.usage[api_key] = used + 1
+            return self.requests_per_hour - used - 1
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                api_key = parse_qs(url.query).get("api_key", [""])[0]
+                remaining = api.take(api_key)
+                time.sleep(api.latency)
+
+                parts = url.path.strip("/").split("/")
+                if remaining < 0:
+                    status, body = 429, {"error": {"code": "OVER_RATE_LIMIT"}}
+                elif len(parts) == 3 and parts[1] in FAKES:
+                    status, body = 200, FAKES[parts[1]](parts[2])
+                else:
+                    status, body = 404, {"errors": [{"status": "404"}]}
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/vnd.api+json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("X-RateLimit-Limit", str(api.requests_per_hour))
+                self.send_header("X-RateLimit-Remaining", str(max(remaining, 0)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def start_stub_server(port=0, latency=0.2, requests_per_hour=1000):
+    """Start the stub API in a background thread and return the server.
+
+    The base URL to point `REGGOV_API_URL` at is
+    `f"http://127.0.0.1:{server.server_port}/v4"`.
+    """
+    api = StubAPI(latency, requests_per_hour)
+    server = ThreadingHTTPServer(("127.0.0.1", port), api.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--requests-per-hour", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port, args.latency, args.requests_per_hour)
+    print(f"Stub API listening on http://127.0.0.1:{server.server_port}/v4")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
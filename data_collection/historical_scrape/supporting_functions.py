@@ -1,124 +1,166 @@
+import asyncio
 import html
-import json
-import math
+import logging
 import os
-import subprocess
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
 from datetime import datetime, timedelta
-from glob import glob
 from io import BytesIO
 import psycopg2
 
 import boto3
 import botocore
-import pdfplumber
-import PyPDF2
 import requests
-from flatten_json import flatten
-from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTChar, LTTextContainer
 
 import config  # pylint: disable=unused-import
-
-
-def get_ids(data_date):
-    api_key = os.getenv("REGGOV_API_KEY_L00")
-    # Figure out how many times we have to call the API to get all the comment ids
-    url = f"https://api.regulations.gov/v4/comments?filter[postedDate]={data_date}&page[size]=5&page[number]=1&sort=lastModifiedDate&api_key={api_key}"
-    response = requests.get(url)
-    result = response.json()
-    # There are maximum 4750 comments per call, so we divide the total number of comments by 4750,
-    # round up to get the number of calls we need to make, and add 1 just to be safe
-    rounds = math.ceil(result["meta"]["totalElements"] / 4750) + 1
+from jobs.historical_scrape.docx_service import docx_to_text
+from jobs.historical_scrape.extraction_cache import ExtractionCache, hash_content
+from jobs.historical_scrape.extraction_pool import ExtractionPool
+from jobs.historical_scrape.fetcher import (
+    API_URL,
+    MAX_ATTEMPTS,
+    RETRY_DELAY,
+    fetch_comments,
+    retryable,
+)
+from jobs.historical_scrape.key_pool import KeyPool
+from jobs.historical_scrape.metadata_cache import MetadataCache
+from jobs.historical_scrape.projector import Projector
+from jobs.historical_scrape.s3_archiver import S3Archiver
+
+
+# The API returns at most 250 comments per page and 20 pages per query
+PAGE_SIZE: int = 250
+MAX_PAGES: int = 20
+# Docket and document metadata requests in flight at once
+METADATA_WORKERS: int = 8
+
+
+def _cursor(last_modified):
+    # Turn a lastModifiedDate of the API into a value for filter[lastModifiedDate][ge].
+    # Correct the time to account for the difference in time zone between the API response and the API call
+    cursor = datetime.strptime(last_modified[:-1], "%Y-%m-%dT%H:%M:%S") - timedelta(hours=5)
+    return cursor.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _get_page(session, params, key_pool):
+    # A 429 parks the key in the pool until its Retry-After, so the retry goes to another key
+    # or waits for it. Server errors and dropped connections are retried after a growing delay
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        key = key_pool.acquire()
+        try:
+            response = session.get(f"{API_URL}/comments", params={**params, "api_key": key.api_key})
+        except requests.ConnectionError as e:
+            key_pool.update(key, None)
+            status, error = None, e
+        else:
+            key_pool.update(key, response.status_code, response.headers)
+            status = response.status_code
+            if not retryable(status):
+                response.raise_for_status()
+                return response.json()
+            error = requests.HTTPError(f"{status} listing the comments", response=response)
+        if attempt == MAX_ATTEMPTS:
+            raise error
+        logging.warning(f"Failed to list the comments: {error}. Retrying")
+        if status != 429:
+            time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+
+
+def iter_comments(filters, key_pool, meta=None, session=None, since=None):
+    """Stream the comment summaries matching `filters`, oldest modification first.
+
+    Pages through the results sorted by lastModifiedDate. Because a query can only
+    go 20 pages deep, the lastModifiedDate of the last comment seen is used as a
+    cursor to start a new query once the pages run out. It stops as soon as a page
+    comes back short. Comments that show up twice around the cursor are only yielded
+    once. If `meta` is a dict, it is filled with the meta block of the first response.
+    With `since`, a lastModifiedDate as returned by the API, only the comments
+    modified at or after it are listed. The requests use the keys of `key_pool`.
+    """
+    session = session or requests.Session()
+    seen = set()
+    cursor = _cursor(since) if since else None
+
+    while True:
+        last_modified = None
+        for page in range(1, MAX_PAGES + 1):
+            params = dict(filters)
+            if cursor is not None:
+                params["filter[lastModifiedDate][ge]"] = cursor
+            params.update(
+                {
+                    "page[size]": PAGE_SIZE,
+                    "page[number]": page,
+                    "sort": "lastModifiedDate",
+                }
+            )
+            result = _get_page(session, params, key_pool)
+            if meta is not None and not meta:
+                meta.update(result["meta"])
+
+            comments = result["data"] or []
+            for comment in comments:
+                last_modified = comment["attributes"]["lastModifiedDate"]
+                if comment["id"] not in seen:
+                    seen.add(comment["id"])
+                    yield comment
+
+            if len(comments) < PAGE_SIZE:
+                return
+
+        # We ran out of pages, so start a new query from the last modified date we saw
+        next_cursor = _cursor(last_modified)
+        if next_cursor == cursor:
+            print(f"More than {PAGE_SIZE * MAX_PAGES} comments were modified at {cursor}, can't page past them")
+            return
+        cursor = next_cursor
+
+
+def get_ids(data_date, key_pool=None):
+    # List with the keys the comments will be fetched with, or by default the key kept for listing
+    if key_pool is None:
+        key_pool = KeyPool.from_env(["L00"])
+
+    meta = {}
+    comment_ids = [
+        comment["id"]
+        for comment in iter_comments({"filter[postedDate]": data_date}, key_pool, meta)
+    ]
 
     # Handle the case where there are no comments
-    if result["meta"]["totalElements"] == 0:
+    if not comment_ids:
         print("No comments found for this date")
         return []
-    else:
-        # Create lists to store the comment ids and the API responses
-        api_response = []
-        comment_metadata = []
-
-        # Call the API the first time and get the comment ids
-        for page in range(1, 20):
-            url = f"https://api.regulations.gov/v4/comments?filter[postedDate]={data_date}&page[size]=250&page[number]={page}&sort=lastModifiedDate&api_key={api_key}"
-            response = requests.get(url)
-            result = response.json()
-
-            if result["data"] is None or not result["data"]:
-                print("Got no comments from the API call")
-                continue
-            else:
-                api_response.append(result)
-                for comment in result["data"]:
-                    comment_metadata.append(comment["id"])
-
-        # Reset the time variables to get the last modified date of the last comment in the first API call. Thus we can use this date to get the next batch of comments
-        greater_than = api_response[-1]["data"][-1]["attributes"]["lastModifiedDate"][
-            :-1
-        ]
-        greater_than = greater_than.replace("T", " ")
-        date_str = greater_than
-        date_format = "%Y-%m-%d %H:%M:%S"
-
-        date_obj = datetime.strptime(date_str, date_format)
-        greater_than = date_obj - timedelta(
-            hours=5
-        )  ## Correct the time variable to account for difference the time zone in the API response and the API call
-
-        for _ in range(0, rounds):
-            for page in range(1, 20):
-                url = f"https://api.regulations.gov/v4/comments?filter[postedDate]={data_date}&filter[lastModifiedDate][ge]={greater_than}&page[size]=250&page[number]={page}&sort=lastModifiedDate&api_key={api_key}"
-                response = requests.get(url)
-                result = response.json()
-
-                # Save the API response to a list if there are comments in the response
-                if result["data"] is None or not result["data"]:
-                    continue
-                else:
-                    api_response.append(result)
-                    for comment in result["data"]:
-                        comment_metadata.append(
-                            comment["id"]
-                        )  ## Save the comment ids to a list
 
-            try:
-                greater_than = api_response[-1]["data"][-1]["attributes"][
-                    "lastModifiedDate"
-                ][:-1]
-                greater_than = greater_than.replace("T", " ")
-                date_obj = datetime.strptime(greater_than, date_format)
-                greater_than = date_obj - timedelta(hours=5)
-                print("Fetched data")
-            except:
-                print("Got no comments from the API call")
+    # Make sure we got all the comments
+    scrape_count = len(comment_ids)
+    api_count = meta["totalElements"]
 
-        ## Remove duplicate elements in the list of comment IDS
-        comment_ids = []
-        [comment_ids.append(x) for x in comment_metadata if x not in comment_ids]
+    if scrape_count == api_count:
+        print(f"We got all the {scrape_count} comments")
+    else:
+        # raise
+        print(
+            f"We didn't get all the comments. We got {scrape_count} comments, but the API says there are {api_count} comments"
+        )
+        # Here we want to send emails to the team to alert them that we didn't get all the comments
 
-        # Make sure we got all the comments
-        scrape_count = len(comment_ids)
-        api_count = api_response[0]["meta"]["totalElements"]
+    return comment_ids
 
-        if scrape_count == api_count:
-            print(f"We got all the {scrape_count} comments")
-        else:
-            # raise
-            print(
-                f"We didn't get all the comments. We got {scrape_count} comments, but the API says there are {api_count} comments"
-            )
-            # Here we want to send emails to the team to alert them that we didn't get all the comments
 
-        return comment_ids
+@lru_cache(maxsize=None)
+def _default_s3_client():
+    return boto3.client("s3")
 
 
-def check_file_exists(bucket, key):
+def check_file_exists(bucket, key, s3_client=None):
     try:
-        boto3.resource("s3").Object(bucket, key).load()
+        (s3_client or _default_s3_client()).head_object(Bucket=bucket, Key=key)
     except botocore.exceptions.ClientError as e:
-        if e.response["Error"]["Code"] == "404":
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
             return False
         else:
             raise
@@ -126,229 +168,168 @@ def check_file_exists(bucket, key):
         return True
 
 
-def get_comments(ids, s3_client, bucket_name):
-
-    # Load in the API keys
-    keys = [
-        "L01",
-        "L02",
-        "L03",
-        "L04",
-        "L05",
-        "J06",
-        "J07",
-        "J08",
-        "J09",
-        "J10",
-        "H11",
-        "M12",
-        "M13",
-        "M14",
-        "M15",
-    ]
+def get_comments(ids, s3_client, bucket_name, on_fetched=None, archiver=None, key_pool=None):
+    """Fetch the details of the comments in `ids` and archive the raw JSON to S3.
 
-    # Figure out how many rounds it will take to scrape all the comments
-    rounds = len(ids) / 500
-    rounds = math.ceil(rounds)
+    The raw JSON is uploaded in the background by `archiver`, by default an
+    `S3Archiver` that stores one object per comment. `on_fetched(comment_id,
+    result)` is called for each comment as soon as it is fetched, from a
+    worker thread. The requests use the keys of `key_pool`, by default all the
+    historical keys. With no `s3_client` and no `archiver`, nothing is archived.
 
-    comment_details = []
+    Returns the API responses, or only the number of comments fetched when
+    `on_fetched` is given: it gets every response, so they aren't kept here.
+    """
+    owns_archiver = archiver is None and s3_client is not None
+    if owns_archiver:
+        archiver = S3Archiver(s3_client, bucket_name)
 
-    num = 0
+    def archive(comment_id, result):
+        if on_fetched is not None:
+            on_fetched(comment_id, result)
+        # Store a copy of the data so we don't have to scrape it again
+        if archiver is not None:
+            archiver.put(comment_id, result)
 
-    for _ in range(rounds):
-        for key in keys:
-            api_key = os.getenv(f"REGGOV_API_KEY_{key}")
-            for _ in range(50):
-                # In the last round, there might not be 50 comments left, so we break when we run out of comments to scrape
-                try:
-                    comment_id = ids[num]
-                    docket_id = comment_id[:-5]
-                    url = f"https://api.regulations.gov/v4/comments/{comment_id}?include=attachments&api_key={api_key}"
-                    response = requests.get(url)
-                    result = response.json()
-
-                    # And append the data to the today_comments list so we can access the download links and store the pdfs
-                    comment_details.append(result)
-
-                    # Try to write the data to the S3 bucket to store a copy of the data so we don't have to scrape it again
-                    try:
-                        # create a directory for each regulation, save each comment as is own json named the comment ID
-                        filename = f"data/raw/{docket_id}/{comment_id}.json"
-
-                        comment_text_buffer = BytesIO()
-                        comment_text_buffer.write(
-                            json.dumps(json.dumps(result)).encode()
-                        )
-
-                        s3_client.upload_fileobj(
-                            comment_text_buffer, "commons-docs", filename
-                        )
-                        s3_client.get_waiter("object_exists").wait(
-                            Bucket=bucket_name, Key=filename
-                        )
-                    except Exception as e:
-                        print(f"Error uploading to S3: {e}")
-
-                except Exception as e:
-                    break
-
-                num = num + 1
-                time.sleep(0.4)
-                print(num)
+    try:
+        # Fetch the comments with all the API keys at once, each one at its own allowed rate
+        comment_details = asyncio.run(
+            fetch_comments(ids, key_pool=key_pool, archive=archive, keep=on_fetched is None)
+        )
+    finally:
+        if owns_archiver:
+            archiver.close()
+    fetched = comment_details if on_fetched is not None else len(comment_details)
+    print(f"Fetched {fetched} of {len(ids)} comments")
 
     return comment_details
 
 
-def get_comment_text(comments):
-
-    # Function to extract text
-    def text_extraction(element):
-        # Extracting the text from the in-line text element
-        line_text = element.get_text()
-
-        # Find the formats of the text
-        # Initialize the list with all the formats that appeared in the line of text
-        line_formats = []
-        for text_line in element:
-            if isinstance(text_line, LTTextContainer):
-                # Iterating through each character in the line of text
-                for character in text_line:
-                    if isinstance(character, LTChar):
-                        # Append the font name of the character
-                        line_formats.append(character.fontname)
-                        # Append the font size of the character
-                        line_formats.append(character.size)
-        # Find the unique font sizes and names in the line
-        format_per_line = list(set(line_formats))
-
-        # Return a tuple with the text in each line along with its format
-        return (line_text, format_per_line)
-
-    # Loop through the comments and extract the text from the attached pdfs
-    for comment in comments:
-        id = comment["data"]["id"]
-        try:
-            num = 1
-            attachment_url = ""
-            for files in comment["included"]:
+def _download(url, session):
+    # Stream the attachment straight into memory
+    buffer = BytesIO()
+    with session.get(url, stream=True) as response:
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            buffer.write(chunk)
+    return buffer.getvalue()
+
+
+def _cached(text):
+    future = Future()
+    future.set_result(text)
+    return future
+
+
+def get_comment_text(comments, max_workers=None, docx_converter=None, cache=None, pool=None):
+    """Extract the text of the attachments of each comment into its attributes.
+
+    .docx attachments are read straight from their XML. Pass a `DocxConverter`
+    to convert them to PDF with LibreOffice and extract them like the PDFs instead.
+    Text is looked up in `cache` (by default the local `ExtractionCache`) by URL
+    and then by content hash before anything is downloaded or parsed. Pass
+    `cache=False` to skip it. Pass an `ExtractionPool` as `pool` to reuse its
+    workers across calls, and a cache to reuse its connection.
+    """
+    owns_cache = cache is None
+    if owns_cache:
+        cache = ExtractionCache()
+    try:
+        return _get_comment_text(comments, max_workers, docx_converter, cache, pool)
+    finally:
+        if owns_cache:
+            cache.close()
+
+
+def _get_comment_text(comments, max_workers, docx_converter, cache, pool):
+    session = requests.Session()
+    # The URL and content hash of the attachments extracted in this run, to cache their text
+    extracted = {}
+    with nullcontext(pool) if pool else ExtractionPool(max_workers=max_workers) as pool:
+        # Download the attachments and hand them to the worker processes, which parse them in
+        # parallel while the rest are downloaded. We keep the futures for each comment, in order
+        jobs = []
+        # (formats, index, comment id, bytes) of the .docx files waiting for LibreOffice
+        to_convert = []
+        for comment in comments:
+            id = comment["data"]["id"]
+            try:
+                included = comment["included"]
+            except KeyError:
+                jobs.append(None)
+                continue
+
+            attachments = []
+            for files in included:
+                # Each attachment is a list of (url, future) for its file formats, and ends
+                # with (None, exception) if it failed before all of them were submitted
+                formats = []
                 try:
-                    result = ""
                     # Loop through the files and get the pdfs
                     for file in files["attributes"]["fileFormats"]:
                         url = file["fileUrl"]
-                        response = requests.get(url)
-                        attachment_url = attachment_url + str(url) + " "
+                        # Text from LibreOffice's PDFs differs from the direct .docx text, so it isn't cached
+                        use_cache = cache and not (url.endswith(".docx") and docx_converter)
+
+                        text = cache.get_by_url(url) if use_cache else None
+                        if text is not None:
+                            formats.append((url, _cached(text)))
+                            continue
+
+                        content = _download(url, session)
+                        formats.append((url, None))
+
+                        if use_cache:
+                            content_hash = hash_content(content)
+                            text = cache.get_by_hash(content_hash)
+                            if text is not None:
+                                cache.put(url, content_hash, text)
+                                formats[-1] = (url, _cached(text))
+                                continue
+
+                        if not url.endswith(".docx"):
+                            formats[-1] = (url, pool.submit(id, content))
+                        elif docx_converter is None:
+                            formats[-1] = (url, pool.submit(id, content, docx_to_text))
+                        else:
+                            to_convert.append((formats, len(formats) - 1, id, content))
+                        if use_cache:
+                            extracted[formats[-1][1]] = (url, content_hash)
+                except Exception as inst:
+                    formats.append((None, inst))
+                attachments.append(formats)
+            jobs.append(attachments)
+
+        # Convert the .docx files in one batch, and extract the PDFs like the others
+        if to_convert:
+            pdfs = docx_converter.convert([content for *_, content in to_convert])
+            for (formats, index, id, _), pdf_bytes in zip(to_convert, pdfs):
+                url = formats[index][0]
+                if pdf_bytes is None:
+                    formats[index] = (url, Future())
+                    formats[index][1].set_exception(RuntimeError(f"Could not convert {url}"))
+                else:
+                    formats[index] = (url, pool.submit(id, pdf_bytes))
 
-                        # pdf_path = f"{id}_attachment_{num}.pdf"
-                        pdf_path = os.path.abspath(f"{id}_attachment_{num}.pdf")
-                        doc_path = os.path.abspath("temp.docx")
-                        soffice_path = (
-                            "/Applications/LibreOffice.app/Contents/MacOS/soffice"
-                        )
-
-                        if url.endswith(".docx"):
-                            with open(doc_path, "wb") as f:
-                                f.write(response.content)
-                            subprocess.run(
-                                [
-                                    soffice_path,
-                                    "--convert-to",
-                                    "pdf",
-                                    "--headless",
-                                    doc_path,
-                                ]
-                            )
-                            os.rename("temp.pdf", pdf_path)
-                            os.remove("temp.docx")
+        # Merge the extracted text back into the comments as the workers finish
+        for comment, attachments in zip(comments, jobs):
+            if attachments is None:
+                comment["data"]["attributes"]["attachment_read"] = "no attachment"
+                comment["data"]["attributes"]["attachments_url"] = None
+                continue
 
-                        else:
-                            with open(pdf_path, "wb") as f:
-                                f.write(response.content)
-
-                        # ADD PDF SCRAPER HERE
-                        pdfFileObj = open(pdf_path, "rb")
-                        pdfReaded = PyPDF2.PdfReader(pdfFileObj)
-
-                        # Get the number of pages in the PDF file
-                        num_pages = len(pdfReaded.pages)
-
-                        # Create the dictionary to extract text from each image
-                        text_per_page = {}
-
-                        # We extract the pages from the PDF
-                        for pagenum, page in enumerate(extract_pages(pdf_path)):
-                            if pagenum > 2:
-                                break
-                            # Initialize the variables needed for the text extraction from the page
-                            pageObj = pdfReaded.pages[pagenum]
-                            page_text = []
-                            line_format = []
-                            page_content = []
-
-                            # Open the pdf file
-                            pdf = pdfplumber.open(pdf_path)
-
-                            # Find the examined page
-                            page_tables = pdf.pages[pagenum]
-
-                            # Find all the elements
-                            page_elements = [
-                                (element.y1, element) for element in page._objs
-                            ]
-
-                            # Sort all the elements as they appear in the page
-                            page_elements.sort(key=lambda a: a[0], reverse=True)
-
-                            # Find the elements that composed a page
-                            for i, component in enumerate(page_elements):
-                                # Extract the position of the top side of the element in the PDF
-                                pos = component[0]
-
-                                # Extract the element of the page layout
-                                element = component[1]
-
-                                # Check if the element is a text element
-                                if isinstance(element, LTTextContainer):
-                                    # Use the function to extract the text and format for each text element
-                                    (line_text, format_per_line) = text_extraction(
-                                        element
-                                    )
-
-                                    # Append the text of each line to the page text
-                                    page_text.append(line_text)
-
-                                    # Append the format for each line containing text
-                                    line_format.append(format_per_line)
-                                    page_content.append(line_text)
-                                # Create the key of the dictionary
-                                dctkey = "Page_" + str(pagenum)
-
-                                # Add the list of list as the value of the page key
-                                text_per_page[dctkey] = [
-                                    page_text,
-                                    line_format,
-                                    page_content,
-                                ]
-
-                            # Display the content of the page
-                            page_result = "".join(
-                                text_per_page["Page_" + str(pagenum)][0]
-                            )
-                            result = result + "\n \n" + page_result
-
-                            # Close the pdf file
-                            pdfFileObj.close()
-
-                            # Remove pdf files that are not needed anymore
-                        try:
-                            os.remove(pdf_path)
-                            files = glob(f"*.pdf")
-                            for f in files:
-                                os.remove(f)
-                        except:
-                            print("No files to remove")
-
-                        num = num + 1
+            attachment_url = ""
+            for formats in attachments:
+                try:
+                    result = ""
+                    for url, future in formats:
+                        if url is None:
+                            raise future
+                        attachment_url = attachment_url + str(url) + " "
+                        if future is not None:
+                            text = pool.result(future)
+                            if future in extracted:
+                                cache.put(*extracted[future], text)
+                            result = result + text
 
                     # Save the extracted text to the json file from the api call
                     comment["data"]["attributes"]["pdf_extracted_text"] = result
@@ -365,234 +346,261 @@ def get_comment_text(comments):
                         "attachment_read"
                     ] = "attachment failed"
                     comment["data"]["attributes"]["attachments_url"] = attachment_url
-                except:
-                    comment["data"]["attributes"][
-                        "attachment_read"
-                    ] = "attachment failed"
-                    comment["data"]["attributes"]["attachments_url"] = attachment_url
-                    raise
-        except KeyError:
-            comment["data"]["attributes"]["attachment_read"] = "no attachment"
-            comment["data"]["attributes"]["attachments_url"] = None
+
+    if cache:
+        print(f"Extraction cache: {cache.hits} hits, {cache.misses} misses")
     return comments
 
 
+# Where each column of a structured comment comes from in the API response, in the column
+# order of INSERT_COMMENTS_STMT. full_text is added afterwards, from comment and comment_pdf_extracted
+COMMENT_FIELDS = [
+    ("comment_id", "data.id"),
+    ("docket_id", "data.attributes.docketId"),
+    ("agency_id", "data.attributes.agencyId"),
+    ("title", "data.attributes.title"),
+    ("comment", "data.attributes.comment"),
+    ("comment_pdf_extracted", "data.attributes.pdf_extracted_text"),
+    ("commenter_first_name", "data.attributes.firstName"),
+    ("commenter_last_name", "data.attributes.lastName"),
+    ("commenter_organization", "data.attributes.organization"),
+    ("commenter_address1", "data.attributes.address1"),
+    ("commenter_address2", "data.attributes.address2"),
+    ("commenter_zip", "data.attributes.zip"),
+    ("commenter_city", "data.attributes.city"),
+    ("commenter_state_province_region", "data.attributes.stateProvinceRegion"),
+    ("commenter_country", "data.attributes.country"),
+    ("commenter_email", "data.attributes.email"),
+    ("receive_date", "data.attributes.receiveDate"),
+    ("posted_date", "data.attributes.postedDate"),
+    ("postmark_date", "data.attributes.postmarkDate"),
+    ("duplicate_comments", "data.attributes.duplicateComments"),
+    ("attachment_read", "data.attributes.attachment_read"),
+    ("attachment_url", "data.attributes.attachments_url"),
+    ("withdrawn", "data.attributes.withdrawn"),
+    ("api_url", "data.links.self"),
+    ("document_id", "data.attributes.commentOnDocumentId"),
+]
+COMMENT_PROJECTOR = Projector(COMMENT_FIELDS)
+
+
 def structure_data(data):
-    keys_to_include = [
-        "data_id",
-        "data_attributes_commentOnDocumentId",
-        "data_attributes_docketId",
-        "data_attributes_agencyId",
-        "data_attributes_title",
-        "data_attributes_comment",
-        "data_attributes_pdf_extracted_text",
-        "data_attributes_firstName",
-        "data_attributes_lastName",
-        "data_attributes_organization",
-        "data_attributes_address1",
-        "data_attributes_address2",
-        "data_attributes_zip",
-        "data_attributes_city",
-        "data_attributes_country",
-        "data_attributes_stateProvinceRegion",
-        "data_attributes_email",
-        "data_attributes_receiveDate",
-        "data_attributes_postedDate",
-        "data_attributes_postmarkDate",
-        "data_links_self",
-        "data_attributes_attachments_url",
-        "data_attributes_attachment_read",
-        "data_attributes_duplicateComments",
-        "data_attributes_withdrawn",
-    ]
-    final_data = []
-    for comment in data:
-        # Flatten the nested dictionaries
-        flat_comment = flatten(comment)
-        result_dict = {}
-        for key, value in flat_comment.items():
-            if key in keys_to_include:
-                if isinstance(value, dict):
-                    # Recursively process nested dictionaries
-                    result_dict[key] = structure_data(value, keys_to_include)
-                else:
-                    # Include non-dictionary values
-                    result_dict[key] = value if value is not None else ""
-        final_data.append(result_dict)
-
-    # Rename the keys to match the database
-    key_mapping = {
-        "data_id": "comment_id",
-        "data_attributes_commentOnDocumentId": "document_id",
-        "data_attributes_docketId": "docket_id",
-        "data_attributes_agencyId": "agency_id",
-        "data_attributes_title": "title",
-        "data_attributes_comment": "comment",
-        "data_attributes_pdf_extracted_text": "comment_pdf_extracted",
-        "data_attributes_firstName": "commenter_first_name",
-        "data_attributes_lastName": "commenter_last_name",
-        "data_attributes_organization": "commenter_organization",
-        "data_attributes_address1": "commenter_address1",
-        "data_attributes_address2": "commenter_address2",
-        "data_attributes_zip": "commenter_zip",
-        "data_attributes_city": "commenter_city",
-        "data_attributes_stateProvinceRegion": "commenter_state_province_region",
-        "data_attributes_country": "commenter_country",
-        "data_attributes_email": "commenter_email",
-        "data_attributes_receiveDate": "receive_date",
-        "data_attributes_postedDate": "posted_date",
-        "data_attributes_postmarkDate": "postmark_date",
-        "data_attributes_duplicateComments": "duplicate_comments",
-        "data_attributes_attachment_read": "attachment_read",
-        "data_attributes_attachments_url": "attachment_url",
-        "data_attributes_withdrawn": "withdrawn",
-        "data_links_self": "api_url",
-    }
-
-    # Rename the keys so they match the database
-    for i in final_data:
-        for old_key, new_key in key_mapping.items():
-            i[new_key] = i.pop(old_key, "")
-    return final_data
-
-
-def get_dockets(result):
+    """Turn the API responses in `data` into dicts with the columns of the comments table.
+
+    Only the fields in `COMMENT_FIELDS` are read from each response, and
+    missing or null ones are set to "".
+    """
+    return COMMENT_PROJECTOR.dicts(data)
+
+
+def _fetch_metadata(path, ids, api_key, params=None, workers=METADATA_WORKERS):
+    """Fetch `{API_URL}/{path}/{id}` for every id at once and return a dict of the responses.
+
+    The requests are paced by a `KeyPool` with the one key, so they stay
+    within its hourly limit, and a request that gets a 429 is retried once the
+    key is available again. Ids that can't be fetched are left out.
+    """
+    key_pool = KeyPool({"metadata": api_key})
+    session = requests.Session()
+
+    def fetch(id):
+        for _ in range(MAX_ATTEMPTS):
+            key = key_pool.acquire()
+            status, headers = None, None
+            try:
+                response = session.get(
+                    f"{API_URL}/{path}/{id}", params={**(params or {}), "api_key": key.api_key}
+                )
+                status, headers = response.status_code, response.headers
+                if status == 429:
+                    continue
+                response.raise_for_status()
+                return response.json()
+            except Exception as e:
+                print(f"Error fetching {path} {id}: {e}")
+                if status is not None and status < 500:
+                    return None
+            finally:
+                key_pool.update(key, status, headers)
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = dict(zip(ids, executor.map(fetch, ids)))
+    return {id: response for id, response in responses.items() if response is not None}
+
+
+def _cached_metadata(kind, ids, cache, fetch, modify_key):
+    # Return the metadata of `ids` in order, fetching only what isn't fresh in the cache
+    if cache is None:
+        cache = MetadataCache()
+    found = cache.get_many(kind, ids) if cache else {}
+    stale = [id for id in ids if id not in found]
+    fetched = fetch(stale)
+    if cache:
+        cache.put_many(kind, fetched.items(), modify_key)
+    print(f"{kind.capitalize()} metadata: {len(found)} cached, {len(fetched)} of {len(stale)} fetched")
+    found.update(fetched)
+    return [found[id] for id in ids if id in found]
+
+
+def get_dockets(result, cache=None):
+    """Return the metadata of the dockets of the comments in `result`.
+
+    Metadata still fresh in `cache` (by default the local `MetadataCache`) is
+    reused, and the rest is fetched concurrently. Pass `cache=False` to fetch
+    everything.
+    """
     # Load in the API key
     extra_api_key = os.getenv("REGGOV_API_KEY_N1")
 
-    docket_ids = []
-    # Loop through the scraped comments to get the docket ids
-    for id in result:
-        docket_ids.append(id["docket_id"])
-
-    # Remove duplicate elements in the list of docket IDS
-    unique_docket_ids = []
-    [unique_docket_ids.append(x) for x in docket_ids if x not in unique_docket_ids]
-
-    # Get the metadata for each docket
-    docket_metadata = []
-    for docket_id in unique_docket_ids:
-        url = f"https://api.regulations.gov/v4/dockets/{docket_id}?api_key={extra_api_key}"
-        response = requests.get(url)
-        result = response.json()
-        docket_metadata.append(result)
-        time.sleep(1.5)
-
-    # Only keep some of the keys
-    cleaned_docket_metadata = []
-    for docket in docket_metadata:
-        docket = docket["data"]
-        docket = {
-            "docket_id": docket["id"],
-            "agency_id": docket["attributes"]["agencyId"],
-            "title": docket["attributes"]["title"],
-            "docket_type": docket["attributes"]["docketType"],
-            "keywords": docket["attributes"]["keywords"],
-            "abstract": docket["attributes"]["dkAbstract"],
-            "category": docket["attributes"]["category"],
-            "modify_date": docket["attributes"]["modifyDate"],
-            "effective_date": docket["attributes"]["effectiveDate"],
-            "organization": docket["attributes"]["organization"],
-            "program": docket["attributes"]["program"],
-            "rin": docket["attributes"]["rin"],
-            "object_id": docket["attributes"]["objectId"],
-            "docket_url": docket["links"]["self"],
-        }
-
-        cleaned_docket_metadata.append(docket)
-
-    return cleaned_docket_metadata
-
-
-def get_documents(result):
+    # The unique docket ids of the scraped comments, in order
+    docket_ids = list(dict.fromkeys(item["docket_id"] for item in result))
+
+    def fetch(docket_ids):
+        # Only keep some of the keys
+        cleaned_docket_metadata = {}
+        for docket_id, docket in _fetch_metadata("dockets", docket_ids, extra_api_key).items():
+            try:
+                docket = docket["data"]
+                cleaned_docket_metadata[docket_id] = {
+                    "docket_id": docket["id"],
+                    "agency_id": docket["attributes"]["agencyId"],
+                    "title": docket["attributes"]["title"],
+                    "docket_type": docket["attributes"]["docketType"],
+                    "keywords": docket["attributes"]["keywords"],
+                    "abstract": docket["attributes"]["dkAbstract"],
+                    "category": docket["attributes"]["category"],
+                    "modify_date": docket["attributes"]["modifyDate"],
+                    "effective_date": docket["attributes"]["effectiveDate"],
+                    "organization": docket["attributes"]["organization"],
+                    "program": docket["attributes"]["program"],
+                    "rin": docket["attributes"]["rin"],
+                    "object_id": docket["attributes"]["objectId"],
+                    "docket_url": docket["links"]["self"],
+                }
+            except (KeyError, TypeError):
+                print(f"Error in the docket metadata for {docket_id}")
+        return cleaned_docket_metadata
+
+    return _cached_metadata("dockets", docket_ids, cache, fetch, "modify_date")
+
+
+def get_documents(result, cache=None):
+    """Return the metadata of the documents the comments in `result` are on.
+
+    Cached like `get_dockets`.
+    """
     # Load in the API key
     extra_api_key = os.getenv("REGGOV_API_KEY")
 
-    document_ids = []
-    # Loop through the scraped comments to get the docket ids
-    for id in result:
-        document_ids.append(id["document_id"])
-
-    # Remove duplicate elements in the list of docket IDS
-    unique_document_ids = []
-    [
-        unique_document_ids.append(x)
-        for x in document_ids
-        if x not in unique_document_ids
-    ]
+    # The unique document ids of the scraped comments, in order
+    document_ids = list(dict.fromkeys(item["document_id"] for item in result))
 
-    # Get the metadata for each docket
-    document_metadata = []
-    for document_id in unique_document_ids:
-        url = f"https://api.regulations.gov/v4/documents/{document_id}?include=attachments&api_key={extra_api_key}"
-        response = requests.get(url)
-        result = response.json()
-        document_metadata.append(result)
-        time.sleep(1.5)
-
-    # Only keep some of the keys
-    cleaned_document_metadata = []
-    for document in document_metadata:
-        try:
-            document = document["data"]
-            document = {
-                "document_id": document["id"],
-                "original_document_id": document["attributes"]["originalDocumentId"],
-                "document_type": document["attributes"]["documentType"],
-                "subtype": document["attributes"]["subtype"],
-                "docket_id": document["attributes"]["docketId"],
-                "agency_id": document["attributes"]["agencyId"],
-                "title": document["attributes"]["title"],
-                "abstract": document["attributes"]["docAbstract"],
-                "topics": document["attributes"]["topics"],
-                "subject": document["attributes"]["subject"],
-                "comment_start_date": document["attributes"]["commentStartDate"],
-                "comment_end_date": document["attributes"]["commentEndDate"],
-                "effective_date": document["attributes"]["effectiveDate"],
-                "implementation_date": document["attributes"]["implementationDate"],
-                "modified_date": document["attributes"]["modifyDate"],
-                "open_for_comment": document["attributes"]["openForComment"],
-                "allow_late_comments": document["attributes"]["allowLateComments"],
-                "object_id": document["attributes"]["objectId"],
-                "withdrawn": document["attributes"]["withdrawn"],
-                "document_url": document["links"]["self"],
-                "attachments": [
-                    file["fileUrl"]
-                    for file in document["attributes"].get("fileFormats", [])
-                    if "fileUrl" in file
-                ]
-                or None,
-            }
-            cleaned_document_metadata.append(document)
-        except:
-            print(f"Error in the document metadata for {document_id}")
-
-    return cleaned_document_metadata
+    def fetch(document_ids):
+        # Only keep some of the keys
+        cleaned_document_metadata = {}
+        responses = _fetch_metadata(
+            "documents", document_ids, extra_api_key, {"include": "attachments"}
+        )
+        for document_id, document in responses.items():
+            try:
+                document = document["data"]
+                cleaned_document_metadata[document_id] = {
+                    "document_id": document["id"],
+                    "original_document_id": document["attributes"]["originalDocumentId"],
+                    "document_type": document["attributes"]["documentType"],
+                    "subtype": document["attributes"]["subtype"],
+                    "docket_id": document["attributes"]["docketId"],
+                    "agency_id": document["attributes"]["agencyId"],
+                    "title": document["attributes"]["title"],
+                    "abstract": document["attributes"]["docAbstract"],
+                    "topics": document["attributes"]["topics"],
+                    "subject": document["attributes"]["subject"],
+                    "comment_start_date": document["attributes"]["commentStartDate"],
+                    "comment_end_date": document["attributes"]["commentEndDate"],
+                    "effective_date": document["attributes"]["effectiveDate"],
+                    "implementation_date": document["attributes"]["implementationDate"],
+                    "modified_date": document["attributes"]["modifyDate"],
+                    "open_for_comment": document["attributes"]["openForComment"],
+                    "allow_late_comments": document["attributes"]["allowLateComments"],
+                    "object_id": document["attributes"]["objectId"],
+                    "withdrawn": document["attributes"]["withdrawn"],
+                    "document_url": document["links"]["self"],
+                    "attachments": [
+                        file["fileUrl"]
+                        for file in document["attributes"].get("fileFormats", [])
+                        if "fileUrl" in file
+                    ]
+                    or None,
+                }
+            except:
+                print(f"Error in the document metadata for {document_id}")
+        return cleaned_document_metadata
+
+    return _cached_metadata("documents", document_ids, cache, fetch, "modified_date")
+
+
+# clean up html - list all the html characters that need to be changed and what they should be changed to
+HTML_ENTITIES = (
+    ("&amp;", "&"),
+    ("&gt;", ">"),
+    ("&lt;", "<"),
+    ("&nbsp;", " "),
+    ("&quot;", '"'),
+    ("&#39;", "'"),
+    ("&#34;", '"'),
+)
 
 
 def clean_string(input_string):
     """Remove NULL characters from a string."""
     if input_string is not None:
-        # clean up html - list all the html characters that need to be changed and what they should be changed to
-        html_chars = {
-            "&amp;": "&",
-            "&gt;": ">",
-            "&lt;": "<",
-            "&nbsp;": " ",
-            "&quot;": '"',
-            "&#39;": "'",
-            "&#34;": '"',
-            "nan": "",
-            "<br>": " ",
-            "<br/>": " ",
-            "\n": " ",
-            "\x00": "",
-        }
-        for key, value in html_chars.items():
-            input_string = input_string.replace(key, value)
-
-        input_string = input_string.replace("See Attached", "")
-        input_string = input_string.replace("See attached file(s)", "")
+        # The replacements have to run in this order, as one can make a match for the next
+        # (like "&amp;lt;br&amp;gt;"). Groups that can't match are skipped, which gives the
+        # same result without copying or scanning the string for nothing
+        if "&" in input_string:
+            for key, value in HTML_ENTITIES:
+                input_string = input_string.replace(key, value)
+        input_string = input_string.replace("nan", "")
+        if "<br" in input_string:
+            input_string = input_string.replace("<br>", " ").replace("<br/>", " ")
+        input_string = input_string.replace("\n", " ").replace("\x00", "")
+        if "See " in input_string:
+            input_string = input_string.replace("See Attached", "")
+            input_string = input_string.replace("See attached file(s)", "")
         input_string = html.unescape(input_string)
 
     return input_string
+
+
+# Only short values repeat between rows (the docket, the agency, a name), and only so many of them
+CLEAN_MEMO_MAX_LENGTH = 256
+CLEAN_MEMO_MAX_ENTRIES = 10000
+
+
+def clean_rows(rows, fields):
+    """Return copies of the dicts in `rows` with `fields` passed through clean_string.
+
+    Short values that repeat between rows (the docket, the agency, ...) are
+    only cleaned once. Fields a row doesn't have are left out, and values that
+    aren't strings (None, a list, a number) are left as they are.
+    """
+    cleaned = {}
+    output = []
+    for row in rows:
+        row = dict(row)
+        for field in fields:
+            value = row.get(field)
+            if not isinstance(value, str):
+                continue
+            if len(value) > CLEAN_MEMO_MAX_LENGTH:
+                row[field] = clean_string(value)
+                continue
+            result = cleaned.get(value)
+            if result is None:
+                if len(cleaned) >= CLEAN_MEMO_MAX_ENTRIES:
+                    cleaned.clear()
+                result = cleaned[value] = clean_string(value)
+            row[field] = result
+        output.append(row)
+    return output
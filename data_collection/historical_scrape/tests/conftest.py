@@ -0,0 +1,108 @@
+import os
+import uuid
+
+import psycopg2
+import pytest
+
+# A Postgres the tests can write to, never the production one. The tests that need it are
+# skipped without it
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# The tables the scrape writes to, with the columns of the INSERT statements of sql.py
+SCHEMA = """
+CREATE TABLE comments (
+    comment_id TEXT PRIMARY KEY,
+    docket_id TEXT,
+    agency_id TEXT,
+    title TEXT,
+    comment TEXT,
+    comment_pdf_extracted TEXT,
+    commenter_first_name TEXT,
+    commenter_last_name TEXT,
+    commenter_organization TEXT,
+    commenter_address1 TEXT,
+    commenter_address2 TEXT,
+    commenter_zip TEXT,
+    commenter_city TEXT,
+    commenter_state_province_region TEXT,
+    commenter_country TEXT,
+    commenter_email TEXT,
+    receive_date TEXT,
+    posted_date TEXT,
+    postmark_date TEXT,
+    duplicate_comments INTEGER,
+    attachment_read TEXT,
+    attachment_url TEXT,
+    withdrawn BOOLEAN,
+    api_url TEXT,
+    full_text TEXT,
+    document_id TEXT
+);
+CREATE TABLE dockets (
+    docket_id TEXT PRIMARY KEY,
+    agency_id TEXT,
+    title TEXT,
+    docket_type TEXT,
+    keywords TEXT[],
+    abstract TEXT,
+    category TEXT,
+    modify_date TEXT,
+    effective_date TEXT,
+    organization TEXT,
+    program TEXT,
+    rin TEXT,
+    object_id TEXT,
+    docket_url TEXT
+);
+CREATE TABLE documents (
+    document_id TEXT PRIMARY KEY,
+    original_document_id TEXT,
+    document_type TEXT,
+    subtype TEXT,
+    docket_id TEXT,
+    agency_id TEXT,
+    title TEXT,
+    abstract TEXT,
+    topics TEXT[],
+    subject TEXT,
+    comment_start_date TEXT,
+    comment_end_date TEXT,
+    effective_date TEXT,
+    implementation_date TEXT,
+    modified_date TEXT,
+    open_for_comment BOOLEAN,
+    allow_late_comment BOOLEAN,
+    object_id TEXT,
+    withdrawn BOOLEAN,
+    document_url TEXT,
+    attachments TEXT[]
+);
+CREATE TABLE status (
+    date TEXT,
+    data_date TEXT PRIMARY KEY,
+    number_of_comments INTEGER,
+    number_of_dockets INTEGER,
+    scrape_timestamp TEXT,
+    number_of_documents INTEGER
+);
+"""
+
+
+@pytest.fixture
+def conn():
+    """A connection to a schema of its own on `TEST_DATABASE_URL`, with the tables of the scrape."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    try:
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"Can't connect to TEST_DATABASE_URL: {e}")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    with conn, conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+        cur.execute(SCHEMA)
+    yield conn
+    conn.rollback()
+    with conn, conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA {schema} CASCADE;")
+    conn.close()
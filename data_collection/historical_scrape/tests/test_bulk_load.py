@@ -0,0 +1,149 @@
+"""bulk_upsert and the load_* functions against a real Postgres (see conftest.py)."""
+
+import psycopg2
+import pytest
+
+from jobs.historical_scrape.bulk_load import load_comments, load_dockets, load_documents
+from jobs.historical_scrape.near_duplicates import create_tables
+
+
+def comment(comment_id, text="I support this rule.", **fields):
+    # A structured comment as structure_data returns it, with its full text
+    item = {
+        "comment_id": comment_id,
+        "docket_id": "EPA-HQ-OAR-2021-0317",
+        "agency_id": "EPA",
+        "title": f"Comment from {comment_id}",
+        "comment": text,
+        "comment_pdf_extracted": "",
+        "posted_date": "2024-01-02T05:00:00Z",
+        "duplicate_comments": 0,
+        "attachment_read": "no attachment",
+        "withdrawn": False,
+        "document_id": "EPA-HQ-OAR-2021-0317-0001",
+        "full_text": text + " ",
+    }
+    item.update(fields)
+    return item
+
+
+def docket(docket_id, title):
+    return {
+        "docket_id": docket_id,
+        "agency_id": "EPA",
+        "title": title,
+        "docket_type": "Rulemaking",
+        "keywords": ["air", "methane"],
+        "abstract": None,
+        "category": None,
+        "modify_date": "2024-01-01T00:00:00Z",
+        "effective_date": None,
+        "organization": None,
+        "program": None,
+        "rin": None,
+        "object_id": "0b0000",
+        "docket_url": f"https://api.regulations.gov/v4/dockets/{docket_id}",
+    }
+
+
+def document(document_id, title):
+    return {
+        "document_id": document_id,
+        "original_document_id": None,
+        "document_type": "Proposed Rule",
+        "subtype": None,
+        "docket_id": "EPA-HQ-OAR-2021-0317",
+        "agency_id": "EPA",
+        "title": title,
+        "abstract": None,
+        "topics": None,
+        "subject": None,
+        "comment_start_date": None,
+        "comment_end_date": None,
+        "effective_date": None,
+        "implementation_date": None,
+        "modified_date": "2024-01-01T00:00:00Z",
+        "open_for_comment": True,
+        "allow_late_comments": False,
+        "object_id": "0900000",
+        "withdrawn": False,
+        "document_url": f"https://api.regulations.gov/v4/documents/{document_id}",
+        "attachments": ["https://downloads.regulations.gov/a.pdf"],
+    }
+
+
+def rows(conn, query):
+    with conn, conn.cursor() as cur:
+        cur.execute(query)
+        return cur.fetchall()
+
+
+@pytest.fixture
+def db(conn):
+    create_tables(conn)
+    return conn
+
+
+def test_load_comments_cleans_and_indexes(db):
+    loaded = load_comments(db, [comment("c1", "Fish &amp; Wildlife"), comment("c2", "")])
+    assert loaded == 2
+    assert rows(db, "SELECT comment_id, comment FROM comments ORDER BY 1") == [
+        ("c1", "Fish & Wildlife"),
+        ("c2", ""),
+    ]
+    assert rows(db, "SELECT comment_id, cluster_id FROM near_duplicates ORDER BY 1") == [
+        ("c1", "c1"),
+        ("c2", "c2"),
+    ]
+
+
+def test_load_comments_keeps_the_first_copy_and_the_stored_comment(db):
+    # The same comment twice in a batch: one upsert can't touch a row twice, the first one is kept
+    assert load_comments(db, [comment("c1", "first"), comment("c1", "second")]) == 1
+    assert rows(db, "SELECT comment FROM comments") == [("first",)]
+    # Without refresh, a comment already stored is left as it is
+    assert load_comments(db, [comment("c1", "third"), comment("c2")]) == 1
+    assert rows(db, "SELECT comment_id, comment FROM comments ORDER BY 1") == [
+        ("c1", "first"),
+        ("c2", "I support this rule."),
+    ]
+
+
+def test_load_comments_refresh_replaces_with_the_last_copy(db):
+    load_comments(db, [comment("c1", "first")])
+    assert load_comments(db, [comment("c1", "second"), comment("c1", "third")], refresh=True) == 1
+    assert rows(db, "SELECT comment, full_text FROM comments") == [("third", "third ")]
+    assert rows(db, "SELECT count(*) FROM near_duplicates") == [(1,)]
+
+
+def test_load_comments_is_one_transaction(db):
+    load_comments(db, [comment("c1")])
+    # A comment with no id fails the upsert, so the other comments of the batch aren't written
+    with pytest.raises(psycopg2.IntegrityError):
+        load_comments(db, [comment("c2"), comment(None)])
+    assert rows(db, "SELECT comment_id FROM comments") == [("c1",)]
+    # And a failure of the index undoes the upsert of the comments
+    with db, db.cursor() as cur:
+        cur.execute("DROP TABLE near_duplicate_buckets;")
+    with pytest.raises(psycopg2.ProgrammingError):
+        load_comments(db, [comment("c3", "A new comment with a few words in it")])
+    assert rows(db, "SELECT comment_id FROM comments") == [("c1",)]
+
+
+def test_load_dockets_and_documents_keep_the_last_copy(db):
+    assert load_dockets(db, [docket("D1", "old"), docket("D1", "new &amp; improved")]) == 1
+    assert load_dockets(db, [docket("D1", "newer"), docket("D2", "other")]) == 2
+    assert rows(db, "SELECT docket_id, title, keywords FROM dockets ORDER BY 1") == [
+        ("D1", "newer", ["air", "methane"]),
+        ("D2", "other", ["air", "methane"]),
+    ]
+    assert load_documents(db, [document("P1", "old"), document("P1", "new")]) == 1
+    assert load_documents(db, [document("P1", "newer")]) == 1
+    assert rows(db, "SELECT document_id, title, attachments FROM documents") == [
+        ("P1", "newer", ["https://downloads.regulations.gov/a.pdf"])
+    ]
+
+
+def test_load_nothing(db):
+    assert load_comments(db, []) == 0
+    assert load_dockets(db, []) == 0
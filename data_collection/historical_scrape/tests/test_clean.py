@@ -0,0 +1,122 @@
+"""clean_string and clean_rows give the same output as the old clean_string."""
+
+import html
+import random
+
+import pytest
+
+from jobs.historical_scrape.supporting_functions import (
+    CLEAN_MEMO_MAX_ENTRIES,
+    CLEAN_MEMO_MAX_LENGTH,
+    clean_rows,
+    clean_string,
+)
+
+# (input, expected output) of clean_string
+GOLDEN = [
+    (None, None),
+    ("", ""),
+    ("I support this rule.", "I support this rule."),
+    ("Fish &amp; Wildlife", "Fish & Wildlife"),
+    ("a &lt;b&gt; c", "a <b> c"),
+    ("one&nbsp;two", "one two"),
+    ("&quot;quoted&quot; &#39;single&#34;", "\"quoted\" 'single\""),
+    ("line one\nline two", "line one line two"),
+    ("first<br>second<br/>third", "first second third"),
+    ("null\x00byte", "nullbyte"),
+    ("nan", ""),
+    ("financial", "ficial"),
+    ("See Attached", ""),
+    ("Please See attached file(s).", "Please ."),
+    ("&eacute;t&eacute; &#8212; &copy;", "été — ©"),
+    # Replacements that make a new match for a later one
+    ("&amp;lt;br&amp;gt;", " "),
+    ("&lt;br/&gt;", " "),
+    ("na\x00n", "nan"),
+    ("See\nAttached", ""),
+    ("See&nbsp;Attached", ""),
+    ("See\x00 Attached", ""),
+    ("&amp;amp;", "&"),
+    ("<b\x00r>", "<br>"),
+]
+
+# Pieces of the replacements, so that random strings built from them make one replacement match another
+PIECES = [
+    "&", "amp;", "gt;", "lt;", "nbsp;", "quot;", "#39;", "#34;", "n", "a", "na", "nan",
+    "<", "br", ">", "/", "<br>", "\n", "\x00", "See", " ", "Attached", "attached file(s)",
+    "x", ";", "#", "&#", "eacute;",
+]
+
+
+def legacy_clean_string(input_string):
+    # clean_string before its replacements were grouped and skipped when they can't match
+    if input_string is not None:
+        html_chars = {
+            "&amp;": "&",
+            "&gt;": ">",
+            "&lt;": "<",
+            "&nbsp;": " ",
+            "&quot;": '"',
+            "&#39;": "'",
+            "&#34;": '"',
+            "nan": "",
+            "<br>": " ",
+            "<br/>": " ",
+            "\n": " ",
+            "\x00": "",
+        }
+        for key, value in html_chars.items():
+            input_string = input_string.replace(key, value)
+
+        input_string = input_string.replace("See Attached", "")
+        input_string = input_string.replace("See attached file(s)", "")
+        input_string = html.unescape(input_string)
+
+    return input_string
+
+
+@pytest.mark.parametrize("input_string, expected", GOLDEN)
+def test_golden(input_string, expected):
+    assert legacy_clean_string(input_string) == expected
+    assert clean_string(input_string) == expected
+
+
+def test_matches_legacy_on_random_strings():
+    rng = random.Random(0)
+    for _ in range(100000):
+        input_string = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 12)))
+        assert clean_string(input_string) == legacy_clean_string(input_string), repr(input_string)
+
+
+def test_clean_rows_matches_clean_string():
+    rng = random.Random(1)
+    rows = [
+        {
+            "docket_id": rng.choice(["EPA&amp;1", "nan-2", "See Attached"]),
+            "comment": "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 400))),
+            "title": None,
+        }
+        for _ in range(2000)
+    ]
+    fields = ["docket_id", "comment", "title", "missing"]
+    cleaned = clean_rows(rows, fields)
+    for row, result in zip(rows, cleaned):
+        assert result == {field: clean_string(value) for field, value in row.items()}
+    # The rows passed in are left as they were
+    assert rows[0] is not cleaned[0]
+
+
+def test_clean_rows_leaves_values_that_are_not_strings():
+    attachments = ["https://example.com/a.pdf&amp;"]
+    rows = [{"comment": attachments, "count": 3, "title": None, "docket_id": "a&amp;b"}]
+    cleaned = clean_rows(rows, ["comment", "count", "title", "docket_id"])
+    assert cleaned == [{"comment": attachments, "count": 3, "title": None, "docket_id": "a&b"}]
+
+
+def test_clean_rows_past_the_memo_limits():
+    # Long values and more distinct values than the memo holds are still cleaned
+    rows = [{"comment": "&amp;" * CLEAN_MEMO_MAX_LENGTH}]
+    rows += [{"comment": f"{i}&amp;"} for i in range(CLEAN_MEMO_MAX_ENTRIES + 10)]
+    cleaned = clean_rows(rows, ["comment"])
+    assert cleaned[0]["comment"] == "&" * CLEAN_MEMO_MAX_LENGTH
+    assert cleaned[-1]["comment"] == f"{CLEAN_MEMO_MAX_ENTRIES + 9}&"
@@ -0,0 +1,102 @@
+"""The high-water mark of docket_sync when comments can't be fetched."""
+
+import contextlib
+
+import pytest
+
+from jobs.historical_scrape import docket_sync
+
+
+def summary(index):
+    return {"id": f"c{index}", "attributes": {"lastModifiedDate": f"2024-01-01T00:00:0{index}Z"}}
+
+
+class FakeCache:
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def docket(monkeypatch):
+    """Six changed comments in chunks of 2, and the ids `get_comments` fails to fetch."""
+    summaries = [summary(index) for index in range(1, 7)]
+    missing = set()
+    calls = []
+
+    def changed_comments(docket_id, since=None, key_pool=None):
+        calls.append(since)
+        return [
+            comment
+            for comment in summaries
+            if since is None or comment["attributes"]["lastModifiedDate"] >= since
+        ]
+
+    def get_comments(ids, s3_client, bucket_name, key_pool=None):
+        return [{"data": {"id": comment_id}} for comment_id in ids if comment_id not in missing]
+
+    def structure_data(comments):
+        return [
+            {
+                "comment_id": comment["data"]["id"],
+                "comment": "text",
+                "comment_pdf_extracted": "",
+                "document_id": "d1",
+            }
+            for comment in comments
+        ]
+
+    monkeypatch.setattr(docket_sync, "CHUNK_SIZE", 2)
+    monkeypatch.setattr(docket_sync, "changed_comments", changed_comments)
+    monkeypatch.setattr(docket_sync, "get_comments", get_comments)
+    monkeypatch.setattr(docket_sync, "get_comment_text", lambda comments, cache, pool: comments)
+    monkeypatch.setattr(docket_sync, "structure_data", structure_data)
+    monkeypatch.setattr(docket_sync, "ExtractionCache", FakeCache)
+    monkeypatch.setattr(docket_sync, "ExtractionPool", contextlib.nullcontext)
+    return missing, calls
+
+
+def marks(docket_id="D-1"):
+    return [(len(rows), last_modified) for rows, last_modified in docket_sync.fetch_docket(docket_id)]
+
+
+def test_mark_follows_the_chunks(docket):
+    assert marks() == [(2, "2024-01-01T00:00:02Z"), (2, "2024-01-01T00:00:04Z"), (2, "2024-01-01T00:00:06Z")]
+
+
+def test_mark_stops_at_the_first_comment_not_fetched(docket):
+    missing, _ = docket
+    # c3 fails mid-way, c6 in a later chunk
+    missing.update({"c3", "c6"})
+    assert marks() == [(2, "2024-01-01T00:00:02Z"), (1, "2024-01-01T00:00:03Z"), (1, "2024-01-01T00:00:03Z")]
+
+
+def test_mark_within_a_chunk(docket):
+    missing, _ = docket
+    missing.add("c4")
+    assert marks()[1:] == [(1, "2024-01-01T00:00:04Z"), (2, "2024-01-01T00:00:04Z")]
+
+
+def test_sync_asks_again_from_the_comment_not_fetched(docket, conn, monkeypatch):
+    missing, calls = docket
+    loaded = []
+    monkeypatch.setattr(docket_sync, "load_comments", lambda conn, rows, refresh: loaded.extend(rows))
+    monkeypatch.setattr(docket_sync, "get_dockets", lambda dockets: [])
+    monkeypatch.setattr(docket_sync, "load_dockets", lambda conn, rows: None)
+    monkeypatch.setattr(docket_sync, "get_documents", lambda documents: [])
+    monkeypatch.setattr(docket_sync, "load_documents", lambda conn, rows: None)
+
+    missing.add("c3")
+    assert docket_sync.sync_docket(conn, "D-1") == 5
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_modified FROM docket_sync WHERE docket_id = 'D-1'")
+        assert cur.fetchone()[0] == "2024-01-01T00:00:03Z"
+
+    # The next sync starts at c3, and once it is fetched the mark moves to the end
+    missing.clear()
+    loaded.clear()
+    assert docket_sync.sync_docket(conn, "D-1") == 4
+    assert calls == [None, "2024-01-01T00:00:03Z"]
+    assert [row["comment_id"] for row in loaded] == ["c3", "c4", "c5", "c6"]
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_modified FROM docket_sync WHERE docket_id = 'D-1'")
+        assert cur.fetchone()[0] == "2024-01-01T00:00:06Z"
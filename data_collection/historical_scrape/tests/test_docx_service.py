@@ -0,0 +1,57 @@
+"""docx_to_text on a document with a text box."""
+
+import zipfile
+from io import BytesIO
+
+from jobs.historical_scrape.docx_service import docx_to_text
+
+DOCUMENT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+    xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006"
+    xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape"
+    xmlns:v="urn:schemas-microsoft-com:vml">
+  <w:body>
+    <w:p><w:r><w:t>Dear Secretary,</w:t></w:r></w:p>
+    <w:p>
+      <w:r><w:t>I oppose</w:t><w:tab/><w:t>the rule.</w:t></w:r>
+      <w:r>
+        <mc:AlternateContent>
+          <mc:Choice Requires="wps">
+            <wps:txbx><w:txbxContent>
+              <w:p><w:r><w:t>Text box line one</w:t><w:br/><w:t>and two</w:t></w:r></w:p>
+              <w:p><w:r><w:t>Text box paragraph two</w:t></w:r></w:p>
+            </w:txbxContent></wps:txbx>
+          </mc:Choice>
+          <mc:Fallback>
+            <v:textbox><w:txbxContent>
+              <w:p><w:r><w:t>Text box line one</w:t><w:br/><w:t>and two</w:t></w:r></w:p>
+              <w:p><w:r><w:t>Text box paragraph two</w:t></w:r></w:p>
+            </w:txbxContent></v:textbox>
+          </mc:Fallback>
+        </mc:AlternateContent>
+      </w:r>
+      <w:r><w:t xml:space="preserve"> Thank you.</w:t></w:r>
+    </w:p>
+    <w:p/>
+  </w:body>
+</w:document>
+"""
+
+
+def docx(document):
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def test_text_box_is_read_once():
+    assert docx_to_text(docx(DOCUMENT)) == "\n \n" + "\n".join(
+        [
+            "Dear Secretary,",
+            "I oppose\tthe rule. Thank you.",
+            "Text box line one\nand two",
+            "Text box paragraph two",
+            "",
+        ]
+    )
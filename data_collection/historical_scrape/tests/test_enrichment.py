@@ -0,0 +1,109 @@
+"""enrich_comments against stub_model_server.py."""
+
+import asyncio
+
+import pytest
+
+from jobs.historical_scrape import enrichment
+from jobs.historical_scrape.enrichment import enrich_comments
+from jobs.historical_scrape.llm_providers import make_provider
+from jobs.historical_scrape.stub_model_server import start_stub_model_server
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(**kwargs):
+        server = start_stub_model_server(latency=kwargs.pop("latency", 0.01), **kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def provider(server, name="gemini"):
+    # The limiter of the provider lets everything through, so that only the server limits
+    return make_provider(
+        name,
+        api_url=f"http://127.0.0.1:{server.server_port}",
+        requests_per_minute=100000,
+        tokens_per_minute=10**9,
+    )
+
+
+def enrich(provider, comments, **kwargs):
+    # Runs enrich_comments on `comments` in chunks of 10, and returns (results, stats)
+    results = {}
+
+    async def chunks():
+        for start in range(0, len(comments), 10):
+            yield comments[start : start + 10]
+
+    async def on_result(comment_id, fields):
+        assert comment_id not in results
+        results[comment_id] = fields
+
+    stats = asyncio.run(enrich_comments(chunks(), provider, on_result, **kwargs))
+    return results, stats
+
+
+def comments(count):
+    return [(f"c{i}", f"Write to user{i}@example.com about comment {i}. I oppose the rule.") for i in range(count)]
+
+
+@pytest.mark.parametrize("name", ["anthropic", "openai", "gemini"])
+def test_every_comment_is_enriched(start_server, name):
+    server = start_server()
+    results, stats = enrich(provider(server, name), comments(40), concurrency=4, pack_size=5)
+    assert sorted(results) == sorted(comment_id for comment_id, _ in comments(40))
+    assert results["c7"]["ai_email"] == "user7@example.com"
+    assert results["c7"]["ai_summary"] == "Write to user7@example.com about comment 7"
+    assert stats["failed"] == 0 and stats["retried"] == 0
+    # Packed 5 to a prompt
+    assert stats["requests"] == server.models.requests == 8
+
+
+def test_broken_answers_are_asked_again(start_server):
+    server = start_server(broken=0.3)
+    results, stats = enrich(provider(server), comments(60), concurrency=4, pack_size=4)
+    assert stats["retried"] > 0
+    assert len(results) + stats["failed"] == 60
+    assert all(fields["ai_summary"] for fields in results.values())
+
+
+def test_rate_limited_requests_are_sent_again(start_server):
+    # 3 requests a second: the other workers get 429 and wait for the Retry-After
+    server = start_server(requests_per_minute=3, window=1)
+    p = provider(server)
+    results, stats = enrich(p, comments(8), concurrency=4, pack_size=1)
+    assert len(results) == 8
+    assert p.limiter.throttled > 0
+    assert server.models.requests > stats["requests"] == 8
+    assert stats["failed"] == stats["retried"] == 0
+
+
+def test_copies_in_flight_wait_for_the_first(start_server):
+    server = start_server(latency=0.2)
+    letter = "I urge the agency to withdraw this rule. It will cost jobs in my town."
+    campaign = [(f"c{i}", letter + " " * (i % 3)) for i in range(10)]
+    results, stats = enrich(provider(server), campaign, concurrency=4, pack_size=1)
+    assert sorted(results) == sorted(comment_id for comment_id, _ in campaign)
+    assert stats["requests"] == server.models.requests == 1
+    assert stats["copies"] == 9
+    assert len({fields["ai_summary"] for fields in results.values()}) == 1
+
+
+def test_gives_up_after_max_attempts(start_server):
+    # Every answer comes back cut short
+    server = start_server(broken=1.0)
+    letter = "I urge the agency to withdraw this rule."
+    results, stats = enrich(
+        provider(server), [("c0", "A comment. " + letter), ("c1", letter), ("c2", letter)], pack_size=1
+    )
+    assert results == {}
+    assert stats["failed"] == 3
+    # The copy c2 isn't sent, and the others are asked MAX_ATTEMPTS times
+    assert stats["requests"] == server.models.requests == 2 * enrichment.MAX_ATTEMPTS
@@ -0,0 +1,75 @@
+"""Which failures fetch_comments retries, and how long it waits before."""
+
+import asyncio
+
+import aiohttp
+import pytest
+from yarl import URL
+
+from jobs.historical_scrape import fetcher
+from jobs.historical_scrape.key_pool import KeyPool
+
+
+def http_error(status):
+    url = URL(f"{fetcher.API_URL}/comments/c1")
+    request_info = aiohttp.RequestInfo(url, "GET", {}, url)
+    return aiohttp.ClientResponseError(request_info, (), status=status, message="error")
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """The failures each comment id gets before it is fetched, and the ids asked for."""
+    failures = {}
+    calls = []
+    delays = []
+    sleep = asyncio.sleep
+
+    async def fetch_comment(session, comment_id, key_pool):
+        calls.append(comment_id)
+        if failures.get(comment_id):
+            raise failures[comment_id].pop(0)
+        return {"data": {"id": comment_id}}
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(fetcher, "_fetch_comment", fetch_comment)
+    monkeypatch.setattr(fetcher.asyncio, "sleep", record_sleep)
+    return failures, calls, delays
+
+
+def fetch(ids):
+    return asyncio.run(fetcher.fetch_comments(ids, KeyPool({"a": "key-a"}), max_connections=1))
+
+
+def test_client_errors_are_not_retried(responses):
+    failures, calls, delays = responses
+    failures.update({"c1": [http_error(404)], "c2": [http_error(400)]})
+    assert fetch(["c1", "c2", "c3"]) == [{"data": {"id": "c3"}}]
+    assert sorted(calls) == ["c1", "c2", "c3"]
+    assert delays == []
+
+
+def test_server_errors_back_off(responses):
+    failures, calls, delays = responses
+    failures["c1"] = [http_error(503), aiohttp.ClientConnectionError(), http_error(500)]
+    assert fetch(["c1"]) == [{"data": {"id": "c1"}}]
+    assert calls == ["c1"] * 4
+    assert delays == [fetcher.RETRY_DELAY, fetcher.RETRY_DELAY * 2, fetcher.RETRY_DELAY * 4]
+
+
+def test_429_is_retried_without_waiting(responses):
+    # The key pool parks the key for its Retry-After instead
+    failures, calls, delays = responses
+    failures["c1"] = [http_error(429), http_error(429)]
+    assert fetch(["c1"]) == [{"data": {"id": "c1"}}]
+    assert calls == ["c1"] * 3
+    assert delays == []
+
+
+def test_gives_up_after_max_attempts(responses):
+    failures, calls, _ = responses
+    failures["c1"] = [http_error(502)] * fetcher.MAX_ATTEMPTS
+    assert fetch(["c1", "c2"]) == [{"data": {"id": "c2"}}]
+    assert calls.count("c1") == fetcher.MAX_ATTEMPTS
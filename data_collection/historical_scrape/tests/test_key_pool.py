@@ -0,0 +1,91 @@
+"""KeyPool's token buckets, parking and Retry-After, on a fake clock."""
+
+import pytest
+
+from jobs.historical_scrape import key_pool
+from jobs.historical_scrape.key_pool import WINDOW_SECONDS, KeyPool, retry_after
+
+
+class Clock:
+    """time.monotonic and time.sleep for key_pool, where sleeping moves the clock on."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(key_pool.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(key_pool.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    # One request a second once the burst of 2 is spent
+    pool = KeyPool({"a": "key-a"}, limit=WINDOW_SECONDS, burst=2)
+    for _ in range(4):
+        pool.update(pool.acquire(), 200)
+    assert clock.sleeps == [pytest.approx(1.0), pytest.approx(1.0)]
+    assert pool.usage()["a"]["successes"] == 4
+
+
+def test_most_remaining_first(clock):
+    pool = KeyPool({"a": "key-a", "b": "key-b"})
+    pool.update(pool.keys["a"], 200, {"X-RateLimit-Remaining": "10"})
+    pool.update(pool.keys["b"], 200, {"X-RateLimit-Remaining": "500"})
+    assert pool.acquire().name == "b"
+
+
+def test_429_parks_for_retry_after(clock):
+    pool = KeyPool({"a": "key-a", "b": "key-b"})
+    a = pool.keys["a"]
+    a.in_flight += 1
+    pool.update(a, 429, {"Retry-After": "30"})
+    assert pool.usage()["a"]["parked_for"] == pytest.approx(30)
+    # The other key takes the requests meanwhile
+    assert {pool.acquire().name for _ in range(5)} == {"b"}
+    assert clock.sleeps == []
+
+
+def test_parked_key_comes_back_with_its_budget(clock):
+    pool = KeyPool({"a": "key-a"}, limit=1000)
+    pool.update(pool.acquire(), 429, {"Retry-After": "30"})
+    key = pool.acquire()
+    assert clock.sleeps == [pytest.approx(30)]
+    assert key.remaining == 1000
+    assert pool.usage()["a"]["throttled"] == 1
+
+
+def test_out_of_budget_parks_for_the_window(clock):
+    pool = KeyPool({"a": "key-a"})
+    pool.update(pool.acquire(), 200, {"X-RateLimit-Remaining": "0"})
+    assert pool.usage()["a"]["parked_for"] == pytest.approx(WINDOW_SECONDS)
+
+
+def test_malformed_headers_are_ignored(clock):
+    pool = KeyPool({"a": "key-a"}, limit=1000)
+    key = pool.acquire()
+    pool.update(key, 200, {"X-RateLimit-Remaining": "", "X-RateLimit-Limit": "lots", "Retry-After": "soon"})
+    assert key.in_flight == 0
+    assert (key.remaining, key.limit) == (1000, 1000)
+    key = pool.acquire()
+    pool.update(key, 429, {"X-RateLimit-Remaining": "1.5", "Retry-After": "soon"})
+    assert key.in_flight == 0
+    assert pool.usage()["a"]["parked_for"] == pytest.approx(WINDOW_SECONDS)
+
+
+def test_retry_after():
+    assert retry_after("12", 60) == 12.0
+    assert retry_after("-3", 60) == 0.0
+    assert retry_after("Wed, 21 Oct 2015 07:28:00 GMT", 60) == 0.0
+    assert retry_after("", 60) == 60
+    assert retry_after("later", 60) == 60
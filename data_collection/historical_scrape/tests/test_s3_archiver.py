@@ -0,0 +1,90 @@
+"""S3Archiver against a moto S3: everything queued lands, and reads back with replay.decode."""
+
+import threading
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from jobs.historical_scrape.replay import decode
+from jobs.historical_scrape.s3_archiver import S3Archiver, raw_comment_key
+
+BUCKET_NAME = "commons-docs"
+
+
+def response(i):
+    comment_id = f"EPA-HQ-OAR-2021-0317-{i:04d}"
+    return comment_id, {"data": {"id": comment_id, "attributes": {"comment": f"Comment {i} &amp; more"}}}
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET_NAME)
+        yield client
+
+
+def objects(s3_client, prefix):
+    pages = s3_client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix)
+    return {
+        obj["Key"]: s3_client.get_object(Bucket=BUCKET_NAME, Key=obj["Key"])["Body"].read()
+        for page in pages
+        for obj in page.get("Contents", [])
+    }
+
+
+def test_one_object_per_comment(s3_client):
+    with S3Archiver(s3_client, BUCKET_NAME, workers=4, queue_size=10) as archiver:
+        for i in range(100):
+            archiver.put(*response(i))
+    assert archiver.uploaded == 100 and archiver.failed == 0
+    stored = objects(s3_client, "data/raw/")
+    assert len(stored) == 100
+    comment_id, result = response(7)
+    assert decode(raw_comment_key(comment_id), stored[raw_comment_key(comment_id)]) == [result]
+
+
+def test_shards_from_several_threads(s3_client):
+    archiver = S3Archiver(s3_client, BUCKET_NAME, workers=4, shard_prefix="data/shards/2024-01-02", shard_size=30)
+
+    def put(start):
+        for i in range(start, start + 25):
+            archiver.put(*response(i))
+
+    threads = [threading.Thread(target=put, args=(start,)) for start in range(0, 100, 25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The last shard, of 10 comments, is only written on close
+    assert len(objects(s3_client, "data/shards/")) <= 3
+    archiver.close()
+
+    stored = objects(s3_client, "data/shards/")
+    assert sorted(stored) == [f"data/shards/2024-01-02/part-{i:05d}.jsonl.gz" for i in range(4)]
+    results = [result for key, body in stored.items() for result in decode(key, body)]
+    assert sorted(results, key=lambda result: result["data"]["id"]) == [response(i)[1] for i in range(100)]
+    assert archiver.uploaded == 4 and archiver.failed == 0
+
+
+class FlakyClient:
+    # Fails the uploads of some keys, like S3 answering 500 or the connection dropping
+    def __init__(self, client, fail):
+        self.client = client
+        self.fail = fail
+
+    def put_object(self, **kwargs):
+        if self.fail(kwargs["Key"]):
+            raise ConnectionError(f"Could not upload {kwargs['Key']}")
+        return self.client.put_object(**kwargs)
+
+
+def test_failed_uploads_are_counted(s3_client):
+    client = FlakyClient(s3_client, lambda key: key.endswith(("3.json", "7.json")))
+    with S3Archiver(client, BUCKET_NAME, workers=4) as archiver:
+        for i in range(50):
+            archiver.put(*response(i))
+    assert archiver.failed == 10
+    assert archiver.uploaded == 40
+    assert len(objects(s3_client, "data/raw/")) == 40
@@ -0,0 +1,104 @@
+"""Reading the answers of the model, and asking again for the invalid ones."""
+
+import asyncio
+import json
+
+from jobs.historical_scrape.enrichment import enrich_comments
+from jobs.historical_scrape.structured_output import read_packed, read_single, repair_json
+
+SUMMARY = "Opposes the rule."
+
+
+def test_fenced_answer():
+    fields, error = read_single(f'```json\n{{"ai_summary": "{SUMMARY}", "ai_city": "Boston"}}\n```')
+    assert error is None
+    assert fields["ai_summary"] == SUMMARY
+    assert fields["ai_city"] == "Boston"
+
+
+def test_python_literals_outside_strings():
+    text = '{"ai_summary": "He said: None, of this matters.", "ai_phone": None, "ai_email": False}'
+    assert json.loads(repair_json(text)) == {
+        "ai_summary": "He said: None, of this matters.",
+        "ai_phone": None,
+        "ai_email": False,
+    }
+
+
+def test_trailing_comma_outside_strings_only():
+    text = '{"ai_summary": "Keeps a, } and a ,] as written", "ai_city": "Boston",}'
+    assert json.loads(repair_json(text)) == {
+        "ai_summary": "Keeps a, } and a ,] as written",
+        "ai_city": "Boston",
+    }
+
+
+def test_python_dict():
+    fields, error = read_single("{'ai_summary': 'Hello there', 'ai_phone': None}")
+    assert error is None
+    assert fields["ai_summary"] == "Hello there"
+    assert fields["ai_phone"] is None
+
+
+def test_concatenated_objects():
+    text = f'{{"id": 0, "ai_summary": "{SUMMARY}"}}\n{{"id": 1, "ai_summary": "Supports the rule."}}'
+    # One comment can't have two answers
+    assert read_single(text) == (None, "the answer is several JSON objects instead of one")
+    # The entries of a packed answer carry their id
+    results, errors = read_packed(text, 2)
+    assert errors == {}
+    assert [results[index]["ai_summary"] for index in (0, 1)] == [SUMMARY, "Supports the rule."]
+
+
+def test_truncated_packed_answer():
+    entries = ",\n".join(f'{{"id": {index}, "ai_summary": "Summary {index}."}}' for index in range(3))
+    text = f'{{"comments": [\n{entries},\n{{"id": 3, "ai_summary": "Summ'
+    results, errors = read_packed(text, 5)
+    assert sorted(results) == [0, 1, 2]
+    assert errors == {index: "the answer has no entry for this comment" for index in (3, 4)}
+
+
+class ScriptedProvider:
+    """Answers with `answers` in order, and keeps the prompts it was sent."""
+
+    model = "scripted"
+    max_output_tokens = 4096
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.prompts = []
+
+    async def complete(self, session, system, user, max_tokens):
+        self.prompts.append(user)
+        return self.answers.pop(0)
+
+
+def test_invalid_answers_are_asked_again_together():
+    comments = [(f"c{index}", f"Comment number {index}, against the rule.") for index in range(3)]
+    provider = ScriptedProvider(
+        [
+            # No entry for c1, and a summary too short for c2
+            json.dumps({"comments": [{"id": 0, "ai_summary": SUMMARY}, {"id": 2, "ai_summary": ""}]}),
+            json.dumps({"comments": [{"id": 0, "ai_summary": "Summary one."}, {"id": 1, "ai_summary": "Summary two."}]}),
+        ]
+    )
+    results = {}
+
+    async def chunks():
+        yield comments
+
+    async def on_result(comment_id, fields):
+        results[comment_id] = fields["ai_summary"]
+
+    stats = asyncio.run(enrich_comments(chunks(), provider, on_result, concurrency=1, pack_size=3))
+
+    assert results == {"c0": SUMMARY, "c1": "Summary one.", "c2": "Summary two."}
+    assert stats["requests"] == 2
+    assert stats["retried"] == 2
+    reask = provider.prompts[1]
+    assert reask.startswith("Your last answers for these comments were not valid. Correct them.\n")
+    assert "- comment 0: the answer has no entry for this comment\n" in reask
+    assert "- comment 1: ai_summary: String should have at least 5 characters" in reask
+    assert '<comment id="0">\nComment number 1, against the rule.\n</comment>' in reask
+    assert '<comment id="1">\nComment number 2, against the rule.\n</comment>' in reask
+    assert '<comment id="2">' not in reask
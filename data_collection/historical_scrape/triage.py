@@ -0,0 +1,101 @@
+# Tell the comments worth sending to the LLM from the ones with nothing in them to extract
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The notebooks count a comment as substantial from 20 characters of full text
+MIN_CHARS: int = 20
+# Fewer words than this ("I oppose this", "Jane Doe, Ohio") leave nothing for the ai_* fields
+# beyond what the commenter fields of the API already hold
+MIN_WORDS: int = 4
+# Share of the tokens that must look like words. Below it, the text is extraction debris
+MIN_WORD_RATIO: float = 0.5
+
+# Text that says nothing by itself. clean_string already removes "See Attached" and
+# "See attached file(s)", which leaves the rest of the sentence behind
+BOILERPLATE_RE = (
+    r"(?i)\b(please\s+)?(see|refer\s+to|find)\s+(the\s+)?attach(ed|ment|ments)\b"
+    r"(\s+(file|files|letter|document|comments?)\b)?"
+    r"|\b(comment|comments|letter)\s+attached\b"
+    r"|\bsee\s+(the\s+)?(file|files|letter|document)\b"
+    r"|\battached(\s+(file|files|letter|document|comments?))?\s*[.:!]*\s*$"
+)
+# Short answers that only count as boilerplate when they are all there is
+WHOLE_BOILERPLATE_RE = (
+    r"(?i)^\W*(please|thank\s+you|thanks|n/?a|none|test(ing)?|no\s+comments?|comment|attachment)\W*$"
+)
+WORD_RE = r"\pL{2,}"
+TOKEN_RE = r"\S+"
+
+# The reasons a comment is left out, in the order they are checked
+EMPTY = "empty"
+BOILERPLATE = "boilerplate"
+GARBLED = "garbled"
+TOO_SHORT = "too short"
+# The comment says nothing, and its attachment gave no text: it is probably a scan
+NEEDS_OCR = "attachment needs ocr"
+# The reasons that hold whatever happens to the attachments. The others can change once an
+# attachment is extracted again or read with OCR, so those comments are triaged again then
+FINAL = (EMPTY, BOILERPLATE)
+
+
+def _ratio(numerator, denominator):
+    return pc.divide(pc.cast(numerator, pa.float64()), pc.max_element_wise(denominator, 1))
+
+
+def triage(full_text, attachment_read):
+    """Score comments on what there is in them to extract.
+
+    `full_text` and `attachment_read` are the columns of the comments, as lists
+    or Arrow arrays. Every check runs over a whole column at once. Returns a
+    dict of Arrow arrays with one value per comment:
+
+    - `reason`: null for a substantive comment, or why it isn't one (see the
+      constants above)
+    - `chars` and `words`: the characters and words left once boilerplate
+      like "Please see attached" is taken out
+    - `boilerplate_ratio`: the share of the characters that were boilerplate
+    """
+    text = pc.fill_null(pa.array(full_text, type=pa.string()), "")
+    attachment_read = pc.fill_null(pa.array(attachment_read, type=pa.string()), "")
+
+    total_chars = pc.utf8_length(pc.utf8_trim_whitespace(text))
+    content = pc.utf8_trim_whitespace(pc.replace_substring_regex(text, BOILERPLATE_RE, ""))
+    content = pc.replace_substring_regex(content, WHOLE_BOILERPLATE_RE, "")
+    content = pc.replace_substring_regex(content, r"\s+", " ")
+    chars = pc.utf8_length(content)
+    words = pc.count_substring_regex(content, WORD_RE)
+    tokens = pc.count_substring_regex(content, TOKEN_RE)
+    word_ratio = _ratio(words, tokens)
+    boilerplate_ratio = pc.subtract(1, _ratio(chars, total_chars))
+
+    empty = pc.equal(total_chars, 0)
+    garbled = pc.and_(pc.greater(tokens, 0), pc.less(word_ratio, MIN_WORD_RATIO))
+    boilerplate = pc.and_(pc.equal(words, 0), pc.greater(total_chars, 0))
+    too_short = pc.or_(pc.less(chars, MIN_CHARS), pc.less(words, MIN_WORDS))
+    unreadable = pc.is_in(attachment_read, pa.array(["attachment extracted", "attachment failed"]))
+
+    reason = pc.case_when(
+        pc.make_struct(
+            pc.and_(unreadable, pc.or_(pc.or_(empty, boilerplate), pc.or_(garbled, too_short))),
+            empty,
+            boilerplate,
+            garbled,
+            too_short,
+        ),
+        NEEDS_OCR,
+        EMPTY,
+        BOILERPLATE,
+        GARBLED,
+        TOO_SHORT,
+    )
+    return {
+        "reason": reason,
+        "chars": chars,
+        "words": words,
+        "boilerplate_ratio": pc.if_else(empty, 0.0, boilerplate_ratio),
+    }
+
+
+def reasons(full_text, attachment_read):
+    """Return the list of the reasons the comments are trivial, None for the substantive ones."""
+    return triage(full_text, attachment_read)["reason"].to_pylist()